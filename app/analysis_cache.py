@@ -0,0 +1,221 @@
+"""
+段落解析キャッシュ - 段落テキストと辞書の組ごとにMeCabの解析結果を保持
+一部だけ修正されたテキストを再インポートする際、変更された段落のみを再解析する
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, List, Tuple, Dict, Any
+
+from .tokens import Token
+
+# キャッシュの1項目: 段落のトークンリスト
+CachedTokens = List[Token]
+
+# デフォルト設定
+DEFAULT_MAX_ENTRIES = 20000              # メモリ上に保持する最大段落数
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024    # メモリ使用量の上限（概算）
+DEFAULT_MAX_DISK_ENTRIES = 500000        # ディスク上に保持する最大段落数
+DISK_BATCH_SIZE = 256                    # ディスクへまとめて書き込む項目数
+DISK_PRUNE_INTERVAL = 1000               # この回数の書き込みごとにディスクを整理
+
+# トークン1つあたりのオブジェクトのオーバーヘッド（概算、バイト）
+# 特徴タプルは同一語彙のトークン間で共有されるため、トークン本体と参照分のみを見積もる
+_TOKEN_OVERHEAD = 120
+
+
+def paragraph_key(content: str, dictionary: str) -> str:
+    """段落テキストと辞書からキャッシュキーを計算"""
+    combined = f"{content}|{dictionary}"
+    return hashlib.sha256(combined.encode('utf-8')).hexdigest()
+
+
+def _estimate_size(tokens: CachedTokens) -> int:
+    """キャッシュ項目のメモリ使用量を概算"""
+    return sum(_TOKEN_OVERHEAD + 2 * len(token.surface) for token in tokens)
+
+
+class AnalysisCache:
+    """
+    段落単位の解析結果LRUキャッシュ
+
+    項目数とメモリ使用量（概算）の両方で上限を設け、超過時は最も古く
+    使われた項目から破棄する。path を指定するとSQLiteファイルにも保存し、
+    再起動後もメモリにない項目をディスクから読み込む。
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES,
+                 max_bytes: Optional[int] = DEFAULT_MAX_BYTES,
+                 path: Optional[str] = None,
+                 max_disk_entries: int = DEFAULT_MAX_DISK_ENTRIES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.path = path
+        self.max_disk_entries = max_disk_entries
+
+        self._entries: "OrderedDict[str, Tuple[CachedTokens, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._disk_conn: Optional[sqlite3.Connection] = None
+        self._disk_writes = 0
+        # ディスク未反映の書き込みと最終使用時刻（flush でまとめて反映）
+        self._pending: Dict[str, str] = {}
+        self._touched: Dict[str, float] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+
+    # ===== ディスク保存 =====
+
+    def _get_disk(self) -> Optional[sqlite3.Connection]:
+        """ディスクキャッシュの接続を取得（初回使用時に作成）"""
+        if not self.path:
+            return None
+        if self._disk_conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            # 失っても再解析すれば済むデータのため、耐障害性より書き込み速度を優先
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS paragraph_cache (
+                    key TEXT PRIMARY KEY,
+                    tokens TEXT NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_cache_last_used ON paragraph_cache(last_used)')
+            conn.commit()
+            self._disk_conn = conn
+        return self._disk_conn
+
+    def _disk_get(self, key: str) -> Optional[CachedTokens]:
+        conn = self._get_disk()
+        if conn is None:
+            return None
+        data = self._pending.get(key)
+        if data is None:
+            row = conn.execute('SELECT tokens FROM paragraph_cache WHERE key = ?', (key,)).fetchone()
+            if not row:
+                return None
+            data = row[0]
+        self._touched[key] = time.time()
+        if len(self._touched) >= DISK_BATCH_SIZE:
+            self._flush()
+        return [Token.from_features(surface, features) for surface, features in json.loads(data)]
+
+    def _disk_put(self, key: str, tokens: CachedTokens) -> None:
+        if not self.path:
+            return
+        self._pending[key] = json.dumps([(t.surface, t.features) for t in tokens], ensure_ascii=False)
+        if len(self._pending) >= DISK_BATCH_SIZE:
+            self._flush()
+
+    def _flush(self) -> None:
+        """未反映の書き込みを1トランザクションでディスクに反映"""
+        conn = self._get_disk()
+        if conn is None or not (self._pending or self._touched):
+            return
+        now = time.time()
+        with conn:
+            conn.executemany('''
+                INSERT OR REPLACE INTO paragraph_cache (key, tokens, last_used) VALUES (?, ?, ?)
+            ''', [(key, data, now) for key, data in self._pending.items()])
+            conn.executemany('UPDATE paragraph_cache SET last_used = ? WHERE key = ?',
+                             [(used, key) for key, used in self._touched.items()])
+
+            # 上限を超えた古い項目を定期的に削除
+            previous = self._disk_writes
+            self._disk_writes += len(self._pending)
+            if self._disk_writes // DISK_PRUNE_INTERVAL != previous // DISK_PRUNE_INTERVAL:
+                conn.execute('''
+                    DELETE FROM paragraph_cache WHERE key IN (
+                        SELECT key FROM paragraph_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                    )
+                ''', (self.max_disk_entries,))
+        self._pending.clear()
+        self._touched.clear()
+
+    def flush(self) -> None:
+        """ディスク未反映の項目を書き込む"""
+        with self._lock:
+            self._flush()
+
+    # ===== メモリ上のLRU =====
+
+    def _remember(self, key: str, tokens: CachedTokens) -> None:
+        """メモリに項目を追加し、上限を超えた分を古い順に破棄"""
+        if key in self._entries:
+            self._bytes -= self._entries.pop(key)[1]
+        size = _estimate_size(tokens)
+        self._entries[key] = (tokens, size)
+        self._bytes += size
+
+        while self._entries and (len(self._entries) > self.max_entries or
+                                 (self.max_bytes is not None and self._bytes > self.max_bytes)):
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self.evictions += 1
+
+    def get(self, content: str, dictionary: str) -> Optional[CachedTokens]:
+        """キャッシュされた解析結果を取得（なければ None）"""
+        key = paragraph_key(content, dictionary)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+            tokens = self._disk_get(key)
+            if tokens is not None:
+                self._remember(key, tokens)
+                self.hits += 1
+                self.disk_hits += 1
+                return tokens
+
+            self.misses += 1
+            return None
+
+    def put(self, content: str, dictionary: str, tokens: CachedTokens) -> None:
+        """解析結果をキャッシュに保存"""
+        key = paragraph_key(content, dictionary)
+        with self._lock:
+            self._remember(key, tokens)
+            self._disk_put(key, tokens)
+
+    def clear(self) -> None:
+        """メモリとディスクのキャッシュを全て削除し、統計をリセット"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._pending.clear()
+            self._touched.clear()
+            conn = self._get_disk()
+            if conn is not None:
+                conn.execute('DELETE FROM paragraph_cache')
+                conn.commit()
+            self.hits = self.misses = self.disk_hits = self.evictions = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """ヒット数・ミス数などの統計情報を取得"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'disk_hits': self.disk_hits,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'persistent': bool(self.path)
+            }
@@ -1,10 +1,21 @@
 """
 MeCab解析モジュール - fugashiを用いた日本語分かち書きと意味解析
 """
+import atexit
 import os
 import re
-from typing import List, Dict, Any, Optional
-from fugashi import GenericTagger
+import threading
+import time
+from typing import List, Dict, Any, Iterable, Iterator, Optional, TYPE_CHECKING
+
+# fugashi（MeCab）は最初のtagger作成時に読み込む（起動時間短縮のため）
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
+    from fugashi import GenericTagger
+
+from .analysis_cache import AnalysisCache
+from .tokens import Token, POS_COLORS, FEATURE_COUNT, sentence_spans
+from .tagger_pool import TaggerPool, TaggerPoolTimeout, DEFAULT_POOL_SIZE, DEFAULT_POOL_TIMEOUT
 
 # プロジェクトルートディレクトリ
 PROJECT_ROOT = os.path.dirname(os.path.dirname(__file__))
@@ -13,6 +24,10 @@ PROJECT_ROOT = os.path.dirname(os.path.dirname(__file__))
 DEFAULT_MECABRC = os.path.join(PROJECT_ROOT, "mecab", "mecabrc")
 DEFAULT_DICTIONARY_DIR = os.path.join(PROJECT_ROOT, "mecab", "dic")
 
+# 並列解析の設定
+DEFAULT_BATCH_SIZE = 32          # 1回でワーカーに送る最大段落数
+PARALLEL_MIN_PARAGRAPHS = 64     # これ未満の段落数では逐次解析する
+
 # 利用可能な辞書リスト
 AVAILABLE_DICTIONARIES = {
 
@@ -58,33 +73,42 @@ UNIDIC_FEATURE_LABELS = {
     20: "語彙素細分類",    # 語彙素細分類
 }
 
-# 品詞カラーマッピング（フロントエンドのハイライト用）
-POS_COLORS = {
-    "名詞": "#4A90D9",       # 青
-    "動詞": "#E74C3C",       # 赤
-    "形容詞": "#27AE60",     # 緑
-    "形状詞": "#2ECC71",     # 淡緑
-    "副詞": "#9B59B6",       # 紫
-    "連体詞": "#F39C12",     # オレンジ
-    "接続詞": "#1ABC9C",     # シアン
-    "感動詞": "#E91E63",     # ピンク
-    "助詞": "#95A5A6",       # グレー
-    "助動詞": "#7F8C8D",     # 濃いグレー
-    "接頭辞": "#3498DB",     # 淡青
-    "接尾辞": "#2980B9",     # 濃青
-    "記号": "#BDC3C7",       # 淡いグレー
-    "補助記号": "#BDC3C7",   # 淡いグレー
-    "空白": "#ECF0F1",       # 白グレー
-}
+# プロセス内taggerキャッシュ（単一スレッドで使う場合用：並列解析のワーカーやスクリプト）
+_tagger_cache: Dict[str, "GenericTagger"] = {}
 
-# グローバルtaggerキャッシュ
-_tagger_cache: Dict[str, GenericTagger] = {}
+# 辞書ごとのtaggerプール（Flaskのリクエストスレッド間で共有）
+_tagger_pools: Dict[str, TaggerPool] = {}
+_tagger_pools_lock = threading.Lock()
+_pool_options = {"size": DEFAULT_POOL_SIZE, "timeout": DEFAULT_POOL_TIMEOUT}
 
+# 並列解析のプロセスプール（最初の並列解析で作成し、プロセス終了まで全リクエストで共有）
+_process_pool: Optional["ProcessPoolExecutor"] = None
+_process_pool_workers = 0
+_process_pool_lock = threading.Lock()
 
-def get_tagger(dictionary: str = "unidic-chuko") -> GenericTagger:
-    """既存または新規のMeCab taggerインスタンスを取得"""
-    if dictionary in _tagger_cache:
-        return _tagger_cache[dictionary]
+
+# 段落単位の解析キャッシュ
+_analysis_cache = AnalysisCache()
+
+
+def configure_cache(**options) -> AnalysisCache:
+    """
+    段落解析キャッシュを設定し直す
+    options は AnalysisCache の引数（max_entries, max_bytes, path, max_disk_entries）
+    """
+    global _analysis_cache
+    _analysis_cache = AnalysisCache(**options)
+    return _analysis_cache
+
+
+def get_analysis_cache() -> AnalysisCache:
+    """現在の段落解析キャッシュを取得"""
+    return _analysis_cache
+
+
+def create_tagger(dictionary: str = "unidic-chuko") -> "GenericTagger":
+    """指定辞書の新しいMeCab taggerインスタンスを作成"""
+    from fugashi import GenericTagger
     
     if dictionary not in AVAILABLE_DICTIONARIES:
         raise ValueError(f"不明な辞書: {dictionary}. 利用可能な辞書: {list(AVAILABLE_DICTIONARIES.keys())}")
@@ -97,12 +121,72 @@ def get_tagger(dictionary: str = "unidic-chuko") -> GenericTagger:
     # MeCabパラメータを構築
     mecab_args = f'-r "{DEFAULT_MECABRC}" -d "{dict_path}"'
     
-    tagger = GenericTagger(mecab_args)
+    return GenericTagger(mecab_args)
+
+
+def get_tagger(dictionary: str = "unidic-chuko") -> "GenericTagger":
+    """
+    既存または新規のMeCab taggerインスタンスを取得
+    同じインスタンスを返すため、複数スレッドから使う場合は tagger_pool を使うこと
+    """
+    if dictionary in _tagger_cache:
+        return _tagger_cache[dictionary]
+    
+    tagger = create_tagger(dictionary)
     _tagger_cache[dictionary] = tagger
     
     return tagger
 
 
+def configure_tagger_pools(size: int = DEFAULT_POOL_SIZE,
+                           timeout: Optional[float] = DEFAULT_POOL_TIMEOUT) -> None:
+    """taggerプールのサイズと待ち時間を設定（既存のプールは破棄される）"""
+    with _tagger_pools_lock:
+        _pool_options.update(size=size, timeout=timeout)
+        _tagger_pools.clear()
+
+
+def get_tagger_pool(dictionary: str = "unidic-chuko") -> TaggerPool:
+    """指定辞書のtaggerプールを取得"""
+    if dictionary not in AVAILABLE_DICTIONARIES:
+        raise ValueError(f"不明な辞書: {dictionary}. 利用可能な辞書: {list(AVAILABLE_DICTIONARIES.keys())}")
+    
+    with _tagger_pools_lock:
+        pool = _tagger_pools.get(dictionary)
+        if pool is None:
+            pool = TaggerPool(lambda: create_tagger(dictionary), **_pool_options)
+            _tagger_pools[dictionary] = pool
+        return pool
+
+
+def warm_up(dictionaries: Iterable[str]) -> Dict[str, float]:
+    """
+    指定辞書のtaggerを事前に読み込み、短い文で一度解析しておく
+    最初の解析リクエストが辞書の読み込み時間を負担しないようにするために使う
+    
+    Returns:
+        辞書ごとの所要秒数（読み込みに失敗した辞書は含まない）
+    """
+    timings = {}
+    for dictionary in dictionaries:
+        start = time.perf_counter()
+        try:
+            with get_tagger_pool(dictionary).checkout() as tagger:
+                tagger("春はあけぼの。")
+        except (ValueError, FileNotFoundError) as e:
+            print(f"辞書の事前読み込みに失敗: {dictionary}: {e}")
+            continue
+        timings[dictionary] = time.perf_counter() - start
+    return timings
+
+
+def get_pool_stats() -> Dict[str, Dict[str, Any]]:
+    """辞書ごとのtaggerプール使用状況を取得"""
+    with _tagger_pools_lock:
+        pools = dict(_tagger_pools)
+    return {dictionary: pool.stats() for dictionary, pool in pools.items()}
+
+
 def split_paragraphs(text: str) -> List[str]:
     """
     テキストを段落に分割
@@ -124,68 +208,291 @@ def split_paragraphs(text: str) -> List[str]:
     return paragraphs
 
 
-def analyze_text(text: str, dictionary: str = "unidic-chuko") -> List[Dict[str, Any]]:
+def _extract_features(word) -> List[str]:
+    """fugashiの単語ノードから25要素の特徴リストを取得"""
+    # fugashiのfeatureはタプルまたはNamedTupleとして取得
+    if hasattr(word, 'feature') and word.feature:
+        if hasattr(word.feature, '__iter__'):
+            # Noneを空文字列にし、UniDicの25フィールドに揃える
+            features = [str(val) if val is not None else "" for val in tuple(word.feature)[:FEATURE_COUNT]]
+        else:
+            # 文字列として返された場合のフォールバック（引号と括弧を削除）
+            feature_raw = str(word.feature).split(',')[:FEATURE_COUNT]
+            features = [val.strip().strip("('").strip("')") for val in feature_raw]
+        features.extend([""] * (FEATURE_COUNT - len(features)))
+        return features
+    
+    return [""] * FEATURE_COUNT
+
+
+def make_token(surface: str, features: List[str]) -> Token:
     """
-    テキストを解析し、段落とトークンの解析結果を返す
+    表層形と特徴リストからトークンを構築
+    品詞・読みなどの名前付きフィールドは Token のプロパティとして参照できる
+    """
+    return Token.from_features(surface, features)
+
+
+def make_paragraph(para_content: str, tokens: List[Token]) -> Dict[str, Any]:
+    """
+    段落データを作成（文・文節の境界インデックスを付ける）
+    sentences / clauses は各文・文節のトークン範囲 [開始, 終了) のリスト
+    """
+    return {
+        "content": para_content,
+        "tokens": tokens,
+        "sentences": sentence_spans(tokens),
+        "clauses": sentence_spans(tokens, clauses=True)
+    }
+
+
+def analyze_paragraph(tagger: "GenericTagger", para_content: str) -> Dict[str, Any]:
+    """1段落を解析し、段落データを返す"""
+    return make_paragraph(
+        para_content, [make_token(word.surface, _extract_features(word)) for word in tagger(para_content)])
+
+
+def _analyze_batch(dictionary: str, batch: List[str]) -> List[Dict[str, Any]]:
+    """
+    ワーカープロセスで段落のバッチを解析
+    taggerはプロセスごとに get_tagger のキャッシュで一度だけ読み込まれる
     """
     tagger = get_tagger(dictionary)
-    paragraphs = split_paragraphs(text)
+    return [analyze_paragraph(tagger, para_content) for para_content in batch]
+
+
+def _make_batches(items: List[Any], workers: int, batch_size: int) -> List[List[Any]]:
+    """段落（またはそのインデックス）のリストを順序を保ったままバッチに分割"""
+    # 小さな文書でも全ワーカーに仕事が行き渡るようにバッチを縮める
+    size = max(1, min(batch_size, -(-len(items) // (workers * 4))))
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def _init_worker(dictionaries: List[str]) -> None:
+    """ワーカープロセスの初期化：指定辞書のtaggerを先に読み込んでおく"""
+    for dictionary in dictionaries:
+        try:
+            get_tagger(dictionary)
+        except (ValueError, FileNotFoundError):
+            pass    # 読み込めない辞書は解析時にエラーとして返る
+
+
+def _worker_ready() -> bool:
+    return True
+
+
+def get_process_pool(workers: int, preload: Iterable[str] = ()) -> "ProcessPoolExecutor":
+    """
+    並列解析の共有プロセスプールを取得
+    初回に作成して使い回し、ワーカー数が足りない時とプールが壊れた時（ワーカーの異常終了）だけ作り直す
+    （呼び出しごとにワーカー数が違っても作り直しを繰り返さないよう、プールは大きい方に合わせる）。
+    preload は新しく作る場合に各ワーカーが起動時に読み込む辞書
+    """
+    global _process_pool, _process_pool_workers
+    from concurrent.futures import ProcessPoolExecutor
+    
+    with _process_pool_lock:
+        pool = _process_pool
+        if pool is not None and (_process_pool_workers < workers or getattr(pool, "_broken", False)):
+            # 古いプールに投入済みの解析はそのまま最後まで実行される
+            pool.shutdown(wait=False)
+            workers = max(workers, _process_pool_workers)
+            pool = None
+        if pool is None:
+            pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                       initargs=(list(preload),))
+            _process_pool, _process_pool_workers = pool, workers
+        return pool
+
+
+def start_process_pool(workers: int, dictionaries: Iterable[str]) -> None:
+    """共有プロセスプールを作成して全ワーカーを起動し、辞書を読み込ませておく（起動時の事前読み込み用）"""
+    pool = get_process_pool(workers, dictionaries)
+    for future in [pool.submit(_worker_ready) for _ in range(workers)]:
+        future.result()
+
+
+@atexit.register
+def shutdown_process_pool() -> None:
+    """共有プロセスプールを終了（プロセス終了時に自動で呼ばれる）"""
+    global _process_pool, _process_pool_workers
+    with _process_pool_lock:
+        pool, _process_pool, _process_pool_workers = _process_pool, None, 0
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def iter_analyze_paragraphs_parallel(paragraphs: List[str], dictionary: str = "unidic-chuko",
+                                     workers: Optional[int] = None,
+                                     batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[Dict[str, Any]]:
+    """
+    段落リストを共有プロセスプールで並列解析し、元の段落順で1段落ずつ返す
+    各ワーカーは指定辞書のtaggerを一度だけ読み込み、以降の解析でも使い回す
+    """
+    workers = workers or os.cpu_count() or 1
     
-    results = []
+    # 辞書の検証はワーカーに送る前に親プロセスで行う
+    if dictionary not in AVAILABLE_DICTIONARIES:
+        raise ValueError(f"不明な辞書: {dictionary}. 利用可能な辞書: {list(AVAILABLE_DICTIONARIES.keys())}")
     
+    batches = _make_batches(paragraphs, workers, batch_size)
+    executor = get_process_pool(workers, [dictionary])
+    # executor.map は投入順に結果を返すため段落順が保たれる
+    # （途中で閉じられた場合、まだ始まっていないバッチは取り消される）
+    for batch_result in executor.map(_analyze_batch, [dictionary] * len(batches), batches):
+        yield from batch_result
+
+
+def analyze_paragraphs_parallel(paragraphs: List[str], dictionary: str = "unidic-chuko",
+                                workers: Optional[int] = None,
+                                batch_size: int = DEFAULT_BATCH_SIZE) -> List[Dict[str, Any]]:
+    """段落リストをプロセスプールで並列解析し、結果を元の段落順で返す"""
+    return list(iter_analyze_paragraphs_parallel(paragraphs, dictionary, workers, batch_size))
+
+
+def _iter_analyze_pooled(paragraphs: List[str], dictionary: str) -> Iterator[Dict[str, Any]]:
+    """プールから借りたtaggerで段落を逐次解析（段落ごとに貸し出し・返却する）"""
+    pool = get_tagger_pool(dictionary)
     for para_content in paragraphs:
-        tokens = []
-        
-        for word in tagger(para_content):
-            # 全ての特徴を取得
-            features = []
+        with pool.checkout() as tagger:
+            result = analyze_paragraph(tagger, para_content)
+        yield result
+
+
+def iter_analyze_text(text: str, dictionary: str = "unidic-chuko",
+                      workers: Optional[int] = None,
+                      use_cache: bool = True) -> Iterator[Dict[str, Any]]:
+    """
+    テキストを解析し、段落の解析結果を1段落ずつ返すジェネレータ
+    全段落をメモリに保持せずに保存・送信したい場合に使用する
+    
+    Args:
+        text: 解析対象のテキスト
+        dictionary: 使用する辞書
+        workers: 並列解析のワーカー数（None または 1 以下で逐次解析）
+        use_cache: 段落解析キャッシュを使用するか
+    """
+    paragraphs = split_paragraphs(text)
+    cache = _analysis_cache if use_cache else None
+    
+    # 先にキャッシュを引き、MeCabに渡すのは未解析の段落だけにする
+    cached = [cache.get(p, dictionary) if cache else None for p in paragraphs]
+    missing = [p for p, hit in zip(paragraphs, cached) if hit is None]
+    
+    # 段落数が少ない場合はプロセス起動のコストが上回るため逐次解析
+    if workers and workers > 1 and len(missing) >= PARALLEL_MIN_PARAGRAPHS:
+        fresh = iter_analyze_paragraphs_parallel(missing, dictionary, workers)
+    elif missing:
+        fresh = _iter_analyze_pooled(missing, dictionary)
+    else:
+        fresh = iter(())
+    
+    try:
+        for para_content, hit in zip(paragraphs, cached):
+            if hit is not None:
+                yield make_paragraph(para_content, list(hit))
+                continue
+            
+            result = next(fresh)
+            if cache:
+                cache.put(para_content, dictionary, list(result["tokens"]))
+            yield result
+    finally:
+        if cache:
+            cache.flush()
+
+
+def analyze_text(text: str, dictionary: str = "unidic-chuko",
+                 workers: Optional[int] = None,
+                 use_cache: bool = True) -> List[Dict[str, Any]]:
+    """
+    テキストを解析し、段落とトークンの解析結果を返す
+    
+    Args:
+        text: 解析対象のテキスト
+        dictionary: 使用する辞書
+        workers: 並列解析のワーカー数（None または 1 以下で逐次解析）
+        use_cache: 段落解析キャッシュを使用するか
+    """
+    return list(iter_analyze_text(text, dictionary, workers, use_cache))
+
+
+def analyze_text_multi(text: str, dictionaries: List[str],
+                       workers: Optional[int] = None,
+                       use_cache: bool = True) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    同じテキストを複数の辞書で解析し、辞書ごとの段落リストを返す
+    段落分割は全辞書で共有するため、各辞書の結果は段落インデックスで対応する。
+    未解析の段落がある辞書が2つ以上なら、段落数にかかわらず全辞書のバッチを共有プロセスプールに投入して
+    同時に解析する（ワーカー数が1以下でも辞書の数だけのワーカーを使う）。CPUコアが辞書の数以上あれば、
+    所要時間は最も遅い辞書の解析時間に近くなる。辞書が1つだけなら iter_analyze_text と同じ基準で逐次解析する。
+    
+    Args:
+        text: 解析対象のテキスト
+        dictionaries: 使用する辞書のリスト
+        workers: 並列解析のワーカー数（None または 1 以下で辞書ごとに1ワーカー）
+        use_cache: 段落解析キャッシュを使用するか
+    """
+    for dictionary in dictionaries:
+        if dictionary not in AVAILABLE_DICTIONARIES:
+            raise ValueError(f"不明な辞書: {dictionary}. 利用可能な辞書: {list(AVAILABLE_DICTIONARIES.keys())}")
+    
+    paragraphs = split_paragraphs(text)
+    cache = _analysis_cache if use_cache else None
+    results: Dict[str, List[Optional[Dict[str, Any]]]] = {}
+    missing: Dict[str, List[int]] = {}
+    
+    # 辞書ごとにキャッシュを引き、未解析の段落インデックスを集める
+    for dictionary in dictionaries:
+        layer = results[dictionary] = [None] * len(paragraphs)
+        for index, para_content in enumerate(paragraphs):
+            hit = cache.get(para_content, dictionary) if cache else None
+            if hit is not None:
+                layer[index] = make_paragraph(para_content, list(hit))
+        indices = [i for i, para in enumerate(layer) if para is None]
+        if indices:
+            missing[dictionary] = indices
+    
+    def store(dictionary: str, indices: List[int], analyzed: List[Dict[str, Any]]) -> None:
+        for index, para in zip(indices, analyzed):
+            results[dictionary][index] = para
+            if cache:
+                cache.put(para["content"], dictionary, list(para["tokens"]))
+    
+    try:
+        # プロセスプールは使い回すので、辞書が複数なら段落数が少なくても起動のコストはかからない
+        # （MeCab は解析中 GIL を保持するので、スレッドでは辞書を同時に解析できない）
+        if len(missing) > 1 or (workers and workers > 1 and
+                                sum(map(len, missing.values())) >= PARALLEL_MIN_PARAGRAPHS):
+            from concurrent.futures import as_completed
             
-            # fugashiのfeatureはタプルまたはNamedTupleとして取得
-            if hasattr(word, 'feature') and word.feature:
-                # タプルとして直接アクセス
-                if hasattr(word.feature, '__iter__'):
-                    feature_tuple = tuple(word.feature) if not isinstance(word.feature, tuple) else word.feature
-                    for i in range(25):  # UniDicは通常20以上のフィールドを持つ
-                        if i < len(feature_tuple):
-                            val = feature_tuple[i]
-                            # Noneや空文字列を適切に処理
-                            features.append(str(val) if val is not None else "")
-                        else:
-                            features.append("")
-                else:
-                    # 文字列として返された場合のフォールバック
-                    feature_raw = str(word.feature).split(',')
-                    for i in range(25):
-                        if i < len(feature_raw):
-                            # 引号と括弧を削除
-                            val = feature_raw[i].strip().strip("('").strip("')")
-                            features.append(val)
-                        else:
-                            features.append("")
-            else:
-                features = [""] * 25
+            workers = workers if workers and workers > 1 else len(missing)
+            # 各辞書の未解析段落をバッチに分け、全辞書分を同じプールに投入する
+            tasks = []
+            for dictionary, indices in missing.items():
+                for batch in _make_batches(indices, workers, DEFAULT_BATCH_SIZE):
+                    tasks.append((dictionary, batch))
             
-            token_data = {
-                "surface": word.surface,  # 表層形
-                "features": features,
-                "pos": features[0] if features else "",  # 品詞
-                "pos_detail": features[1] if len(features) > 1 else "",  # 品詞細分
-                "conjugation_type": features[4] if len(features) > 4 else "",  # 活用型
-                "conjugation_form": features[5] if len(features) > 5 else "",  # 活用形
-                "reading": features[8] if len(features) > 8 else "",  # 読み
-                "base_form": features[9] if len(features) > 9 else "",  # 基本形
-                "kana": features[11] if len(features) > 11 else "",  # 仮名
-                "origin": features[12] if len(features) > 12 else "",  # 語種
-                "taigen_yougen": features[19] if len(features) > 19 else "",  # 体言/用言
-                "color": POS_COLORS.get(features[0], "#333333") if features else "#333333"
+            executor = get_process_pool(workers, dictionaries)
+            futures = {
+                executor.submit(_analyze_batch, dictionary, [paragraphs[i] for i in batch]): (dictionary, batch)
+                for dictionary, batch in tasks
             }
-            
-            tokens.append(token_data)
-        
-        results.append({
-            "content": para_content,
-            "tokens": tokens
-        })
+            try:
+                for future in as_completed(futures):
+                    dictionary, batch = futures[future]
+                    store(dictionary, batch, future.result())
+            finally:
+                # 失敗した場合、まだ始まっていないバッチは共有プールに残さない
+                for future in futures:
+                    future.cancel()
+        else:
+            for dictionary, indices in missing.items():
+                store(dictionary, indices,
+                      list(_iter_analyze_pooled([paragraphs[i] for i in indices], dictionary)))
+    finally:
+        if cache:
+            cache.flush()
     
     return results
 
@@ -1,29 +1,79 @@
 """
 Flaskメインアプリ - Project Komachi 日本語意味解析プラットフォーム
 """
+import csv
+import io
+import itertools
 import os
-from flask import Flask, render_template, request, jsonify, send_from_directory
+import json
+import socket
+import threading
+import time
+from flask import Flask, Response, render_template, request, jsonify, send_from_directory, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 
 from werkzeug.utils import secure_filename
 
 from . import analyzer
+from . import connections
+from . import corpus
 from . import database
 from . import document_manager
+from . import jobs
+from . import textfile
+from .tokens import Token
+
+
+class KomachiJSONProvider(DefaultJSONProvider):
+    """Token オブジェクトをシリアライズできるJSONプロバイダ"""
+    
+    @staticmethod
+    def default(o):
+        if isinstance(o, Token):
+            return o.to_dict()
+        return DefaultJSONProvider.default(o)
 
 # Flaskアプリを作成
 app = Flask(__name__, 
             template_folder=os.path.join(os.path.dirname(__file__), 'templates'),
             static_folder=os.path.join(os.path.dirname(__file__), 'static'))
 
+app.json = KomachiJSONProvider(app)
+
 app.config['SECRET_KEY'] = 'komachi-secret-key-change-in-production'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 最大16MB
+# 大きなテキストを並列解析する際のワーカープロセス数（1で逐次解析）
+app.config['ANALYZE_WORKERS'] = int(os.environ.get('KOMACHI_ANALYZE_WORKERS', os.cpu_count() or 1))
+# 段落解析キャッシュの保存先（空文字列でメモリのみ）
+app.config['ANALYSIS_CACHE_PATH'] = os.environ.get(
+    'KOMACHI_ANALYSIS_CACHE', os.path.join(document_manager.DATA_DIR, 'analysis_cache.db'))
+
+# 辞書ごとのtaggerプール（同時に解析できるリクエスト数と、空きを待つ秒数）
+app.config['TAGGER_POOL_SIZE'] = int(os.environ.get('KOMACHI_TAGGER_POOL_SIZE', analyzer.DEFAULT_POOL_SIZE))
+app.config['TAGGER_POOL_TIMEOUT'] = float(os.environ.get('KOMACHI_TAGGER_POOL_TIMEOUT', analyzer.DEFAULT_POOL_TIMEOUT))
+
+# サーバー起動後にバックグラウンドで読み込んでおく辞書（カンマ区切り、all で全辞書）
+app.config['WARMUP_DICTIONARIES'] = [
+    d.strip() for d in os.environ.get('KOMACHI_WARMUP', '').split(',') if d.strip()]
+
+# インポートジョブのキュー（SQLite）と、run.py が起動するワーカープロセス数
+app.config['JOBS_PATH'] = os.environ.get('KOMACHI_JOBS_DB', jobs.JOBS_PATH)
+app.config['JOB_WORKERS'] = int(os.environ.get('KOMACHI_JOB_WORKERS', 1))
+
+# SQLite 接続プールに保持する待機接続の上限（省略時はファイルディスクリプタの上限から決める）
+app.config['DB_MAX_IDLE_CONNECTIONS'] = int(os.environ.get('KOMACHI_DB_MAX_IDLE', 0)) or None
+
+analyzer.configure_cache(path=app.config['ANALYSIS_CACHE_PATH'] or None)
+if app.config['DB_MAX_IDLE_CONNECTIONS']:
+    connections.configure(app.config['DB_MAX_IDLE_CONNECTIONS'])
+analyzer.configure_tagger_pools(app.config['TAGGER_POOL_SIZE'], app.config['TAGGER_POOL_TIMEOUT'])
 
 # 許可されたファイル拡張子
-ALLOWED_EXTENSIONS = {'txt', 'text'}
+ALLOWED_EXTENSIONS = textfile.TEXT_EXTENSIONS
 
 
 def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    return textfile.is_text_file(filename)
 
 
 def get_stats():
@@ -36,6 +86,150 @@ def get_stats():
     }
 
 
+def ndjson_line(event: dict) -> str:
+    """ストリーミング応答の1行（NDJSON）を生成"""
+    return json.dumps(event, ensure_ascii=False) + '\n'
+
+
+def paragraph_event(index: int, para: dict) -> str:
+    """段落1つ分のストリーミングイベントを生成"""
+    return ndjson_line({
+        'type': 'paragraph',
+        'index': index,
+        'paragraph': {
+            'content': para['content'],
+            'tokens': [t.to_dict() for t in para['tokens']],
+            'sentences': para.get('sentences', []),
+            'clauses': para.get('clauses', [])
+        }
+    })
+
+
+def stream_analysis(document: dict, cached: bool, paragraphs) -> Response:
+    """
+    解析結果を NDJSON としてストリーミング送信
+    1行目に文書情報、続いて段落ごとに1行、最後に完了イベントを送る
+    """
+    def generate():
+        yield ndjson_line({'type': 'document', 'cached': cached, 'document': document})
+        
+        paragraph_count = 0
+        token_count = 0
+        try:
+            for index, para in enumerate(paragraphs):
+                paragraph_count += 1
+                token_count += len(para['tokens'])
+                yield paragraph_event(index, para)
+        except Exception as e:
+            yield ndjson_line({'type': 'error', 'error': str(e)})
+            return
+        
+        yield ndjson_line({
+            'type': 'done',
+            'document_id': document['id'],
+            'paragraph_count': paragraph_count,
+            'token_count': token_count
+        })
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+def stream_existing(document: dict) -> Response:
+    """解析済みの文書を NDJSON でストリーミング送信"""
+    paragraphs = document.pop('paragraphs', [])
+    document.pop('content', None)
+    return stream_analysis(document, True, paragraphs)
+
+
+def stream_import(title: str, content: str, dictionary: str,
+                  tags: list = None, metadata: dict = None) -> Response:
+    """
+    原文を先に登録し、解析した段落を逐次保存しながらストリーミング送信する
+    最初の段落は応答を返す前に解析・保存するので、taggerプールの待ち時間切れなどは
+    呼び出し側でエラー応答にできる（失敗した文書は iter_save_paragraphs が削除する）。
+    同じテキストを別のリクエストが保存中の場合は DocumentExists（in_progress）を送出する。
+    """
+    try:
+        doc_id = document_manager.create_document(title, content, dictionary, tags, metadata)
+    except document_manager.DocumentExists as e:
+        if e.in_progress:
+            raise
+        # 確認した後に別のリクエストが保存を終えていた
+        return stream_existing(document_manager.get_document(e.doc_id))
+    
+    document = {'id': doc_id, 'title': title, 'dictionary': dictionary}
+    paragraphs = document_manager.iter_save_paragraphs(
+        doc_id, analyzer.iter_analyze_text(content, dictionary, workers=app.config['ANALYZE_WORKERS']))
+    first = next(paragraphs, None)
+    if first is not None:
+        paragraphs = itertools.chain([first], paragraphs)
+    return stream_analysis(document, False, paragraphs)
+
+
+def start_warm_up(host: str = '127.0.0.1', port: int = 5000,
+                  timeout: float = 30.0):
+    """
+    サーバーが接続を受け付け始めた後、バックグラウンドで事前準備を行う
+    データベースを初期化し、旧データベース（data/komachi.db）が残っていれば文書ライブラリへ移行して、
+    WARMUP_DICTIONARIES の辞書を読み込んでおく（ANALYZE_WORKERS が2以上なら並列解析のワーカーも起動して読み込ませる）。
+    移行に失敗してもエラーを表示して辞書の読み込みは続ける（旧データベースは残るので次回の起動で再び移行する）。
+    最後に、旧版のライブラリで新しく作られた索引を既存の文書について補建する（document_manager.backfill_indexes）。
+    """
+    dictionaries = app.config['WARMUP_DICTIONARIES']
+    if 'all' in dictionaries:
+        dictionaries = list(analyzer.get_available_dictionaries())
+    
+    def run():
+        # 起動処理を遅らせないよう、ポートが開くまで待ってから始める
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection((host, port), timeout=0.5).close()
+                break
+            except OSError:
+                time.sleep(0.05)
+        
+        document_manager.ensure_registry()
+        if database.legacy_database_exists():
+            try:
+                stats = database.migrate_to_library()
+            except Exception as e:
+                import traceback
+                traceback.print_exc()
+                print(f"  旧データベースの移行に失敗: {e}（{database.DATABASE_PATH} は残してあります）")
+            else:
+                print(f"  旧データベースをライブラリへ移行: {stats['migrated']} 件"
+                      f"（重複 {stats['duplicates']} 件, {stats['seconds']:.1f}秒）"
+                      f" 旧ファイルは {stats['backup']} に改名")
+        timings = analyzer.warm_up(dictionaries)
+        for dictionary, seconds in timings.items():
+            print(f"  辞書を事前読み込み: {dictionary} ({seconds:.2f}秒)")
+        workers = app.config['ANALYZE_WORKERS']
+        if timings and workers > 1:
+            start = time.perf_counter()
+            analyzer.start_process_pool(workers, list(timings))
+            print(f"  並列解析のワーカーを起動: {workers} 個 ({time.perf_counter() - start:.2f}秒)")
+        if document_manager.backfill_pending():
+            try:
+                stats = document_manager.backfill_indexes()
+            except Exception as e:
+                import traceback
+                traceback.print_exc()
+                print(f"  索引の補建に失敗: {e}（次回の起動で続きから補建します）")
+            else:
+                print(f"  既存の文書の索引を補建: {stats['documents']} 件 ({stats['seconds']:.1f}秒)")
+    
+    thread = threading.Thread(target=run, name='komachi-warm-up', daemon=True)
+    thread.start()
+    return thread
+
+
+def start_job_workers() -> list:
+    """インポートジョブのワーカープロセスを起動（JOB_WORKERS 個、0 なら起動しない）"""
+    return jobs.start_workers(app.config['JOB_WORKERS'], app.config['JOBS_PATH'],
+                              app.config['ANALYSIS_CACHE_PATH'] or None)
+
+
 # ===== 页面路由 =====
 
 @app.route('/')
@@ -50,7 +244,7 @@ def index():
 def analyzer_page():
     """テキスト解析ページ"""
     dictionaries = analyzer.get_available_dictionaries()
-    documents = database.list_documents()
+    documents = document_manager.list_documents()
     return render_template('index.html', dictionaries=dictionaries, documents=documents)
 
 
@@ -110,7 +304,7 @@ def api_analyze():
             return jsonify({'error': '解析するテキストを入力してください'}), 400
         
         # キャッシュがあるか確認
-        existing = database.check_existing_analysis(text, dictionary)
+        existing = document_manager.check_existing_analysis(text, dictionary)
         if existing:
             return jsonify({
                 'success': True,
@@ -119,13 +313,13 @@ def api_analyze():
             })
         
         # 解析を実行
-        paragraphs = analyzer.analyze_text(text, dictionary)
+        paragraphs = analyzer.analyze_text(text, dictionary, workers=app.config['ANALYZE_WORKERS'])
         
-        # データベースに保存
-        doc_id = database.save_document(title, text, dictionary, paragraphs)
+        # 文書ライブラリに保存
+        doc_id = document_manager.save_document(title, text, dictionary, paragraphs)
         
         # 完全なドキュメントを取得
-        document = database.get_document_with_analysis(doc_id)
+        document = document_manager.get_document(doc_id)
         
         return jsonify({
             'success': True,
@@ -133,6 +327,39 @@ def api_analyze():
             'document': document
         })
         
+    except document_manager.DocumentExists as e:
+        return jsonify({'error': str(e), 'document_id': e.doc_id}), 409
+    except analyzer.TaggerPoolTimeout as e:
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/analyze/stream', methods=['POST'])
+def api_analyze_stream():
+    """テキスト解析API（段落ごとに NDJSON でストリーミング）"""
+    try:
+        data = request.get_json()
+        text = data.get('text', '').strip()
+        title = data.get('title', '名称未設定').strip()
+        dictionary = data.get('dictionary', 'unidic-chuko')
+        
+        if not text:
+            return jsonify({'error': '解析するテキストを入力してください'}), 400
+        if dictionary not in analyzer.AVAILABLE_DICTIONARIES:
+            return jsonify({'error': f'不明な辞書: {dictionary}'}), 400
+        
+        # キャッシュがあるか確認
+        existing = document_manager.check_existing_analysis(text, dictionary)
+        if existing:
+            return stream_existing(existing)
+        
+        return stream_import(title, text, dictionary)
+        
+    except document_manager.DocumentExists as e:
+        return jsonify({'error': str(e), 'document_id': e.doc_id}), 409
+    except analyzer.TaggerPoolTimeout as e:
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -156,13 +383,7 @@ def api_upload():
         content = file.read()
         
         # 異なるエンコーディングを試行
-        text = None
-        for encoding in ['utf-8', 'utf-8-sig', 'shift_jis', 'euc-jp', 'cp932', 'iso-2022-jp']:
-            try:
-                text = content.decode(encoding)
-                break
-            except UnicodeDecodeError:
-                continue
+        text = textfile.decode_text(content)
         
         if text is None:
             return jsonify({'error': 'ファイルのエンコーディングを解析できません'}), 400
@@ -183,14 +404,14 @@ def api_upload():
 @app.route('/api/documents', methods=['GET'])
 def api_list_documents():
     """ドキュメント一覧を取得"""
-    documents = database.list_documents()
+    documents = document_manager.list_documents()
     return jsonify({'documents': documents})
 
 
 @app.route('/api/documents/<int:doc_id>', methods=['GET'])
 def api_get_document(doc_id):
     """単一ドキュメントを取得"""
-    document = database.get_document_with_analysis(doc_id)
+    document = document_manager.get_document(doc_id)
     if document:
         return jsonify({'document': document})
     return jsonify({'error': 'ドキュメントが存在しません'}), 404
@@ -199,7 +420,7 @@ def api_get_document(doc_id):
 @app.route('/api/documents/<int:doc_id>', methods=['DELETE'])
 def api_delete_document(doc_id):
     """ドキュメントを削除"""
-    if database.delete_document(doc_id):
+    if document_manager.delete_document(doc_id):
         return jsonify({'success': True})
     return jsonify({'error': '削除に失敗しました'}), 404
 
@@ -222,6 +443,16 @@ def api_token_details():
     return jsonify({'details': details})
 
 
+@app.route('/api/analyzer/stats', methods=['GET'])
+def api_analyzer_stats():
+    """解析エンジンの統計情報（段落キャッシュのヒット率、taggerプール・DB接続プールの使用状況）を取得"""
+    return jsonify({
+        'cache': analyzer.get_analysis_cache().stats(),
+        'tagger_pools': analyzer.get_pool_stats(),
+        'connections': connections.stats()
+    })
+
+
 @app.route('/api/feature-labels', methods=['GET'])
 def api_feature_labels():
     """特徴ラベル説明を取得"""
@@ -253,10 +484,196 @@ def api_library_list():
     return jsonify({'documents': documents})
 
 
+@app.route('/api/library/search', methods=['GET'])
+def api_library_search():
+    """全文書の段落を全文検索（?q=検索語&limit=&offset=）"""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': '検索語を指定してください'}), 400
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 200)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+
+    results = document_manager.search_paragraphs(query, limit=limit, offset=offset)
+    return jsonify({'query': query, 'limit': limit, 'offset': offset, 'results': results})
+
+
+@app.route('/api/library/kwic', methods=['GET'])
+def api_library_kwic():
+    """
+    語彙索引による用例検索（KWIC）
+    検索キー: lemma, reading, pos, ctype, cform（例: ?lemma=給ふ&cform=連用形）
+    絞り込み: tags（カンマ区切り、いずれかを持つ文書）, era
+    表示: window（前後のトークン数）, limit, offset
+    """
+    query = {field: request.args.get(field, '').strip() for field in document_manager.INDEX_FIELDS}
+    tags = [t.strip() for t in request.args.get('tags', '').split(',') if t.strip()] or None
+    era = request.args.get('era', '').strip() or None
+    window = request.args.get('window', corpus.DEFAULT_WINDOW, type=int)
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 500)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+
+    try:
+        result = corpus.kwic(query, tags=tags, era=era, window=window, limit=limit, offset=offset)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(dict(result, limit=limit, offset=offset))
+
+
+@app.route('/api/library/pattern', methods=['GET'])
+def api_library_pattern():
+    """
+    トークン列のパターン検索（構文は corpus モジュール参照）
+    ?q=パターン&tags=&era=&within=paragraph|sentence&window=&limit=
+    一致箇所を NDJSON で逐次送信し、最後に件数と所要時間を送る
+    """
+    try:
+        pattern = corpus.compile_pattern(request.args.get('q', ''))
+    except corpus.PatternSyntaxError as e:
+        return jsonify({'error': str(e)}), 400
+    tags = [t.strip() for t in request.args.get('tags', '').split(',') if t.strip()] or None
+    era = request.args.get('era', '').strip() or None
+    within = request.args.get('within', 'paragraph')
+    if within not in corpus.PATTERN_SCOPES:
+        return jsonify({'error': f'不明な範囲: {within}'}), 400
+    window = request.args.get('window', corpus.DEFAULT_WINDOW, type=int)
+    limit = min(max(request.args.get('limit', 1000, type=int), 1), 100000)
+
+    def generate():
+        start = time.perf_counter()
+        count = 0
+        truncated = False
+        yield ndjson_line({'type': 'query', 'pattern': pattern.text, 'indexed': bool(pattern.anchors)})
+        try:
+            for match in corpus.iter_pattern_matches(pattern, tags=tags, era=era, within=within, window=window):
+                if count >= limit:
+                    truncated = True
+                    break
+                count += 1
+                yield ndjson_line(dict(match, type='match'))
+        except Exception as e:
+            yield ndjson_line({'type': 'error', 'error': str(e)})
+            return
+        yield ndjson_line({'type': 'done', 'count': count, 'truncated': truncated,
+                           'seconds': round(time.perf_counter() - start, 3)})
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+@app.route('/api/library/frequencies', methods=['GET'])
+def api_library_frequencies():
+    """
+    頻度表（インポート時に集計済み）
+    ?field=surface|lemma|reading|pos|ctype|cform&document=&tags=&era=&prefix=&level=&min_count=&limit=&offset=
+    format=csv で CSV（limit 省略時は全件）
+    """
+    field = request.args.get('field', 'lemma')
+    fmt = request.args.get('format', 'json')
+    tags = [t.strip() for t in request.args.get('tags', '').split(',') if t.strip()] or None
+    if fmt == 'csv':
+        limit = request.args.get('limit', None, type=int)
+    else:
+        limit = min(max(request.args.get('limit', corpus.DEFAULT_TOP, type=int), 1), corpus.MAX_TOP)
+
+    try:
+        result = corpus.frequencies(
+            field,
+            document_id=request.args.get('document', None, type=int),
+            tags=tags,
+            era=request.args.get('era', '').strip() or None,
+            prefix=request.args.get('prefix', '').strip() or None,
+            level=request.args.get('level', None, type=int),
+            min_count=max(request.args.get('min_count', 1, type=int), 1),
+            limit=limit,
+            offset=max(request.args.get('offset', 0, type=int), 0))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if fmt != 'csv':
+        return jsonify(result)
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow([field, 'count', 'documents', 'per_million'])
+    for row in result['rows']:
+        writer.writerow([row['value'], row['count'], row['documents'], row['per_million']])
+    # BOM 付き UTF-8（Excel で文字化けしないように）
+    return Response('\ufeff' + output.getvalue(), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename=frequencies_{field}.csv'})
+
+
+@app.route('/api/library/cube', methods=['GET'])
+def api_library_cube():
+    """
+    時代・文体 × 品詞・活用型・活用形の集計キューブ
+    ?by=era,cform:1（集計する次元、:n は上位 n 階層で集約）
+    &pos=助動詞&era=&style=&ctype=&cform=（切り出し条件）
+    """
+    by = []
+    levels = {}
+    for item in request.args.get('by', '').split(','):
+        dim, _, level = item.strip().partition(':')
+        if not dim:
+            continue
+        if level:
+            if not level.isdigit():
+                return jsonify({'error': f'不正な階層: {item}'}), 400
+            levels[dim] = int(level)
+        by.append(dim)
+    where = {dim: request.args[dim].strip() for dim in document_manager.CUBE_DIMENSIONS
+             if request.args.get(dim, '').strip()}
+
+    try:
+        return jsonify(corpus.cube(by, where=where, levels=levels))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+
+@app.route('/api/library/ngrams', methods=['GET'])
+def api_library_ngrams():
+    """
+    頻出 N-gram（インポート時に索引済み）
+    ?kind=lemma|surface&n=2..5&starts=&contains=&min_count=&min_documents=&limit=&offset=
+    """
+    try:
+        result = corpus.ngrams(
+            request.args.get('kind', 'lemma'),
+            n=request.args.get('n', 2, type=int),
+            starts=request.args.get('starts', '').strip() or None,
+            contains=request.args.get('contains', '').strip() or None,
+            min_count=max(request.args.get('min_count', 2, type=int), 1),
+            min_documents=max(request.args.get('min_documents', 1, type=int), 1),
+            limit=min(max(request.args.get('limit', 100, type=int), 1), 1000),
+            offset=max(request.args.get('offset', 0, type=int), 0))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(result)
+
+
+@app.route('/api/library/collocations', methods=['GET'])
+def api_library_collocations():
+    """
+    中心語（基本形）の共起語
+    ?lemma=&window=&side=both|left|right&measure=log_likelihood|pmi|t_score&min_count=&limit=
+    """
+    lemma = request.args.get('lemma', '').strip()
+    if not lemma:
+        return jsonify({'error': '基本形を指定してください'}), 400
+    try:
+        result = corpus.collocations(
+            lemma,
+            window=request.args.get('window', corpus.DEFAULT_COLLOCATION_WINDOW, type=int),
+            side=request.args.get('side', 'both'),
+            measure=request.args.get('measure', 'log_likelihood'),
+            min_count=max(request.args.get('min_count', 3, type=int), 1),
+            limit=min(max(request.args.get('limit', 50, type=int), 1), 1000))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(result)
+
+
 @app.route('/api/library/documents/<int:doc_id>', methods=['GET'])
 def api_library_get(doc_id):
-    """ライブラリから単一文書を取得"""
-    document = document_manager.get_document(doc_id)
+    """ライブラリから単一文書を取得（?dictionary= で別辞書の解析層を選択）"""
+    document = document_manager.get_document(doc_id, request.args.get('dictionary') or None)
     if document:
         return jsonify({'document': document})
     return jsonify({'error': '文書が存在しません'}), 404
@@ -327,7 +744,7 @@ def api_library_import():
             })
         
         # 解析を実行
-        paragraphs = analyzer.analyze_text(content, dictionary)
+        paragraphs = analyzer.analyze_text(content, dictionary, workers=app.config['ANALYZE_WORKERS'])
         
         # 新しいデータベースに保存
         doc_id = document_manager.save_document(
@@ -348,6 +765,154 @@ def api_library_import():
             'document': document
         })
         
+    except document_manager.DocumentExists as e:
+        return jsonify({'error': str(e), 'document_id': e.doc_id}), 409
+    except analyzer.TaggerPoolTimeout as e:
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/library/import/stream', methods=['POST'])
+def api_library_import_stream():
+    """新しい文書をインポートして解析（段落ごとに NDJSON でストリーミング）"""
+    try:
+        data = request.get_json()
+        title = data.get('title', '名称未設定').strip()
+        content = data.get('content', '').strip()
+        dictionary = data.get('dictionary', 'unidic-chuko')
+        tags = data.get('tags', [])
+        metadata = data.get('metadata', {})
+        
+        if not content:
+            return jsonify({'error': 'コンテンツを入力してください'}), 400
+        if dictionary not in analyzer.AVAILABLE_DICTIONARIES:
+            return jsonify({'error': f'不明な辞書: {dictionary}'}), 400
+        
+        # 既存のチェック
+        existing = document_manager.check_existing_analysis(content, dictionary)
+        if existing:
+            return stream_existing(existing)
+        
+        return stream_import(title, content, dictionary, tags, metadata)
+        
+    except document_manager.DocumentExists as e:
+        return jsonify({'error': str(e), 'document_id': e.doc_id}), 409
+    except analyzer.TaggerPoolTimeout as e:
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/library/jobs', methods=['POST'])
+def api_library_submit_job():
+    """インポートジョブを登録（解析・保存はワーカープロセスが行い、ジョブIDをすぐに返す）"""
+    data = request.get_json()
+    title = data.get('title', '名称未設定').strip()
+    content = data.get('content', '').strip()
+    dictionary = data.get('dictionary', 'unidic-chuko')
+    
+    if not content:
+        return jsonify({'error': 'コンテンツを入力してください'}), 400
+    if dictionary not in analyzer.AVAILABLE_DICTIONARIES:
+        return jsonify({'error': f'不明な辞書: {dictionary}'}), 400
+    
+    job_id = jobs.submit_job(
+        title=title,
+        content=content,
+        dictionary=dictionary,
+        tags=data.get('tags', []),
+        metadata=data.get('metadata', {}),
+        path=app.config['JOBS_PATH']
+    )
+    return jsonify({'success': True, 'job': jobs.get_job(job_id, path=app.config['JOBS_PATH'])}), 202
+
+
+@app.route('/api/library/jobs', methods=['GET'])
+def api_library_list_jobs():
+    """最近のインポートジョブ一覧を取得（?status= で状態を絞り込み）"""
+    status = request.args.get('status') or None
+    limit = request.args.get('limit', 50, type=int)
+    return jsonify({'jobs': jobs.list_jobs(status, limit, path=app.config['JOBS_PATH'])})
+
+
+@app.route('/api/library/jobs/<int:job_id>', methods=['GET'])
+def api_library_get_job(job_id):
+    """インポートジョブの状態と進捗（処理済みの段落数・語数）を取得"""
+    job = jobs.get_job(job_id, path=app.config['JOBS_PATH'])
+    if job:
+        return jsonify({'job': job})
+    return jsonify({'error': 'ジョブが存在しません'}), 404
+
+
+@app.route('/api/library/jobs/<int:job_id>/retry', methods=['POST'])
+def api_library_retry_job(job_id):
+    """失敗したインポートジョブを再試行"""
+    if jobs.retry_job(job_id, path=app.config['JOBS_PATH']):
+        return jsonify({'success': True})
+    return jsonify({'error': '再試行できるジョブではありません'}), 400
+
+
+@app.route('/api/library/import/multi', methods=['POST'])
+def api_library_import_multi():
+    """
+    同じ文書を複数の辞書で並列に解析してインポート
+    段落分割と原文は共有し、主辞書以外の結果は比較用の解析層として保存する
+    """
+    try:
+        data = request.get_json()
+        title = data.get('title', '名称未設定').strip()
+        content = data.get('content', '').strip()
+        dictionaries = data.get('dictionaries', [])
+        primary = data.get('primary') or (dictionaries[0] if dictionaries else None)
+        tags = data.get('tags', [])
+        metadata = data.get('metadata', {})
+        
+        if not content:
+            return jsonify({'error': 'コンテンツを入力してください'}), 400
+        if not dictionaries:
+            return jsonify({'error': '辞書を1つ以上指定してください'}), 400
+        if primary not in dictionaries:
+            dictionaries = [primary] + dictionaries
+        for dictionary in dictionaries:
+            if dictionary not in analyzer.AVAILABLE_DICTIONARIES:
+                return jsonify({'error': f'不明な辞書: {dictionary}'}), 400
+        
+        # 既に主辞書で解析済みなら、足りない解析層だけを追加する
+        existing = document_manager.check_existing_analysis(content, primary)
+        if existing:
+            missing = [d for d in dictionaries if d not in existing['layers']]
+            if missing:
+                layers = analyzer.analyze_text_multi(content, missing, workers=app.config['ANALYZE_WORKERS'])
+                for dictionary, paragraphs in layers.items():
+                    document_manager.save_layer(existing['id'], dictionary, paragraphs)
+                existing = document_manager.get_document(existing['id'])
+            return jsonify({
+                'success': True,
+                'cached': not missing,
+                'document': existing
+            })
+        
+        layers = analyzer.analyze_text_multi(content, dictionaries, workers=app.config['ANALYZE_WORKERS'])
+        doc_id = document_manager.save_document_layers(
+            title=title,
+            content=content,
+            layers=layers,
+            primary=primary,
+            tags=tags,
+            metadata=metadata
+        )
+        
+        return jsonify({
+            'success': True,
+            'cached': False,
+            'document': document_manager.get_document(doc_id)
+        })
+        
+    except document_manager.DocumentExists as e:
+        return jsonify({'error': str(e), 'document_id': e.doc_id}), 409
+    except analyzer.TaggerPoolTimeout as e:
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -0,0 +1,170 @@
+"""
+圧縮モジュール - 文書データベースに保存する文字列を値ごとに圧縮・展開する
+
+原文・段落本文は1値（1段落）ずつ、語彙素の素性 JSON は1行ずつ独立に圧縮するので、
+任意の段落を読むときはその段落の値だけを展開すればよい。圧縮した値は先頭1バイトに
+方式を記録した BLOB、圧縮しない値（圧縮しても縮まない値を含む）は TEXT のまま保存し、
+読み込み時は型と先頭バイトで判別する。方式を切り替えても既存の値はそのまま読める。
+
+素性の JSON は1つが短く単独ではあまり縮まないため、データベースごとに頻出する値から
+学習した辞書を共有して圧縮する。辞書は内容から求めた ID で識別し、値には ID を埋め込む。
+本文は辞書を使わないので、圧縮した値を別のデータベースへそのまま複製できる。
+"""
+import hashlib
+import json
+import threading
+import zlib
+from collections import Counter
+from typing import Callable, Dict, Iterable, Optional, Union
+
+try:
+    import zstandard
+except ImportError:
+    # zstd は任意（zstandard がなければ zlib のみ使える）
+    zstandard = None
+
+METHODS = ('none', 'zlib', 'zstd')
+
+# 圧縮した値の先頭バイト（方式）。辞書を使う方式は続く4バイトが辞書ID
+_ZLIB = 1
+_ZLIB_DICT = 2
+_ZSTD = 3
+_ZSTD_DICT = 4
+
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+
+# 素性の圧縮は窓 4 KiB（値は数百バイトなので十分で、辞書付きの圧縮状態の準備が速い）
+# zlib は辞書のうち末尾の「窓 - 262」バイトしか使わない
+_FEATURE_WBITS = 12
+_FEATURE_MEMLEVEL = 4
+ZLIB_DICTIONARY_SIZE = (1 << _FEATURE_WBITS) - 262
+ZSTD_DICTIONARY_SIZE = 16384
+
+# 辞書の学習に使う最小の標本数（少ないうちは辞書なしで圧縮し、次の書き込みで学習する）
+DICTIONARY_MIN_SAMPLES = 256
+
+# 展開に使った辞書（辞書ID -> 内容。内容から求めた ID なので全データベースで共有できる）
+_dictionaries: Dict[int, bytes] = {}
+# zstd の圧縮・展開オブジェクトはスレッド間で共有できないのでスレッドごとに持つ
+_local = threading.local()
+
+
+def resolve_method(method: str) -> str:
+    """設定値を圧縮方式に変換（auto は zstd が使えれば zstd、なければ zlib）"""
+    if method == 'auto':
+        return 'zstd' if zstandard is not None else 'zlib'
+    if method not in METHODS:
+        raise ValueError(f"未知の圧縮方式: {method}")
+    if method == 'zstd' and zstandard is None:
+        raise ValueError("zstd を使うには zstandard をインストールしてください")
+    return method
+
+
+def dictionary_id(dictionary: bytes) -> int:
+    """辞書の ID（内容の SHA-256 の先頭4バイト）"""
+    return int.from_bytes(hashlib.sha256(dictionary).digest()[:4], 'big')
+
+
+def train_dictionary(samples: Iterable[str], method: str) -> Optional[bytes]:
+    """
+    素性 JSON の標本から共有辞書を学習する（標本が足りない時は None）
+
+    zstd は zstandard の辞書学習を使う。zlib の辞書は参照される文字列を並べたものなので、
+    配列の要素（"値", ）を出現回数×長さの小さい順に並べる（末尾ほど近い距離で参照でき、短い符号になる）。
+    """
+    samples = list(samples)
+    if len(samples) < DICTIONARY_MIN_SAMPLES:
+        return None
+    if method == 'zstd':
+        try:
+            return zstandard.train_dictionary(
+                ZSTD_DICTIONARY_SIZE, [raw.encode('utf-8') for raw in samples]).as_bytes()
+        except zstandard.ZstdError:
+            return None
+    counts = Counter(json.dumps(value, ensure_ascii=False) + ', '
+                     for raw in samples for value in json.loads(raw))
+    pieces = sorted(counts, key=lambda piece: counts[piece] * len(piece.encode('utf-8')))
+    return ''.join(pieces).encode('utf-8')[-ZLIB_DICTIONARY_SIZE:]
+
+
+def _zstd(kind: str, key: Optional[int], dictionary: Optional[bytes]):
+    """このスレッドの zstd 圧縮（kind='c'）・展開（kind='d'）オブジェクト（key は辞書ID）"""
+    cache = getattr(_local, 'zstd', None)
+    if cache is None:
+        cache = _local.zstd = {}
+    key = (kind, key)
+    codec = cache.get(key)
+    if codec is None:
+        params = {'dict_data': zstandard.ZstdCompressionDict(dictionary)} if dictionary else {}
+        codec = cache[key] = (zstandard.ZstdCompressor(level=ZSTD_LEVEL, **params) if kind == 'c'
+                              else zstandard.ZstdDecompressor(**params))
+    return codec
+
+
+class Packer:
+    """
+    1つの方式（と辞書）で値を圧縮する
+
+    圧縮しても縮まない値は文字列のまま返す。
+    """
+
+    def __init__(self, method: str, dictionary: Optional[bytes] = None):
+        self.method = method
+        self.dictionary = dictionary
+        self.dictionary_id = dictionary_id(dictionary) if dictionary else None
+        if dictionary:
+            _dictionaries.setdefault(self.dictionary_id, dictionary)
+            self._header = bytes([_ZSTD_DICT if method == 'zstd' else _ZLIB_DICT]) + \
+                self.dictionary_id.to_bytes(4, 'big')
+        else:
+            self._header = bytes([_ZSTD if method == 'zstd' else _ZLIB])
+
+    def _compress(self, data: bytes) -> bytes:
+        if self.method == 'zstd':
+            return _zstd('c', self.dictionary_id, self.dictionary).compress(data)
+        if self.dictionary:
+            compressor = zlib.compressobj(ZLIB_LEVEL, zlib.DEFLATED, -_FEATURE_WBITS, _FEATURE_MEMLEVEL,
+                                          zdict=self.dictionary)
+        else:
+            compressor = zlib.compressobj(ZLIB_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+        return compressor.compress(data) + compressor.flush()
+
+    def pack(self, text: str) -> Union[str, bytes]:
+        """保存する値（圧縮した BLOB、または元の文字列）"""
+        if self.method == 'none':
+            return text
+        data = text.encode('utf-8')
+        packed = self._header + self._compress(data)
+        return packed if len(packed) < len(data) else text
+
+
+def unpack(value: Union[str, bytes], load_dictionary: Callable[[int], Optional[bytes]]) -> str:
+    """
+    保存した値を文字列に戻す
+
+    Args:
+        value: TEXT（圧縮なし）または Packer.pack で圧縮した BLOB
+        load_dictionary: まだ読み込んでいない辞書を ID から読む関数（値を保存したデータベースから）
+    """
+    if not isinstance(value, bytes):
+        return value
+    method = value[0]
+    if method == _ZLIB:
+        return zlib.decompress(value[1:], -zlib.MAX_WBITS).decode('utf-8')
+    if method == _ZSTD:
+        return _zstd('d', None, None).decompress(value[1:]).decode('utf-8')
+    if method not in (_ZLIB_DICT, _ZSTD_DICT):
+        raise ValueError(f"未知の圧縮形式: {method}")
+
+    key = int.from_bytes(value[1:5], 'big')
+    dictionary = _dictionaries.get(key)
+    if dictionary is None:
+        dictionary = load_dictionary(key)
+        if dictionary is None:
+            raise ValueError(f"圧縮辞書がありません: {key:08x}")
+        dictionary = _dictionaries.setdefault(key, dictionary)
+    if method == _ZSTD_DICT:
+        return _zstd('d', key, dictionary).decompress(value[5:]).decode('utf-8')
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS, zdict=dictionary)
+    return (decompressor.decompress(value[5:]) + decompressor.flush()).decode('utf-8')
@@ -0,0 +1,307 @@
+"""
+接続プール - SQLiteの接続をデータベースファイルごとに再利用する
+呼び出しのたびに接続を開き直すと、接続とページキャッシュの準備が毎回必要になり、
+書き込みが重なると "database is locked" になりやすいため、WALモードの接続を使い回す
+"""
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# 全接続に設定するプラグマ
+# WAL + synchronous=NORMAL は読み書きを並行でき、電源断でもデータベースは壊れない
+PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('temp_store', 'MEMORY'),
+    ('cache_size', -8000),        # 接続ごとのページキャッシュ（KiB）
+)
+BUSY_TIMEOUT = 30.0               # ロック解除を待つ最大秒数
+_FDS_PER_CONNECTION = 3           # WAL の接続は本体・-wal・-shm の3つを開く
+_FD_RESERVE = 256                 # ソケットやログなどのために残しておく数
+
+
+def _default_max_idle() -> int:
+    """ファイルディスクリプタの上限から、保持しておく待機接続の上限を決める"""
+    try:
+        import resource
+        soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft == resource.RLIM_INFINITY:
+            soft = 4096
+    except (ImportError, ValueError, OSError):
+        # Windows など resource がない環境
+        soft = 512
+    return max(8, min(128, (soft - _FD_RESERVE) // _FDS_PER_CONNECTION))
+
+
+class PooledConnection:
+    """
+    プールから貸し出した接続
+
+    close() で接続を閉じずにプールへ返す。返す前に未確定のトランザクションは
+    ロールバックされる（sqlite3.Connection.close と同じ扱い）。
+    貸し出し中の接続は借りたスレッドだけが使う。close を忘れても、
+    参照がなくなった時点でプールへ戻る。
+    """
+
+    __slots__ = ('_pool', '_path', '_conn', '_generation', '__weakref__')
+
+    def __init__(self, pool: 'ConnectionPool', path: str, conn: sqlite3.Connection, generation: int):
+        self._pool = pool
+        self._path = path
+        self._conn = conn
+        self._generation = generation
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            raise sqlite3.ProgrammingError("Cannot operate on a closed database.")
+        return self._conn
+
+    def execute(self, sql: str, parameters: Any = ()) -> sqlite3.Cursor:
+        return self.connection.execute(sql, parameters)
+
+    def executemany(self, sql: str, seq_of_parameters: Any) -> sqlite3.Cursor:
+        return self.connection.executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql: str) -> sqlite3.Cursor:
+        return self.connection.executescript(sql)
+
+    def cursor(self) -> sqlite3.Cursor:
+        return self.connection.cursor()
+
+    def commit(self) -> None:
+        self.connection.commit()
+
+    def rollback(self) -> None:
+        self.connection.rollback()
+
+    @property
+    def in_transaction(self) -> bool:
+        return self.connection.in_transaction
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.connection, name)
+
+    def __enter__(self) -> 'PooledConnection':
+        self.connection.__enter__()
+        return self
+
+    def __exit__(self, *exc_info) -> Any:
+        return self.connection.__exit__(*exc_info)
+
+    def close(self) -> None:
+        """接続をプールへ返す"""
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            self._pool._release(self._path, conn, self._generation)
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class ConnectionPool:
+    """
+    データベースファイルごとの接続プール
+
+    待機中の接続は全ファイル合計で max_idle 個まで保持し、超えた分は
+    最も長く使われていないものから閉じる（文書ごとのデータベースが多数あっても
+    ファイルディスクリプタを使い切らない）。
+    """
+
+    def __init__(self, max_idle: Optional[int] = None, pragmas=PRAGMAS,
+                 busy_timeout: float = BUSY_TIMEOUT):
+        self.max_idle = max_idle or _default_max_idle()
+        self.pragmas = pragmas
+        self.busy_timeout = busy_timeout
+
+        self._lock = threading.Lock()
+        self._prepare_lock = threading.Lock()
+        self._idle: Dict[str, List[sqlite3.Connection]] = {}
+        self._lru: "OrderedDict[int, Tuple[str, sqlite3.Connection]]" = OrderedDict()
+        self._generation: Dict[str, int] = {}
+        self._prepared: set = set()
+
+        self._created = 0
+        self._closed = 0
+        self._reused = 0
+        self._evicted = 0
+
+    def _open(self, path: str) -> sqlite3.Connection:
+        """新しい接続を開いてプラグマを設定"""
+        # プール内の接続はスレッド間で受け渡すため check_same_thread を外す
+        # （同時に使うのは貸し出し先の1スレッドのみ）
+        conn = sqlite3.connect(path, timeout=self.busy_timeout, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for name, value in self.pragmas:
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def connect(self, path: str, prepare: Optional[Callable[[sqlite3.Connection], None]] = None
+                ) -> PooledConnection:
+        """
+        接続を借りる
+
+        Args:
+            path: データベースファイルのパス
+            prepare: このファイルを初めて開いた時に一度だけ実行する処理（スキーマ作成・移行など）
+        """
+        path = os.path.abspath(path)
+        conn = None
+        with self._lock:
+            idle = self._idle.get(path)
+            if idle:
+                conn = idle.pop()
+                if not idle:
+                    del self._idle[path]
+                del self._lru[id(conn)]
+                self._reused += 1
+            generation = self._generation.get(path, 0)
+            needs_prepare = prepare is not None and path not in self._prepared
+
+        if conn is None:
+            conn = self._open(path)
+            with self._lock:
+                self._created += 1
+
+        if needs_prepare:
+            # 同じファイルの準備処理を複数のスレッドで同時に走らせない
+            with self._prepare_lock:
+                if path not in self._prepared:
+                    try:
+                        prepare(conn)
+                    except Exception:
+                        conn.close()
+                        with self._lock:
+                            self._closed += 1
+                        raise
+                    with self._lock:
+                        self._prepared.add(path)
+
+        return PooledConnection(self, path, conn, generation)
+
+    def _release(self, path: str, conn: sqlite3.Connection, generation: int) -> None:
+        """返却された接続を待機接続に戻す（破棄済みのファイルなら閉じる）"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            generation = -1
+
+        to_close = []
+        with self._lock:
+            if generation != self._generation.get(path, 0):
+                to_close.append(conn)
+            else:
+                self._idle.setdefault(path, []).append(conn)
+                self._lru[id(conn)] = (path, conn)
+                while len(self._lru) > self.max_idle:
+                    _, (old_path, old_conn) = self._lru.popitem(last=False)
+                    self._idle[old_path].remove(old_conn)
+                    if not self._idle[old_path]:
+                        del self._idle[old_path]
+                    to_close.append(old_conn)
+                    self._evicted += 1
+            self._closed += len(to_close)
+
+        for old in to_close:
+            old.close()
+
+    def discard(self, path: str) -> None:
+        """
+        ファイルの接続を全て閉じる（ファイルを削除する前に呼ぶ）
+        貸し出し中の接続は返却された時点で閉じる
+        """
+        path = os.path.abspath(path)
+        with self._lock:
+            self._generation[path] = self._generation.get(path, 0) + 1
+            self._prepared.discard(path)
+            to_close = self._idle.pop(path, [])
+            for conn in to_close:
+                del self._lru[id(conn)]
+            self._closed += len(to_close)
+        for conn in to_close:
+            conn.close()
+
+    def close_all(self) -> None:
+        """待機中の接続を全て閉じる"""
+        with self._lock:
+            to_close = [conn for _, conn in self._lru.values()]
+            self._idle.clear()
+            self._lru.clear()
+            self._closed += len(to_close)
+        for conn in to_close:
+            conn.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """接続数・再利用数などの統計情報を取得"""
+        with self._lock:
+            open_count = self._created - self._closed
+            return {
+                'max_idle': self.max_idle,
+                'open': open_count,
+                'idle': len(self._lru),
+                'in_use': open_count - len(self._lru),
+                'files': len(self._idle),
+                'created': self._created,
+                'reused': self._reused,
+                'evicted': self._evicted
+            }
+
+
+@contextmanager
+def bulk_write(conn, checkpoint: bool = True):
+    """
+    大量書き込み用のトランザクション
+
+    1つの BEGIN IMMEDIATE ... COMMIT の間だけ synchronous=OFF にして fsync を省き、
+    終了後に通常の設定へ戻してからチェックポイントで書き込み内容をディスクに確定させる。
+    例外（ジェネレータの中断を含む）ではロールバックする。
+    分けて書き込む一連のトランザクションでは checkpoint=False とし、最後に
+    PRAGMA wal_checkpoint(FULL) を1回実行する。
+    """
+    conn.execute('PRAGMA synchronous = OFF')
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+    finally:
+        conn.execute(f'PRAGMA synchronous = {dict(PRAGMAS)["synchronous"]}')
+    if checkpoint:
+        conn.execute('PRAGMA wal_checkpoint(FULL)')
+
+
+# プロセス全体で共有する接続プール
+_pool = ConnectionPool()
+
+
+def configure(max_idle: Optional[int] = None) -> ConnectionPool:
+    """接続プールを設定し直す（既存の待機接続は閉じる）"""
+    global _pool
+    _pool.close_all()
+    _pool = ConnectionPool(max_idle)
+    return _pool
+
+
+def connect(path: str, prepare: Optional[Callable[[sqlite3.Connection], None]] = None) -> PooledConnection:
+    """共有プールから接続を借りる"""
+    return _pool.connect(path, prepare)
+
+
+def discard(path: str) -> None:
+    """共有プールからファイルの接続を破棄"""
+    _pool.discard(path)
+
+
+def stats() -> Dict[str, Any]:
+    """共有プールの統計情報"""
+    return _pool.stats()
@@ -0,0 +1,1004 @@
+"""
+コーパス検索 - ライブラリ全体の語彙索引（document_manager の postings）を使った用例検索
+検索キーから出現位置までは主索引データベースだけで求め、文書データベースは
+結果として返す用例の前後文脈を読む時にだけ開く
+"""
+import json
+import math
+import re
+import sys
+from array import array
+from collections import Counter
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from . import document_manager
+from .tokens import Token, sentence_spans
+
+# KWIC の前後文脈（トークン数）
+DEFAULT_WINDOW = 10
+MAX_WINDOW = 50
+
+
+def _lexeme_subquery(query: Dict[str, str]) -> Tuple[str, List[str]]:
+    """
+    検索条件（キー名 -> 値）を全て満たす語彙素IDの副問い合わせを作る
+
+    キー名は document_manager.INDEX_FIELDS のもの（lemma, reading, pos, ctype, cform）。
+    pos・ctype・cform は上位の分類でも指定できる（pos=名詞 で名詞全体）。
+    """
+    conditions = {field: value for field, value in query.items() if value}
+    if not conditions:
+        raise ValueError("検索条件を指定してください")
+    for field in conditions:
+        if field not in document_manager.INDEX_FIELDS:
+            raise ValueError(f"不明な検索キー: {field}")
+    sql = ' INTERSECT '.join(
+        'SELECT lexeme_id FROM lexeme_keys WHERE field = ? AND value = ?' for _ in conditions)
+    params = [item for pair in conditions.items() for item in pair]
+    return sql, params
+
+
+def _document_filter(tags: Optional[List[str]] = None, era: Optional[str] = None) -> Tuple[str, List[str]]:
+    """
+    文書の絞り込み条件（postings.document_id に対する AND 条件）を作る
+
+    tags はいずれかのタグを持つ文書（文書一覧の絞り込みと同じ）、
+    era は時代タグまたはメタデータの era が一致する文書
+    """
+    sql = ''
+    params: List[str] = []
+    if tags:
+        placeholders = ','.join('?' * len(tags))
+        sql += f'''
+            AND document_id IN (SELECT dt.document_id FROM document_tags dt
+                                JOIN tags t ON t.id = dt.tag_id WHERE t.name IN ({placeholders}))
+        '''
+        params.extend(tags)
+    if era:
+        sql += '''
+            AND document_id IN (SELECT dt.document_id FROM document_tags dt
+                                JOIN tags t ON t.id = dt.tag_id WHERE t.category = 'era' AND t.name = ?
+                                UNION
+                                SELECT document_id FROM document_metadata WHERE key = 'era' AND value = ?)
+        '''
+        params.extend([era, era])
+    return sql, params
+
+
+def _page_positions(conn, lexeme_sql: str, lexeme_params: List[str], doc_sql: str, doc_params: List[str],
+                    limit: int, offset: int) -> Tuple[int, List[Tuple[int, List[Tuple[int, int]]]]]:
+    """
+    全件数と、ページに入る出現位置を文書ごとに返す
+
+    件数は postings.token_count の合計で求め、位置列はページにかかる文書の分だけ読む。
+    順序は文書ID、段落番号、段落内トークン番号の順。
+    """
+    rows = conn.execute(f'''
+        SELECT document_id, SUM(token_count) FROM postings
+        WHERE lexeme_id IN ({lexeme_sql}) {doc_sql}
+        GROUP BY document_id ORDER BY document_id
+    ''', lexeme_params + doc_params).fetchall()
+
+    total = 0
+    page = []
+    for doc_id, count in rows:
+        if total + count > offset and total < offset + limit:
+            skip = max(0, offset - total)
+            take = min(count - skip, offset + limit - total - skip)
+            page.append((doc_id, skip, take))
+        total += count
+
+    result = []
+    for doc_id, skip, take in page:
+        positions = []
+        for (blob,) in conn.execute(f'''
+                SELECT positions FROM postings WHERE document_id = ? AND lexeme_id IN ({lexeme_sql})
+                ''', [doc_id] + lexeme_params):
+            values = document_manager.unpack_positions(blob)
+            positions.extend(zip(values[0::2], values[1::2]))
+        positions.sort()
+        result.append((doc_id, positions[skip:skip + take]))
+    return total, result
+
+
+def kwic(query: Dict[str, str], tags: Optional[List[str]] = None, era: Optional[str] = None,
+         window: int = DEFAULT_WINDOW, limit: int = 50, offset: int = 0) -> Dict[str, Any]:
+    """
+    KWIC（前後文脈つきの用例一覧）を検索
+
+    Args:
+        query: 検索条件（キー名 -> 値）。例: {'lemma': '給ふ', 'cform': '連用形'}
+        tags: いずれかのタグを持つ文書に限定
+        era: 時代で限定
+        window: 前後文脈のトークン数（段落をまたがない）
+        limit: 返す最大件数
+        offset: 読み飛ばす件数（ページング）
+
+    Returns:
+        {'total': 全件数, 'hits': [{document_id, title, paragraph_index, token_index,
+         left, node, right, features}, ...]}
+    """
+    window = max(0, min(window, MAX_WINDOW))
+    lexeme_sql, lexeme_params = _lexeme_subquery(query)
+    doc_sql, doc_params = _document_filter(tags, era)
+
+    conn = document_manager.get_registry_connection()
+    try:
+        total, page = _page_positions(conn, lexeme_sql, lexeme_params, doc_sql, doc_params, limit, offset)
+    finally:
+        conn.close()
+
+    hits = []
+    for doc_id, positions in page:
+        document = document_manager.open_document(doc_id)
+        if document is None or not document.exists():
+            continue
+        ranges = [(para_idx, max(0, token_idx - window), token_idx + window + 1)
+                  for para_idx, token_idx in positions]
+        for (para_idx, token_idx), (_, start, _), tokens in zip(positions, ranges,
+                                                                document.token_ranges(ranges)):
+            node = token_idx - start
+            if node >= len(tokens):
+                continue
+            hits.append({
+                'document_id': doc_id,
+                'title': document.title,
+                'paragraph_index': para_idx,
+                'token_index': token_idx,
+                'left': ''.join(token.surface for token in tokens[:node]),
+                'node': tokens[node].surface,
+                'right': ''.join(token.surface for token in tokens[node + 1:]),
+                'features': list(tokens[node].features)
+            })
+    return {'total': total, 'hits': hits}
+
+
+# ===== パターン検索 =====
+#
+# トークン列のパターン（CQP 風の小さな問い合わせ言語）
+#   [lemma="けり" & pos="助動詞"]        1トークンの条件（& 且つ、| 又は、! 否定、!= 不一致）
+#   [pos="動詞" & cform="連用形"] [lemma="けり"]   空白区切りで連続するトークン
+#   []                                   任意の1トークン
+#   []{0,5}  []*  [..]+  [..]?           繰り返し（{最小,最大}、{n}、{n,}）
+#   ([lemma="ぞ"] | [lemma="なむ"])      括弧と | で列の選択
+#   "けり"                               [surface="けり"] の省略形
+# 条件のキーは INDEX_FIELDS（lemma, reading, pos, ctype, cform）と surface。
+# pos・ctype・cform は上位の分類でも一致する（pos="助詞" で係助詞なども含む）。
+
+# パターン検索の範囲（一致はこの単位をまたがない）
+PATTERN_SCOPES = ('paragraph', 'sentence')
+
+_PATTERN_TOKEN = re.compile(r'\s*(?:("(?:[^"\\]|\\.)*")|(!=|[\[\]()|&!?*+{},=])|([A-Za-z_]\w*)|(\d+))')
+_PATTERN_FIELDS = frozenset(document_manager.INDEX_FIELDS) | {'surface'}
+
+
+class PatternSyntaxError(ValueError):
+    """パターンの構文エラー"""
+
+
+class _PatternParser:
+    """
+    パターン文字列を構文木に変換する再帰下降パーサ
+
+    構文木（タプル）:
+        ('token', 条件 | None)  ('seq', [子])  ('alt', [子])  ('repeat', 子, 最小, 最大 | None)
+    トークン条件:
+        ('eq' | 'ne', キー, 値)  ('and', [条件])  ('or', [条件])  ('not', 条件)
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.tokens: List[Tuple[str, str]] = []
+        position = 0
+        text = text.rstrip()
+        while position < len(text):
+            match = _PATTERN_TOKEN.match(text, position)
+            if not match or match.end() == position:
+                raise PatternSyntaxError(f"解釈できない文字があります（{position + 1}文字目）: {text[position:position + 10]}")
+            string, symbol, name, number = match.groups()
+            if string is not None:
+                self.tokens.append(('string', re.sub(r'\\(.)', r'\1', string[1:-1])))
+            elif symbol is not None:
+                self.tokens.append(('symbol', symbol))
+            elif name is not None:
+                self.tokens.append(('name', name))
+            else:
+                self.tokens.append(('number', number))
+            position = match.end()
+        self.index = 0
+
+    def peek(self, value: Optional[str] = None) -> bool:
+        if self.index >= len(self.tokens):
+            return False
+        return value is None or self.tokens[self.index] == ('symbol', value)
+
+    def take(self, kind: Optional[str] = None, value: Optional[str] = None) -> str:
+        if self.index >= len(self.tokens):
+            raise PatternSyntaxError("パターンが途中で終わっています")
+        token_kind, token_value = self.tokens[self.index]
+        if (kind and token_kind != kind) or (value and token_value != value):
+            raise PatternSyntaxError(f"{value or kind} が必要な位置に {token_value} があります")
+        self.index += 1
+        return token_value
+
+    def parse(self):
+        if not self.tokens:
+            raise PatternSyntaxError("パターンが空です")
+        node = self.alternation()
+        if self.index < len(self.tokens):
+            raise PatternSyntaxError(f"余分な記号があります: {self.tokens[self.index][1]}")
+        return node
+
+    def alternation(self):
+        branches = [self.sequence()]
+        while self.peek('|'):
+            self.take()
+            branches.append(self.sequence())
+        return branches[0] if len(branches) == 1 else ('alt', branches)
+
+    def sequence(self):
+        items = []
+        while self.peek() and not self.peek('|') and not self.peek(')'):
+            items.append(self.item())
+        if not items:
+            raise PatternSyntaxError("トークンの条件がありません")
+        return items[0] if len(items) == 1 else ('seq', items)
+
+    def item(self):
+        if self.peek('['):
+            self.take()
+            condition = None if self.peek(']') else self.condition()
+            self.take('symbol', ']')
+            node = ('token', condition)
+        elif self.peek('('):
+            self.take()
+            node = self.alternation()
+            self.take('symbol', ')')
+        else:
+            node = ('token', ('eq', 'surface', self.take('string')))
+        return self.quantifier(node)
+
+    def quantifier(self, node):
+        if self.peek('?'):
+            self.take()
+            return ('repeat', node, 0, 1)
+        if self.peek('*'):
+            self.take()
+            return ('repeat', node, 0, None)
+        if self.peek('+'):
+            self.take()
+            return ('repeat', node, 1, None)
+        if self.peek('{'):
+            self.take()
+            minimum = int(self.take('number'))
+            maximum: Optional[int] = minimum
+            if self.peek(','):
+                self.take()
+                maximum = None if self.peek('}') else int(self.take('number'))
+            self.take('symbol', '}')
+            if maximum is not None and maximum < minimum:
+                raise PatternSyntaxError(f"繰り返し回数の指定が不正です: {{{minimum},{maximum}}}")
+            return ('repeat', node, minimum, maximum)
+        return node
+
+    def condition(self):
+        terms = [self.conjunction()]
+        while self.peek('|'):
+            self.take()
+            terms.append(self.conjunction())
+        return terms[0] if len(terms) == 1 else ('or', terms)
+
+    def conjunction(self):
+        terms = [self.term()]
+        while self.peek('&'):
+            self.take()
+            terms.append(self.term())
+        return terms[0] if len(terms) == 1 else ('and', terms)
+
+    def term(self):
+        if self.peek('!'):
+            self.take()
+            return ('not', self.term())
+        if self.peek('('):
+            self.take()
+            condition = self.condition()
+            self.take('symbol', ')')
+            return condition
+        field = self.take('name')
+        if field not in _PATTERN_FIELDS:
+            raise PatternSyntaxError(f"不明なキー: {field}")
+        operator = 'ne' if self.peek('!=') else 'eq'
+        self.take('symbol', '!=' if operator == 'ne' else '=')
+        return (operator, field, self.take('string'))
+
+
+@lru_cache(maxsize=65536)
+def _feature_keys(features: Tuple[str, ...]) -> frozenset:
+    """特徴タプルの検索キーの集合（語彙索引と同じ lexeme_keys）"""
+    return frozenset(document_manager.lexeme_keys(features))
+
+
+def _predicate(condition) -> Callable[[Token], bool]:
+    """トークン条件を判定関数に変換"""
+    if condition is None:
+        return lambda token: True
+    kind = condition[0]
+    if kind in ('eq', 'ne'):
+        _, field, value = condition
+        if field == 'surface':
+            test = lambda token: token.surface == value
+        else:
+            key = (field, value)
+            test = lambda token: key in _feature_keys(token.features)
+        return test if kind == 'eq' else (lambda token: not test(token))
+    if kind == 'not':
+        inner = _predicate(condition[1])
+        return lambda token: not inner(token)
+    parts = [_predicate(part) for part in condition[1]]
+    if kind == 'and':
+        return lambda token: all(part(token) for part in parts)
+    return lambda token: any(part(token) for part in parts)
+
+
+def _condition_lexemes(condition) -> Optional[Tuple[str, List[str]]]:
+    """
+    トークン条件を満たしうる語彙素IDの副問い合わせ（語彙索引で絞り込めない時は None）
+    否定は絞り込みに使わない（& の中では無視しても候補が広がるだけ）。
+    surface はその表層形で現れたことのある語彙素（surface_lexemes）で絞り込む
+    """
+    if condition is None or condition[0] in ('ne', 'not'):
+        return None
+    if condition[0] == 'eq':
+        _, field, value = condition
+        if field == 'surface':
+            return 'SELECT lexeme_id FROM surface_lexemes WHERE surface = ?', [value]
+        return 'SELECT lexeme_id FROM lexeme_keys WHERE field = ? AND value = ?', [field, value]
+    parts = [_condition_lexemes(part) for part in condition[1]]
+    if condition[0] == 'and':
+        parts = [part for part in parts if part]
+        if not parts:
+            return None
+    elif not all(parts):
+        return None
+    return _combine_lexemes(' INTERSECT ' if condition[0] == 'and' else ' UNION ', parts)
+
+
+def _combine_lexemes(operator: str, parts: List[Tuple[str, List[str]]]) -> Tuple[str, List[str]]:
+    """
+    語彙素副問い合わせを INTERSECT / UNION で結ぶ
+
+    SQLite の複合 SELECT は演算子の種類によらず左から順に結合するため、各副問い合わせを FROM 句に包む
+    （A UNION B INTERSECT C が (A UNION B) INTERSECT C にならないように）
+    """
+    if len(parts) == 1:
+        return parts[0]
+    return (operator.join(f'SELECT lexeme_id FROM ({sql})' for sql, _ in parts),
+            [p for _, params in parts for p in params])
+
+
+def _required_lexemes(node) -> List[Tuple[str, List[str]]]:
+    """一致するなら必ず現れるトークンの語彙素副問い合わせ"""
+    kind = node[0]
+    if kind == 'token':
+        lexemes = _condition_lexemes(node[1])
+        return [lexemes] if lexemes else []
+    if kind == 'seq':
+        return [lexemes for child in node[1] for lexemes in _required_lexemes(child)]
+    if kind == 'repeat':
+        return _required_lexemes(node[1]) if node[2] >= 1 else []
+    # 選択: 全ての分岐に必須トークンがあれば、各分岐の1つ目の和集合
+    branches = [_required_lexemes(child) for child in node[1]]
+    if not all(branches):
+        return []
+    return [_combine_lexemes(' UNION ', [branch[0] for branch in branches])]
+
+
+def _length(node) -> Tuple[int, Optional[int]]:
+    """node が一致するトークン数の範囲 (最小, 最大 | None=上限なし)"""
+    kind = node[0]
+    if kind == 'token':
+        return 1, 1
+    if kind == 'repeat':
+        low, high = _length(node[1])
+        maximum = node[3]
+        return low * node[2], None if high is None or maximum is None else high * maximum
+    lengths = [_length(child) for child in node[1]]
+    highs = [high for _, high in lengths]
+    if kind == 'seq':
+        return sum(low for low, _ in lengths), None if None in highs else sum(highs)
+    return min(low for low, _ in lengths), None if None in highs else max(highs)
+
+
+def _anchors(tree) -> List[Tuple[str, List[str], int, Optional[int]]]:
+    """
+    候補位置の絞り込みに使う必須トークン (語彙素副問い合わせ, 引数, 最小距離, 最大距離)
+
+    距離は一致の開始位置から必須トークンまでのトークン数の範囲（None は上限なし）。
+    必須トークンの出現位置から、一致が始まりうる位置だけを調べられる。
+    """
+    items = tree[1] if tree[0] == 'seq' else [tree]
+    anchors = []
+    low, high = 0, 0
+    for item in items:
+        item_low, item_high = _length(item)
+        end = None if high is None or item_high is None else high + item_high - 1
+        if item[0] == 'token':
+            end = high
+        for sql, params in _required_lexemes(item):
+            anchors.append((sql, params, low, end))
+        low += item_low
+        high = None if high is None or item_high is None else high + item_high
+    return anchors
+
+
+class Pattern:
+    """
+    コンパイル済みのパターン
+
+    構文木を NFA（トークン判定・分岐・終了の状態）に変換し、開始位置ごとに
+    状態集合を進めて最短の一致を求める。
+    """
+
+    _TOKEN, _SPLIT, _MATCH = range(3)
+    _TRANSITION_CACHE_SIZE = 4096
+
+    def __init__(self, text: str):
+        self.text = text
+        self.tree = _PatternParser(text).parse()
+        self.anchors = _anchors(self.tree)
+        # 状態: [種類, 判定関数, 次の状態, 分岐先]
+        self._states: List[list] = [[self._MATCH, None, None, None]]
+        self._start = self._build(self.tree, 0)
+        self._transition_cache: Dict[frozenset, Tuple] = {}
+
+    def _state(self, kind: int, test=None, out: Optional[int] = None, alt: Optional[int] = None) -> int:
+        self._states.append([kind, test, out, alt])
+        return len(self._states) - 1
+
+    def _build(self, node, next_state: int) -> int:
+        """node の後に next_state へ続く状態を作り、開始状態を返す（後ろから組み立てる）"""
+        kind = node[0]
+        if kind == 'token':
+            return self._state(self._TOKEN, _predicate(node[1]), next_state)
+        if kind == 'seq':
+            for child in reversed(node[1]):
+                next_state = self._build(child, next_state)
+            return next_state
+        if kind == 'alt':
+            starts = [self._build(child, next_state) for child in node[1]]
+            start = starts[-1]
+            for branch in reversed(starts[:-1]):
+                start = self._state(self._SPLIT, None, branch, start)
+            return start
+        _, child, minimum, maximum = node
+        if maximum is None:
+            loop = self._state(self._SPLIT, None, None, next_state)
+            self._states[loop][2] = self._build(child, loop)
+            rest = loop
+        else:
+            rest = next_state
+            for _ in range(maximum - minimum):
+                rest = self._state(self._SPLIT, None, self._build(child, rest), next_state)
+        for _ in range(minimum):
+            rest = self._build(child, rest)
+        return rest
+
+    def _closure(self, states: Iterable[int]) -> set:
+        """分岐をたどって到達できる状態の集合"""
+        result = set()
+        stack = list(states)
+        while stack:
+            state = stack.pop()
+            if state in result:
+                continue
+            result.add(state)
+            kind, _, out, alt = self._states[state]
+            if kind == self._SPLIT:
+                stack.append(out)
+                stack.append(alt)
+        return result
+
+    def _transitions(self, states: Iterable[int]) -> Tuple[Tuple[Tuple[Callable[[Token], bool], int], ...], bool]:
+        """状態集合から進める (判定関数, 次の状態) の一覧と、終了状態に達しているか（集合ごとに記憶）"""
+        key = frozenset(states)
+        cached = self._transition_cache.get(key)
+        if cached is None:
+            if len(self._transition_cache) >= self._TRANSITION_CACHE_SIZE:
+                self._transition_cache.clear()
+            reachable = self._closure(key)
+            cached = self._transition_cache[key] = (
+                tuple((self._states[state][1], self._states[state][2]) for state in sorted(reachable)
+                      if self._states[state][0] == self._TOKEN),
+                0 in reachable)
+        return cached
+
+    def match_at(self, tokens: List[Token], start: int) -> Optional[int]:
+        """tokens[start:] の先頭から一致する最短の終了位置（1トークン以上、なければ None）"""
+        transitions, _ = self._transitions((self._start,))
+        position = start
+        while position < len(tokens):
+            token = tokens[position]
+            advanced = [out for test, out in transitions if test(token)]
+            if not advanced:
+                return None
+            transitions, matched = self._transitions(advanced)
+            position += 1
+            if matched:
+                return position
+        return None
+
+    def finditer(self, tokens: List[Token], starts: Optional[Iterable[int]] = None) -> Iterator[Tuple[int, int]]:
+        """
+        各開始位置からの最短一致 (開始, 終了) を順に返す（重なりを含む）
+        starts を指定するとその開始位置（昇順）だけを調べる
+        """
+        for start in range(len(tokens)) if starts is None else starts:
+            end = self.match_at(tokens, start)
+            if end is not None:
+                yield start, end
+
+
+def compile_pattern(text: str) -> Pattern:
+    """パターン文字列をコンパイル（構文エラーは PatternSyntaxError）"""
+    return Pattern(text)
+
+
+def _candidate_documents(pattern: Pattern, tags: Optional[List[str]], era: Optional[str]
+                         ) -> Tuple[List[int], Optional[Tuple[str, List[str], int, Optional[int]]]]:
+    """
+    パターンを評価する文書と、候補位置を求めるための必須トークン
+
+    必須トークンが語彙索引で引ける場合は、全ての必須トークンを含む文書に絞り、
+    最も出現数の少ない必須トークンの周辺だけを評価する。引けない場合は
+    絞り込み条件に合う全文書を評価する（必須トークンは None）。
+    """
+    doc_sql, doc_params = _document_filter(tags, era)
+    conn = document_manager.get_registry_connection()
+    try:
+        if not pattern.anchors:
+            rows = conn.execute(f'''
+                SELECT document_id FROM (SELECT id AS document_id FROM documents WHERE status = ?)
+                WHERE 1 {doc_sql} ORDER BY document_id
+            ''', [document_manager.DOCUMENT_COMPLETE] + list(doc_params))
+            return [row[0] for row in rows], None
+
+        documents = None
+        rarest = None
+        for anchor in pattern.anchors:
+            sql, params = anchor[:2]
+            counts = dict(conn.execute(f'''
+                SELECT document_id, SUM(token_count) FROM postings
+                WHERE lexeme_id IN ({sql}) {doc_sql} GROUP BY document_id
+            ''', params + doc_params).fetchall())
+            documents = set(counts) if documents is None else documents & set(counts)
+            total = sum(counts.values())
+            if rarest is None or total < rarest[0]:
+                rarest = (total, anchor)
+        return sorted(documents), rarest[1]
+    finally:
+        conn.close()
+
+
+def _candidate_starts(doc_id: int, anchor: Tuple[str, List[str], int, Optional[int]]) -> Dict[int, List[int]]:
+    """文書内で一致が始まりうる位置: 段落番号 -> 開始位置（必須トークンの出現位置から求める）"""
+    sql, params, low, high = anchor
+    conn = document_manager.get_registry_connection()
+    try:
+        starts: Dict[int, set] = {}
+        for (blob,) in conn.execute(f'''
+                SELECT positions FROM postings WHERE document_id = ? AND lexeme_id IN ({sql})
+                ''', [doc_id] + params):
+            positions = document_manager.unpack_positions(blob)
+            for para_idx, token_idx in zip(positions[0::2], positions[1::2]):
+                first = 0 if high is None else max(0, token_idx - high)
+                starts.setdefault(para_idx, set()).update(range(first, token_idx - low + 1))
+    finally:
+        conn.close()
+    return {para_idx: sorted(starts[para_idx]) for para_idx in sorted(starts)}
+
+
+def _iter_paragraph_tokens(document, starts: Optional[Dict[int, List[int]]]
+                           ) -> Iterator[Tuple[int, List[Token], Optional[List[int]]]]:
+    """(段落番号, トークン列, 開始位置) を順に返す（starts が None なら全段落の全位置）"""
+    if starts is None:
+        for para in document.iter_paragraphs():
+            yield para['paragraph_index'], para['tokens'], None
+        return
+    for para_idx, tokens in zip(starts, document.token_ranges(
+            (para_idx, 0, sys.maxsize) for para_idx in starts)):
+        yield para_idx, tokens, starts[para_idx]
+
+
+def iter_pattern_matches(pattern, tags: Optional[List[str]] = None, era: Optional[str] = None,
+                         within: str = 'paragraph', window: int = DEFAULT_WINDOW) -> Iterator[Dict[str, Any]]:
+    """
+    パターンに一致する箇所を文書ID・段落・位置の順に逐次返す
+
+    Args:
+        pattern: パターン文字列またはコンパイル済みの Pattern
+        tags: いずれかのタグを持つ文書に限定
+        era: 時代で限定
+        within: 一致の範囲（'paragraph' または 'sentence'、文は句点で区切る）
+        window: 前後文脈のトークン数
+
+    Yields:
+        {document_id, title, paragraph_index, start, end, left, match, right}
+        start・end は段落内のトークン番号（end は含まない）
+    """
+    if not isinstance(pattern, Pattern):
+        pattern = compile_pattern(pattern)
+    if within not in PATTERN_SCOPES:
+        raise ValueError(f"不明な範囲: {within}")
+    window = max(0, min(window, MAX_WINDOW))
+
+    documents, anchor = _candidate_documents(pattern, tags, era)
+    for doc_id in documents:
+        document = document_manager.open_document(doc_id)
+        if document is None or not document.exists():
+            continue
+        candidates = _candidate_starts(doc_id, anchor) if anchor else None
+        for para_idx, tokens, starts in _iter_paragraph_tokens(document, candidates):
+            spans = sentence_spans(tokens) if within == 'sentence' else [(0, len(tokens))]
+            for span_start, span_end in spans:
+                span_starts = None if starts is None else [
+                    start - span_start for start in starts if span_start <= start < span_end]
+                for start, end in pattern.finditer(tokens[span_start:span_end], span_starts):
+                    start += span_start
+                    end += span_start
+                    yield {
+                        'document_id': doc_id,
+                        'title': document.title,
+                        'paragraph_index': para_idx,
+                        'start': start,
+                        'end': end,
+                        'left': ''.join(token.surface for token in tokens[max(0, start - window):start]),
+                        'match': ''.join(token.surface for token in tokens[start:end]),
+                        'right': ''.join(token.surface for token in tokens[end:end + window])
+                    }
+
+
+# ===== 頻度表 =====
+
+# 上位 N 件の既定値と、JSON で返す最大件数
+DEFAULT_TOP = 100
+MAX_TOP = 10000
+
+
+def frequencies(field: str = 'lemma', document_id: Optional[int] = None, tags: Optional[List[str]] = None,
+                era: Optional[str] = None, prefix: Optional[str] = None, level: Optional[int] = None,
+                min_count: int = 1, limit: Optional[int] = DEFAULT_TOP, offset: int = 0) -> Dict[str, Any]:
+    """
+    頻度表（document_manager の frequencies / corpus_frequencies）を頻度順に取得
+
+    絞り込みがなければライブラリ全体の集計表をそのまま読み、文書・タグ・時代で絞る時は
+    該当文書の頻度表を合計する。
+
+    Args:
+        field: 集計キー（document_manager.FREQUENCY_FIELDS: surface, lemma, reading, pos, ctype, cform）
+        document_id: 1文書に限定
+        tags: いずれかのタグを持つ文書に限定
+        era: 時代で限定
+        prefix: 値の前方一致（pos の '動詞' で動詞の下位分類など）
+        level: 階層のあるキー（pos, ctype, cform）で返す階層（1 が最上位）
+        min_count: 最小出現数
+        limit: 返す最大件数（None で全件）
+        offset: 読み飛ばす件数（ページング）
+
+    Returns:
+        {'field': キー, 'total_tokens': 対象のトークン数, 'distinct': 条件に合う値の数,
+         'rows': [{value, count, documents, per_million}, ...]}
+    """
+    if field not in document_manager.FREQUENCY_FIELDS:
+        raise ValueError(f"不明な集計キー: {field}")
+    if level is not None and field not in document_manager.HIERARCHICAL_FIELDS:
+        raise ValueError(f"{field} には階層がありません")
+
+    value_sql = ''
+    value_params: List[Any] = []
+    if prefix:
+        # 前方一致を範囲条件にして主キーの索引を使う
+        value_sql += ' AND value >= ? AND value < ?'
+        value_params.extend([prefix, prefix + '\U0010ffff'])
+    if level is not None:
+        value_sql += " AND length(value) - length(replace(value, '-', '')) = ?"
+        value_params.append(max(level, 1) - 1)
+
+    doc_sql, doc_params = _document_filter(tags, era)
+    if document_id is not None:
+        doc_sql += ' AND document_id = ?'
+        doc_params.append(document_id)
+
+    if doc_sql:
+        source = f'''
+            (SELECT value, SUM(token_count) AS token_count, COUNT(*) AS document_count FROM frequencies
+             WHERE field = ? {value_sql} {doc_sql} GROUP BY value)
+        '''
+        source_params = [field] + value_params + doc_params
+        total_sql = f"SELECT COALESCE(SUM(token_count), 0) FROM frequencies WHERE field = 'surface' {doc_sql}"
+        where = 'WHERE token_count >= ?'
+        where_params = [min_count]
+    else:
+        source = 'corpus_frequencies'
+        source_params = []
+        total_sql = "SELECT COALESCE(SUM(token_count), 0) FROM corpus_frequencies WHERE field = 'surface'"
+        where = f'WHERE field = ? {value_sql} AND token_count >= ?'
+        where_params = [field] + value_params + [min_count]
+
+    conn = document_manager.get_registry_connection()
+    try:
+        total = conn.execute(total_sql, doc_params).fetchone()[0]
+        distinct = conn.execute(f'SELECT COUNT(*) FROM {source} {where}',
+                                source_params + where_params).fetchone()[0]
+        rows = conn.execute(f'''
+            SELECT value, token_count, document_count FROM {source} {where}
+            ORDER BY token_count DESC, value LIMIT ? OFFSET ?
+        ''', source_params + where_params + [-1 if limit is None else limit, offset]).fetchall()
+    finally:
+        conn.close()
+
+    return {
+        'field': field,
+        'total_tokens': total,
+        'distinct': distinct,
+        'rows': [{
+            'value': value,
+            'count': count,
+            'documents': documents,
+            'per_million': round(count * 1000000 / total, 2) if total else 0.0
+        } for value, count, documents in rows]
+    }
+
+
+# ===== 集計キューブ =====
+
+def _truncate(value: str, level: Optional[int]) -> str:
+    """階層のある値を上位 level 階層までに切り詰める"""
+    if not level or not value:
+        return value
+    return '-'.join(value.split('-')[:level])
+
+
+def cube(by: Iterable[str], where: Optional[Dict[str, str]] = None,
+         levels: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+    """
+    集計キューブ（document_manager の feature_cube）の切り出しと集約
+
+    例: 助動詞の活用形の時代別分布
+        cube(['era', 'cform'], where={'pos': '助動詞'}, levels={'cform': 1})
+
+    複数の時代・文体タグを持つ文書は各組合せに数えられるため、時代や文体で集約した合計は
+    ライブラリのトークン数を超えることがある。
+
+    Args:
+        by: 集計する次元（document_manager.CUBE_DIMENSIONS: era, style, pos, ctype, cform）。
+            指定しない次元は合計される
+        where: 次元 -> 値 の切り出し条件。pos・ctype・cform は上位の分類でも指定できる
+            （pos=助動詞 で助動詞全体）、空文字列は「未設定」
+        levels: pos・ctype・cform の集計階層（1 が最上位、省略時は最下位）
+
+    Returns:
+        {'dimensions': 集計次元, 'total': トークン数の合計,
+         'cells': [{次元: 値, ..., 'count': トークン数}, ...]}（トークン数の多い順）
+    """
+    by = list(by)
+    where = {dim: value for dim, value in (where or {}).items() if value is not None}
+    levels = {dim: level for dim, level in (levels or {}).items() if level}
+    for dim in by + list(where) + list(levels):
+        if dim not in document_manager.CUBE_DIMENSIONS:
+            raise ValueError(f"不明な次元: {dim}")
+    for dim in levels:
+        if dim not in document_manager.CUBE_TOKEN_DIMENSIONS:
+            raise ValueError(f"{dim} には階層がありません")
+    if len(set(by)) != len(by):
+        raise ValueError("集計次元が重複しています")
+
+    conditions = []
+    params: List[str] = []
+    for dim, value in where.items():
+        if dim in document_manager.CUBE_TOKEN_DIMENSIONS and value:
+            # 値そのものか、その下位分類（'-' 区切り）
+            conditions.append(f'({dim} = ? OR ({dim} >= ? AND {dim} < ?))')
+            params.extend([value, value + '-', value + '-\U0010ffff'])
+        else:
+            conditions.append(f'{dim} = ?')
+            params.append(value)
+    where_sql = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    columns = ', '.join(by)
+
+    conn = document_manager.get_registry_connection()
+    try:
+        rows = conn.execute(f'''
+            SELECT {columns + ', ' if by else ''}SUM(token_count) FROM feature_cube {where_sql}
+            {'GROUP BY ' + columns if by else ''}
+        ''', params).fetchall()
+    finally:
+        conn.close()
+
+    # 階層の切り詰めは SQL で集約した後に行う（キューブ自体が小さいため）
+    counts: Dict[Tuple[str, ...], int] = {}
+    for row in rows:
+        if row[-1] is None:
+            continue
+        key = tuple(_truncate(value, levels.get(dim)) for dim, value in zip(by, row))
+        counts[key] = counts.get(key, 0) + row[-1]
+    cells = [dict(zip(by, key), count=count)
+             for key, count in sorted(counts.items(), key=lambda item: (-item[1], item[0]))]
+    return {'dimensions': by, 'total': sum(counts.values()), 'cells': cells}
+
+
+# ===== N-gram・コロケーション =====
+
+DEFAULT_COLLOCATION_WINDOW = 4
+MAX_COLLOCATION_WINDOW = 10
+COLLOCATION_SIDES = ('both', 'left', 'right')
+COLLOCATION_MEASURES = ('log_likelihood', 'pmi', 't_score')
+
+
+def _escape_like(text: str) -> str:
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def ngrams(kind: str = 'lemma', n: int = 2, starts: Optional[str] = None, contains: Optional[str] = None,
+           min_count: int = 2, min_documents: int = 1, limit: int = 100, offset: int = 0) -> Dict[str, Any]:
+    """
+    N-gram 索引（document_manager の ngrams）を頻度順に取得
+
+    索引は全文書の N-gram の正確な合計（prune_ngrams で剪枝した後は、剪枝後に現れた分の下限）。
+
+    Args:
+        kind: 'surface'（表層形）または 'lemma'（基本形）
+        n: 長さ（2～5）
+        starts: 先頭の語（空白区切りで複数語も可）
+        contains: 含む語（空白区切りで連続する複数語も可）
+        min_count: 最小出現数
+        min_documents: 最小出現文書数
+        limit: 返す最大件数
+        offset: 読み飛ばす件数（ページング）
+
+    Returns:
+        {'kind', 'n', 'total': 条件に合う N-gram 数,
+         'rows': [{gram: 語のリスト, count, documents}, ...]}
+    """
+    if kind not in document_manager.NGRAM_KINDS:
+        raise ValueError(f"不明な種類: {kind}")
+    if n not in document_manager.NGRAM_SIZES:
+        raise ValueError(f"N-gram の長さは {min(document_manager.NGRAM_SIZES)}～{max(document_manager.NGRAM_SIZES)}")
+
+    separator = document_manager.NGRAM_SEPARATOR
+    sql = 'WHERE kind = ? AND n = ? AND token_count >= ? AND document_count >= ?'
+    params: List[Any] = [kind, n, min_count, min_documents]
+    if starts:
+        prefix = separator.join(starts.split())
+        sql += ' AND (gram = ? OR (gram >= ? AND gram < ?))'
+        params.extend([prefix, prefix + separator, prefix + separator + '\U0010ffff'])
+    if contains:
+        words = separator.join(contains.split())
+        sql += " AND (? || gram || ?) LIKE ? ESCAPE '\\'"
+        params.extend([separator, separator, f'%{separator}{_escape_like(words)}{separator}%'])
+
+    conn = document_manager.get_registry_connection()
+    try:
+        total = conn.execute(f'SELECT COUNT(*) FROM ngrams {sql}', params).fetchone()[0]
+        rows = conn.execute(f'''
+            SELECT gram, token_count, document_count FROM ngrams {sql}
+            ORDER BY token_count DESC, gram LIMIT ? OFFSET ?
+        ''', params + [limit, offset]).fetchall()
+    finally:
+        conn.close()
+    return {
+        'kind': kind,
+        'n': n,
+        'total': total,
+        'rows': [{'gram': gram.split(separator), 'count': count, 'documents': documents}
+                 for gram, count, documents in rows]
+    }
+
+
+def _association(observed: int, node_count: int, collocate_count: int, total: int, span: int) -> Dict[str, float]:
+    """
+    共起の強さ（窓内の共起回数 observed、中心語と共起語の頻度、総語数、窓の幅から）
+
+    期待値は node_count * span 語の窓に collocate_count / total の確率で現れるとして求め、
+    対数尤度比は 2×2 分割表による（共起が期待値より少ない時は負）。
+    """
+    expected = node_count * collocate_count * span / total
+    window_tokens = node_count * span
+    cells = (
+        (observed, expected),
+        (window_tokens - observed, window_tokens - expected),
+        (collocate_count - observed, collocate_count - expected),
+        (total - window_tokens - collocate_count + observed, total - window_tokens - collocate_count + expected),
+    )
+    g2 = 2 * sum(o * math.log(o / e) for o, e in cells if o > 0 and e > 0)
+    return {
+        'expected': expected,
+        'log_likelihood': g2 if observed >= expected else -g2,
+        'pmi': math.log2(observed / expected),
+        't_score': (observed - expected) / math.sqrt(observed)
+    }
+
+
+def collocations(lemma: str, window: int = DEFAULT_COLLOCATION_WINDOW, side: str = 'both',
+                 measure: str = 'log_likelihood', min_count: int = 3, limit: int = 50) -> Dict[str, Any]:
+    """
+    中心語（基本形）の共起語を共起の強さの順に取得
+
+    中心語の出現位置は語彙索引（postings）から、その前後の語は文書ごとの基本形の列
+    （document_manager の lemma_sequences）から読むため、文書データベースは開かない。
+    窓は句読点と段落の境界で切れる。
+
+    Args:
+        lemma: 中心語の基本形
+        window: 片側の窓の語数（1～MAX_COLLOCATION_WINDOW）
+        side: 'both'（前後）、'left'（前のみ）、'right'（後のみ）
+        measure: 並べ替えの指標（'log_likelihood', 'pmi', 't_score'）
+        min_count: 最小共起回数
+        limit: 返す最大件数
+
+    Returns:
+        {'lemma', 'window', 'side', 'measure', 'node_count': 中心語の出現数, 'total_tokens': 総語数,
+         'total': 条件に合う共起語の数,
+         'collocates': [{lemma, count, frequency, expected, log_likelihood, pmi, t_score}, ...]}
+    """
+    if side not in COLLOCATION_SIDES:
+        raise ValueError(f"不明な範囲: {side}")
+    if measure not in COLLOCATION_MEASURES:
+        raise ValueError(f"不明な指標: {measure}")
+    window = max(1, min(window, MAX_COLLOCATION_WINDOW))
+    lexeme_sql, lexeme_params = _lexeme_subquery({'lemma': lemma})
+    result = {'lemma': lemma, 'window': window, 'side': side, 'measure': measure,
+              'node_count': 0, 'total_tokens': 0, 'total': 0, 'collocates': []}
+
+    conn = document_manager.get_registry_connection()
+    try:
+        positions: Dict[int, List[array]] = {}
+        for doc_id, blob in conn.execute(f'''
+            SELECT document_id, positions FROM postings WHERE lexeme_id IN ({lexeme_sql})
+        ''', lexeme_params):
+            positions.setdefault(doc_id, []).append(document_manager.unpack_positions(blob))
+        if not positions:
+            return result
+
+        counts: Counter = Counter()
+        node_count = 0
+        for doc_id, blob, starts_blob in conn.execute('''
+            SELECT document_id, lemmas, paragraph_starts FROM lemma_sequences
+            WHERE document_id IN (SELECT value FROM json_each(?))
+        ''', (json.dumps(list(positions)),)):
+            sequence = document_manager.unpack_positions(blob)
+            starts = document_manager.unpack_positions(starts_blob)
+            for values in positions[doc_id]:
+                for para_idx, token_idx in zip(values[0::2], values[1::2]):
+                    if para_idx >= len(starts):
+                        continue
+                    node_count += 1
+                    center = starts[para_idx] + token_idx
+                    if side != 'left':
+                        for term_id in sequence[center + 1:center + 1 + window]:
+                            if not term_id:
+                                break
+                            counts[term_id] += 1
+                    if side != 'right':
+                        for term_id in reversed(sequence[max(0, center - window):center]):
+                            if not term_id:
+                                break
+                            counts[term_id] += 1
+
+        total = conn.execute('SELECT COALESCE(SUM(token_count), 0) FROM lemma_terms').fetchone()[0]
+        candidates = [term_id for term_id, count in counts.items() if count >= min_count]
+        terms = conn.execute('''
+            SELECT id, lemma, token_count FROM lemma_terms WHERE id IN (SELECT value FROM json_each(?))
+        ''', (json.dumps(candidates),)).fetchall()
+    finally:
+        conn.close()
+
+    span = window * (2 if side == 'both' else 1)
+    collocates = []
+    for term_id, collocate, frequency in terms:
+        scores = _association(counts[term_id], node_count, frequency, total, span)
+        collocates.append(dict({'lemma': collocate, 'count': counts[term_id], 'frequency': frequency},
+                               **{key: round(value, 3) for key, value in scores.items()}))
+    collocates.sort(key=lambda item: (-item[measure], item['lemma']))
+    return dict(result, node_count=node_count, total_tokens=total, total=len(collocates),
+                collocates=collocates[:limit])
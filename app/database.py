@@ -1,213 +1,122 @@
 """
-データベースモジュール - SQLiteで解析結果を保存
+旧データベース移行モジュール - data/komachi.db の文書を文書ライブラリへ移す
+
+解析ページと /api/analyze、/api/documents は以前このデータベースに保存していたが、
+現在は文書ライブラリ（document_manager）に保存する。既存の文書は内容ハッシュ
+（原文と辞書）で重複を除きながらライブラリへ移し、全文書の移行後にファイルを
+komachi.db.migrated へ改名して残す（移行結果を確かめた後で手動で削除できる）。
+保存済みの解析結果をそのまま移すので、再解析はしない。
 """
-import sqlite3
-import json
-import hashlib
 import os
-from datetime import datetime
-from typing import Optional, List, Dict, Any
+import threading
+import time
+from itertools import groupby
+from typing import Any, Callable, Dict, Iterator, Optional
 
-DATABASE_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "komachi.db")
+from . import connections, document_manager
+from .tokens import Token, features_from_json
 
+DATABASE_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "komachi.db")
+# 移行し終えた旧データベースの改名先（既にあれば .migrated.1, .migrated.2 ...）
+MIGRATED_SUFFIX = ".migrated"
 
-def get_db_connection():
-    """データベース接続を取得"""
-    os.makedirs(os.path.dirname(DATABASE_PATH), exist_ok=True)
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-
-def init_db():
-    """データベーステーブルを初期化"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # ドキュメントテーブル - 原文を保存
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS documents (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT NOT NULL,
-            content TEXT NOT NULL,
-            content_hash TEXT UNIQUE NOT NULL,
-            dictionary TEXT DEFAULT 'unidic-chuko',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # 段落テーブル - 分割された段落を保存
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS paragraphs (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            document_id INTEGER NOT NULL,
-            paragraph_index INTEGER NOT NULL,
-            content TEXT NOT NULL,
-            FOREIGN KEY (document_id) REFERENCES documents(id) ON DELETE CASCADE
-        )
-    ''')
-    
-    # トークン解析結果テーブル
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS tokens (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            paragraph_id INTEGER NOT NULL,
-            token_index INTEGER NOT NULL,
-            surface TEXT NOT NULL,
-            features TEXT NOT NULL,
-            FOREIGN KEY (paragraph_id) REFERENCES paragraphs(id) ON DELETE CASCADE
-        )
-    ''')
-    
-    # インデックスを作成
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_documents_hash ON documents(content_hash)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_paragraphs_doc ON paragraphs(document_id)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_tokens_para ON tokens(paragraph_id)')
-    
-    conn.commit()
-    conn.close()
+# 移行はプロセス内で同時に1つだけ実行する
+_migrate_lock = threading.Lock()
 
 
-def compute_hash(content: str, dictionary: str) -> str:
-    """コンテンツのハッシュ値を計算（辞書情報を含む）"""
-    combined = f"{content}|{dictionary}"
-    return hashlib.sha256(combined.encode('utf-8')).hexdigest()
+def legacy_database_exists() -> bool:
+    """移行していない旧データベースが残っているか"""
+    return os.path.exists(DATABASE_PATH)
 
 
-def find_document_by_hash(content_hash: str) -> Optional[Dict[str, Any]]:
-    """ハッシュで解析済みドキュメントを検索"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM documents WHERE content_hash = ?', (content_hash,))
-    row = cursor.fetchone()
-    conn.close()
-    
-    if row:
-        return dict(row)
-    return None
-
-
-def save_document(title: str, content: str, dictionary: str, paragraphs: List[Dict]) -> int:
-    """ドキュメントと解析結果を保存"""
-    content_hash = compute_hash(content, dictionary)
-    
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    try:
-        # ドキュメントを挿入
-        cursor.execute('''
-            INSERT INTO documents (title, content, content_hash, dictionary)
-            VALUES (?, ?, ?, ?)
-        ''', (title, content, content_hash, dictionary))
-        document_id = cursor.lastrowid
-        
-        # 段落とトークンを挿入
-        for para_idx, para in enumerate(paragraphs):
-            cursor.execute('''
-                INSERT INTO paragraphs (document_id, paragraph_index, content)
-                VALUES (?, ?, ?)
-            ''', (document_id, para_idx, para['content']))
-            paragraph_id = cursor.lastrowid
-            
-            # トークンを挿入
-            for token_idx, token in enumerate(para['tokens']):
-                cursor.execute('''
-                    INSERT INTO tokens (paragraph_id, token_index, surface, features)
-                    VALUES (?, ?, ?, ?)
-                ''', (paragraph_id, token_idx, token['surface'], json.dumps(token['features'], ensure_ascii=False)))
-        
-        conn.commit()
-        return document_id
-    except sqlite3.IntegrityError:
-        # ハッシュ衝突、ドキュメントは既に存在
-        conn.rollback()
-        existing = find_document_by_hash(content_hash)
-        return existing['id'] if existing else -1
-    finally:
-        conn.close()
-
-
-def get_document_with_analysis(document_id: int) -> Optional[Dict[str, Any]]:
-    """ドキュメントと完全な解析結果を取得"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # ドキュメントを取得
-    cursor.execute('SELECT * FROM documents WHERE id = ?', (document_id,))
-    doc_row = cursor.fetchone()
-    if not doc_row:
-        conn.close()
-        return None
-    
-    document = dict(doc_row)
-    document['paragraphs'] = []
-    
-    # 段落を取得
-    cursor.execute('''
-        SELECT * FROM paragraphs WHERE document_id = ? ORDER BY paragraph_index
+def _iter_paragraphs(conn, document_id: int) -> Iterator[Dict[str, Any]]:
+    """旧データベースの段落を解析結果ごと1段落ずつ読み込む（文境界は保存時に計算される）"""
+    rows = conn.execute('''
+        SELECT p.id, p.content, t.surface, t.features
+        FROM paragraphs p
+        LEFT JOIN tokens t ON t.paragraph_id = p.id
+        WHERE p.document_id = ?
+        ORDER BY p.paragraph_index, t.token_index
     ''', (document_id,))
-    para_rows = cursor.fetchall()
-    
-    for para_row in para_rows:
-        paragraph = dict(para_row)
-        paragraph['tokens'] = []
-        
-        # トークンを取得
-        cursor.execute('''
-            SELECT * FROM tokens WHERE paragraph_id = ? ORDER BY token_index
-        ''', (para_row['id'],))
-        token_rows = cursor.fetchall()
-        
-        for token_row in token_rows:
-            token = dict(token_row)
-            token['features'] = json.loads(token['features'])
-            paragraph['tokens'].append(token)
-        
-        document['paragraphs'].append(paragraph)
-    
-    conn.close()
-    return document
-
-
-def list_documents() -> List[Dict[str, Any]]:
-    """全ドキュメントを一覧表示"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT id, title, dictionary, created_at, 
-               (SELECT COUNT(*) FROM paragraphs WHERE document_id = documents.id) as paragraph_count
-        FROM documents 
-        ORDER BY updated_at DESC
-    ''')
-    rows = cursor.fetchall()
-    conn.close()
-    return [dict(row) for row in rows]
-
-
-def delete_document(document_id: int) -> bool:
-    """ドキュメントと関連データを削除"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # ON DELETE CASCADE が設定されているため、ドキュメントを削除するだけでよい
-    cursor.execute('DELETE FROM documents WHERE id = ?', (document_id,))
-    affected = cursor.rowcount
+    for _, group in groupby(rows, key=lambda r: r['id']):
+        group = list(group)
+        yield {
+            'content': group[0]['content'],
+            'tokens': [Token(row['surface'], features_from_json(row['features']))
+                       for row in group if row['surface'] is not None],
+        }
+
+
+def _backup_path() -> str:
+    """旧データベースの改名先（既存の改名済みファイルは上書きしない）"""
+    path = DATABASE_PATH + MIGRATED_SUFFIX
+    number = 0
+    while os.path.exists(path):
+        number += 1
+        path = f"{DATABASE_PATH}{MIGRATED_SUFFIX}.{number}"
+    return path
+
+
+def _restore_timestamps(doc_id: int, created_at: str, updated_at: str):
+    """移行した文書の作成・更新日時を旧データベースの値に戻す"""
+    conn = document_manager.get_registry_connection()
+    conn.execute('UPDATE documents SET created_at = ?, updated_at = ? WHERE id = ?',
+                 (created_at, updated_at, doc_id))
     conn.commit()
     conn.close()
-    
-    return affected > 0
-
-
-def check_existing_analysis(content: str, dictionary: str) -> Optional[Dict[str, Any]]:
-    """同一コンテンツの解析結果が既にあるか確認"""
-    content_hash = compute_hash(content, dictionary)
-    doc = find_document_by_hash(content_hash)
-    if doc:
-        return get_document_with_analysis(doc['id'])
-    return None
 
 
-# データベースを初期化
-init_db()
+def migrate_to_library(progress: Optional[Callable[[Dict[str, Any], int, bool], None]] = None
+                       ) -> Dict[str, Any]:
+    """
+    旧データベースの全文書をライブラリへ移し、完了後に旧データベースを komachi.db.migrated へ改名する
+
+    同じ原文・辞書の文書が既にライブラリにあれば保存しない（重複として数える）。
+    1文書ずつ保存するので、中断しても再実行すれば続きから移行できる。
+
+    Args:
+        progress: 1文書ごとに (旧文書, ライブラリの文書ID, 重複か) を受け取る関数
+
+    Returns:
+        {'documents': 旧文書数, 'migrated': 移行数, 'duplicates': 重複数, 'seconds': 所要時間,
+         'backup': 改名後の旧データベースのパス（移行しなかった時は None）}
+    """
+    stats = {'documents': 0, 'migrated': 0, 'duplicates': 0, 'seconds': 0.0, 'backup': None}
+    with _migrate_lock:
+        if not legacy_database_exists():
+            return stats
+        start = time.time()
+        conn = connections.connect(DATABASE_PATH)
+        try:
+            # 原文は1文書ずつ読む（一覧には含めない）
+            documents = [dict(row) for row in conn.execute('''
+                SELECT id, title, dictionary, created_at, updated_at FROM documents ORDER BY id
+            ''')]
+            for doc in documents:
+                row = conn.execute('SELECT content FROM documents WHERE id = ?', (doc['id'],)).fetchone()
+                doc_id = document_manager.find_document_id(row['content'], doc['dictionary'])
+                duplicate = doc_id is not None
+                if duplicate:
+                    stats['duplicates'] += 1
+                else:
+                    doc_id = document_manager.save_document(
+                        doc['title'], row['content'], doc['dictionary'], _iter_paragraphs(conn, doc['id']))
+                    _restore_timestamps(doc_id, doc['created_at'], doc['updated_at'])
+                    stats['migrated'] += 1
+                if progress:
+                    progress(doc, doc_id, duplicate)
+            stats['documents'] = len(documents)
+            # 改名後も単独のファイルで読めるよう WAL の内容を本体へ書き戻しておく
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        finally:
+            conn.close()
+
+        # 全文書を移し終えたので、次回の起動で再び移行しないよう改名して残す（削除はしない）
+        connections.discard(DATABASE_PATH)
+        backup = _backup_path()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(DATABASE_PATH + suffix):
+                os.replace(DATABASE_PATH + suffix, backup + suffix)
+        stats['backup'] = backup
+        stats['seconds'] = time.time() - start
+    return stats
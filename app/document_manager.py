@@ -5,34 +5,140 @@
 import sqlite3
 import json
 import hashlib
+import html
 import os
+import re
 import shutil
+import sys
+import threading
+import time
+from array import array
+from collections import Counter
 from datetime import datetime
-from typing import Optional, List, Dict, Any
+from itertools import groupby, islice, product
+from typing import Optional, List, Dict, Any, Iterable, Iterator, Tuple
+
+from . import compression, connections
+from .tokens import Token, features_from_json, features_to_json, sentence_spans
 
 # 数据目录
 DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
 DOCUMENTS_DIR = os.path.join(DATA_DIR, "documents")
+SHARDS_DIR = os.path.join(DATA_DIR, "shards")
 REGISTRY_PATH = os.path.join(DATA_DIR, "registry.db")
 
+# 新文档的存储方式：
+#   shards - 按文档ID分配到固定数量的分片数据库（shards/shard_{n}.db），
+#            可用 connect_corpus() 把全部分片 ATTACH 到一起做跨文档查询
+#   files  - 每个文档一个数据库文件（documents/doc_{id}_{标题}.db）
+# 每个文档的存储位置记录在主索引的 db_filename 中，两种方式可以并存。
+# 重复的段落只在同一数据库内共用（见 _create_passage_tables），默认全部文档存入一个分片，
+# 整个文库中相同的段落只保存一份；分片数越多，同时写入不同文档时越少互相等待，但只在各分片内去重
+STORAGE_BACKEND = os.environ.get('KOMACHI_STORAGE', 'shards')
+SHARD_COUNT = int(os.environ.get('KOMACHI_SHARDS', 1))
+SHARD_FILENAME = "shard_{:02d}.db"
+STORAGE_BACKENDS = ('files', 'shards')
+
+# 原文、段落文本和词素特征的压缩方式（KOMACHI_COMPRESSION，只影响之后写入的值）：
+#   none - 不压缩
+#   zlib / zstd - 逐值压缩（原文每个文档一个值，段落文本每段一个值，读取一个段落只需解压该段落），
+#                 词素特征使用各数据库共享的训练字典
+#   auto - 安装了 zstandard 时用 zstd，否则用 zlib
+# 读取时按各值判断压缩方式（见 app/compression.py），不同方式写入的值可以并存，切换时不需要转换已有数据
+COMPRESSION = compression.resolve_method(os.environ.get('KOMACHI_COMPRESSION', 'none'))
+
+# 文档数据库的结构版本（记录在各文档数据库的 PRAGMA user_version 中）
+DOCUMENT_SCHEMA_VERSION = 7
+
+# 文境界索引的粒度（sentences 表的 level 列）
+SENTENCE_LEVEL = 0   # 句（以句点划分）
+CLAUSE_LEVEL = 1     # 文节（以句点和读点划分）
+
+# 批量写入时每次 executemany 的行数上限（控制逐段写入时的内存占用）
+BULK_BATCH_ROWS = 20000
+
+# 文档的保存状态（主索引 documents.status）：create_document 登记时为 saving，
+# iter_save_paragraphs 写完全部段落并建立索引后为 complete。保存中的文档不作为已有的分析结果返回
+DOCUMENT_SAVING = 'saving'
+DOCUMENT_COMPLETE = 'complete'
+# 保存中的文档每隔这么多秒更新一次 updated_at；超过 SAVE_STALE_SECONDS 没有更新的
+# 视为进程被终止后残留的文档（可以删除后重新保存）
+SAVE_HEARTBEAT_SECONDS = 30
+SAVE_STALE_SECONDS = 600
+
+
+class DocumentExists(Exception):
+    """同一内容（原文和辞书）的文档已登记，in_progress 表示该文档仍在保存中"""
+
+    def __init__(self, doc_id: int, in_progress: bool):
+        super().__init__(f"同一内容的文档{'正在保存中' if in_progress else '已存在'}: {doc_id}")
+        self.doc_id = doc_id
+        self.in_progress = in_progress
+
 
 def ensure_directories():
     """确保数据目录存在"""
     os.makedirs(DATA_DIR, exist_ok=True)
     os.makedirs(DOCUMENTS_DIR, exist_ok=True)
+    os.makedirs(SHARDS_DIR, exist_ok=True)
+
+
+def configure_storage(backend: str = None, shard_count: int = None, compression_method: str = None):
+    """
+    设置新文档的存储方式（已有文档不受影响）
+    
+    Args:
+        backend: 'files' 或 'shards'
+        shard_count: 分片数（只影响之后新建文档的分配，已分配的文档位置记录在主索引中）
+        compression_method: 'none'、'zlib'、'zstd' 或 'auto'（只影响之后写入的值）
+    """
+    global STORAGE_BACKEND, SHARD_COUNT, COMPRESSION
+    if backend is not None:
+        if backend not in STORAGE_BACKENDS:
+            raise ValueError(f"未知的存储方式: {backend}")
+        STORAGE_BACKEND = backend
+    if shard_count is not None:
+        if shard_count < 1:
+            raise ValueError("分片数必须大于 0")
+        SHARD_COUNT = shard_count
+    if compression_method is not None:
+        COMPRESSION = compression.resolve_method(compression_method)
+
+
+# 文档列表所读取的主索引表（这些表的写入会使列表缓存失效）
+_LISTING_TABLES = ('documents', 'tags', 'document_tags', 'document_metadata', 'document_layers')
+
+# 主索引数据库在首次使用时才初始化（缩短启动时间）
+_registry_initialized = False
+_registry_init_lock = threading.Lock()
+
+
+def _connect_registry():
+    """从连接池借出主索引数据库连接（不做初始化检查），用完后 close() 即归还"""
+    ensure_directories()
+    return connections.connect(REGISTRY_PATH)
+
+
+def ensure_registry():
+    """确保主索引数据库已初始化（每个进程只执行一次）"""
+    global _registry_initialized
+    if _registry_initialized:
+        return
+    with _registry_init_lock:
+        if not _registry_initialized:
+            init_registry()
+            _registry_initialized = True
 
 
 def get_registry_connection():
     """获取主索引数据库连接"""
-    ensure_directories()
-    conn = sqlite3.connect(REGISTRY_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    ensure_registry()
+    return _connect_registry()
 
 
 def init_registry():
     """初始化主索引数据库"""
-    conn = get_registry_connection()
+    conn = _connect_registry()
     cursor = conn.cursor()
     
     # 文档元数据表
@@ -45,11 +151,18 @@ def init_registry():
             dictionary TEXT DEFAULT 'unidic-chuko',
             paragraph_count INTEGER DEFAULT 0,
             token_count INTEGER DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'complete',
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     ''')
-    
+
+    # 旧版本的主索引没有保存状态：段落数为 0 的文档是中断的保存留下的，记为保存中（已超时，可被清除）
+    columns = [row[1] for row in cursor.execute('PRAGMA table_info(documents)')]
+    if 'status' not in columns:
+        cursor.execute("ALTER TABLE documents ADD COLUMN status TEXT NOT NULL DEFAULT 'complete'")
+        cursor.execute('UPDATE documents SET status = ? WHERE paragraph_count = 0', (DOCUMENT_SAVING,))
+
     # 标签表
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS tags (
@@ -92,11 +205,66 @@ def init_registry():
         )
     ''')
     
+    # 文档的附加分析层（同一原文用其他辞书分析的结果）
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS document_layers (
+            document_id INTEGER NOT NULL,
+            dictionary TEXT NOT NULL,
+            token_count INTEGER DEFAULT 0,
+            PRIMARY KEY (document_id, dictionary),
+            FOREIGN KEY (document_id) REFERENCES documents(id) ON DELETE CASCADE
+        )
+    ''')
+    
     # 创建索引
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_docs_hash ON documents(content_hash)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_doc_tags ON document_tags(document_id)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_tag_docs ON document_tags(tag_id)')
     
+    # 主索引的修改计数：列表相关的表有任何写入时由触发器加一，
+    # 其他进程（任务进程、批量导入）的写入也能使文档列表缓存失效
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS registry_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            generation INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('INSERT OR IGNORE INTO registry_state (id, generation) VALUES (1, 0)')
+    for table in _LISTING_TABLES:
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_generation
+                AFTER {event} ON {table}
+                BEGIN
+                    UPDATE registry_state SET generation = generation + 1 WHERE id = 1;
+                END
+            ''')
+    
+    # 段落全文检索（见 search_paragraphs）
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'search_paragraphs'")
+    search_created = cursor.fetchone() is None
+    _create_search_tables(cursor)
+
+    # 语料索引（检索键 -> 词元位置，见 lexeme_keys；旧版本的文库可能还没有 surface_lexemes）
+    cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE name IN ('postings', 'surface_lexemes')")
+    index_created = cursor.fetchone()[0] < 2
+    _create_corpus_index_tables(cursor)
+
+    # 频度表（见 FREQUENCY_FIELDS）
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'frequencies'")
+    frequencies_created = cursor.fetchone() is None
+    _create_frequency_tables(cursor)
+
+    # 聚合立方体（见 CUBE_DIMENSIONS）
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'feature_cube'")
+    cube_created = cursor.fetchone() is None
+    _create_cube_tables(cursor)
+
+    # N-gram 与搭配索引（见 NGRAM_SIZES）
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'ngrams'")
+    ngrams_created = cursor.fetchone() is None
+    _create_ngram_tables(cursor)
+
     # 插入预设标签类别
     default_categories = [
         ('era', '时代', '文本所属的历史时代'),
@@ -152,11 +320,219 @@ def init_registry():
             SELECT tag_id FROM document_tags
         )
     ''')
-    
+
+    # 旧版本的文库：首次创建的索引只记下需要补建的文档，由 backfill_indexes 在后台分批建立
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS index_backfill (
+            document_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            PRIMARY KEY (document_id, name)
+        ) WITHOUT ROWID
+    ''')
+    created = (search_created, index_created, frequencies_created, cube_created, ngrams_created)
+    cursor.executemany('''
+        INSERT OR IGNORE INTO index_backfill (document_id, name) SELECT id, ? FROM documents WHERE status = ?
+    ''', ((name, DOCUMENT_COMPLETE) for name, flag in zip(BACKFILL_INDEXES, created) if flag))
+
     conn.commit()
     conn.close()
 
 
+def _create_search_tables(cursor):
+    """
+    创建段落全文检索表
+
+    search_paragraphs 保存各文档的段落文本，paragraph_fts 是以它为外部内容的 FTS5 索引，
+    由触发器同步。trigram 分词器按字符三元组建索引，不需要分词，适合不加空格的古文。
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS search_paragraphs (
+            id INTEGER PRIMARY KEY,
+            document_id INTEGER NOT NULL,
+            paragraph_index INTEGER NOT NULL,
+            content TEXT NOT NULL,
+            UNIQUE (document_id, paragraph_index)
+        )
+    ''')
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS paragraph_fts USING fts5(
+            content, content='search_paragraphs', content_rowid='id', tokenize='trigram'
+        )
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_search_paragraphs_insert AFTER INSERT ON search_paragraphs
+        BEGIN
+            INSERT INTO paragraph_fts (rowid, content) VALUES (new.id, new.content);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_search_paragraphs_delete AFTER DELETE ON search_paragraphs
+        BEGIN
+            INSERT INTO paragraph_fts (paragraph_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        END
+    ''')
+
+
+def _create_corpus_index_tables(cursor):
+    """
+    创建语料索引表
+
+    corpus_lexemes 为全文库共用的词素编号，lexeme_keys 记录每个词素可被检索的键
+    （见 lexeme_keys 函数），postings 按 (词素, 文档) 保存该词素在文档主辞书层中的全部位置。
+    按键检索时先在词素表中求交集，再读取这些词素的位置列表，不需要打开文档数据库。
+    surface_lexemes 记录各表层形出现过的词素，按表层形检索时由它求出词素再读取位置列表
+    （所得位置包括同一词素的其他表层形，需再比对表层形）。删除文档时不减去，只会多出候选位置。
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS corpus_lexemes (
+            id INTEGER PRIMARY KEY,
+            features TEXT UNIQUE NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS lexeme_keys (
+            field TEXT NOT NULL,
+            value TEXT NOT NULL,
+            lexeme_id INTEGER NOT NULL,
+            PRIMARY KEY (field, value, lexeme_id)
+        ) WITHOUT ROWID
+    ''')
+    # positions: (段落序号, 段内词元序号) 依次排列的 32 位无符号整数（小端序）
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS postings (
+            lexeme_id INTEGER NOT NULL,
+            document_id INTEGER NOT NULL,
+            token_count INTEGER NOT NULL,
+            positions BLOB NOT NULL,
+            PRIMARY KEY (lexeme_id, document_id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_postings_doc ON postings(document_id)')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS surface_lexemes (
+            surface TEXT NOT NULL,
+            lexeme_id INTEGER NOT NULL,
+            PRIMARY KEY (surface, lexeme_id)
+        ) WITHOUT ROWID
+    ''')
+
+
+def _create_frequency_tables(cursor):
+    """
+    创建频度表
+
+    frequencies 按 (文档, 键名, 值) 保存文档主辞书层的词元数，corpus_frequencies 是全文库的合计
+    （document_count 为含该值的文档数）。两者在导入和删除文档时增量更新，见 _index_frequencies。
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS frequencies (
+            document_id INTEGER NOT NULL,
+            field TEXT NOT NULL,
+            value TEXT NOT NULL,
+            token_count INTEGER NOT NULL,
+            PRIMARY KEY (document_id, field, value)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS corpus_frequencies (
+            field TEXT NOT NULL,
+            value TEXT NOT NULL,
+            token_count INTEGER NOT NULL,
+            document_count INTEGER NOT NULL,
+            PRIMARY KEY (field, value)
+        ) WITHOUT ROWID
+    ''')
+    # 频度顺序的前 N 项直接按索引读取
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_corpus_frequencies_rank
+        ON corpus_frequencies(field, token_count DESC)
+    ''')
+
+
+def _create_cube_tables(cursor):
+    """
+    创建聚合立方体表
+
+    document_features 按 (品词, 活用型, 活用形) 保存各文档的词元数，document_cells 记录文档
+    计入了哪些 (时代, 文体) 单元，feature_cube 是按全部维度合计的词元数。
+    文档的标签改变时按 document_cells 减去旧单元的计数，再按新的标签计入（见 _recount_cube）。
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS document_features (
+            document_id INTEGER NOT NULL,
+            pos TEXT NOT NULL,
+            ctype TEXT NOT NULL,
+            cform TEXT NOT NULL,
+            token_count INTEGER NOT NULL,
+            PRIMARY KEY (document_id, pos, ctype, cform)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS document_cells (
+            document_id INTEGER NOT NULL,
+            era TEXT NOT NULL,
+            style TEXT NOT NULL,
+            PRIMARY KEY (document_id, era, style)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS feature_cube (
+            era TEXT NOT NULL,
+            style TEXT NOT NULL,
+            pos TEXT NOT NULL,
+            ctype TEXT NOT NULL,
+            cform TEXT NOT NULL,
+            token_count INTEGER NOT NULL,
+            PRIMARY KEY (era, style, pos, ctype, cform)
+        ) WITHOUT ROWID
+    ''')
+
+
+def _create_ngram_tables(cursor):
+    """
+    创建 N-gram 与搭配统计用的表
+
+    ngrams 保存全文库中表层形和基本形的 2～5 元组（词以空格连接）的合计，删除文档时
+    从文档数据库重新计数后减去。搭配统计不预先计算词对，而是读取中心词出现位置（postings）
+    周围的基本形：lemma_sequences 按文档保存基本形编号的序列，lemma_terms 是基本形的编号和词频。
+    ngram_progress 记录保存中或补建中的文档已分批加入 ngrams 的最后一个主键
+    （见 _complete_document、backfill_indexes）。
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ngrams (
+            kind TEXT NOT NULL,
+            gram TEXT NOT NULL,
+            n INTEGER NOT NULL,
+            token_count INTEGER NOT NULL,
+            document_count INTEGER NOT NULL,
+            PRIMARY KEY (kind, gram)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_ngrams_rank ON ngrams(kind, n, token_count DESC)')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS lemma_terms (
+            id INTEGER PRIMARY KEY,
+            lemma TEXT UNIQUE NOT NULL,
+            token_count INTEGER NOT NULL
+        )
+    ''')
+    # lemmas、paragraph_starts: 32 位无符号整数（小端序，同 postings.positions）
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS lemma_sequences (
+            document_id INTEGER PRIMARY KEY,
+            lemmas BLOB NOT NULL,
+            paragraph_starts BLOB NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ngram_progress (
+            document_id INTEGER PRIMARY KEY,
+            kind TEXT NOT NULL,
+            gram TEXT NOT NULL
+        )
+    ''')
+
+
 def compute_hash(content: str, dictionary: str) -> str:
     """计算文档内容哈希"""
     combined = f"{content}|{dictionary}"
@@ -164,17 +540,36 @@ def compute_hash(content: str, dictionary: str) -> str:
 
 
 def generate_db_filename(title: str, doc_id: int) -> str:
-    """生成文档数据库文件名"""
+    """生成文档的存储位置（独立文件名，或分片存储时的 分片文件名#文档ID）"""
+    if STORAGE_BACKEND == 'shards':
+        return f"{SHARD_FILENAME.format(doc_id % SHARD_COUNT)}#{doc_id}"
+    
     # 安全的文件名
-    import re
     safe_title = re.sub(r'[^\w\u4e00-\u9fff\u3040-\u309f\u30a0-\u30ff]', '_', title)
     safe_title = safe_title[:50]  # 限制长度
     return f"doc_{doc_id}_{safe_title}.db"
 
 
+def document_location(db_filename: str) -> Tuple[str, int]:
+    """
+    主索引中的存储位置 -> (数据库路径, 库内的文档键)
+    
+    独立文件中只有一个文档，键固定为 1；分片中的文档以文档ID为键。
+    """
+    if '#' in db_filename:
+        shard_filename, doc_key = db_filename.rsplit('#', 1)
+        return os.path.join(SHARDS_DIR, shard_filename), int(doc_key)
+    return os.path.join(DOCUMENTS_DIR, db_filename), 1
+
+
+def _passage_hash(content: str, dictionary: str) -> bytes:
+    """段落内容的地址：(段落文本, 辞书) 的 SHA-256（与 compute_hash 相同，以二进制保存）"""
+    return hashlib.sha256(f"{content}|{dictionary}".encode('utf-8')).digest()
+
+
 def create_document_db(db_path: str):
-    """创建单个文档的数据库结构"""
-    conn = sqlite3.connect(db_path)
+    """创建文档数据库（独立文件或分片）的结构"""
+    conn = connections.connect(db_path)
     cursor = conn.cursor()
     
     # 文档内容表
@@ -185,134 +580,961 @@ def create_document_db(db_path: str):
         )
     ''')
     
-    # 段落表
+    _create_passage_tables(cursor)
+    _create_lexemes_table(cursor)
+    _create_layers_table(cursor)
+    _create_compression_table(cursor)
+    
+    _create_token_indexes(cursor)
+    
+    cursor.execute(f'PRAGMA user_version = {DOCUMENT_SCHEMA_VERSION}')
+    conn.commit()
+    conn.close()
+
+
+def _create_passage_tables(cursor):
+    """
+    段落内容表（按内容寻址）及段落表、词元表、文境界索引表
+    
+    每种 (段落文本, 辞书) 的分析结果在数据库中只保存一次，以两者的哈希查找；
+    各文档各分析层的段落按ID引用段落内容，refcount 为引用它的段落行数，
+    减到 0 时连同词元一起删除。同一数据库中（独立文件为一个文档，分片为多个文档，
+    默认的单一分片为整个文库）重复出现的段落只占一份空间。
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS passages (
+            id INTEGER PRIMARY KEY,
+            hash BLOB UNIQUE NOT NULL,
+            content TEXT NOT NULL,
+            refcount INTEGER NOT NULL
+        )
+    ''')
+    
+    # 段落表（document_id 为库内的文档键，见 document_location；layer 0 为主辞书，其余见 layers 表）
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS paragraphs (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            id INTEGER PRIMARY KEY,
+            document_id INTEGER NOT NULL,
+            layer INTEGER NOT NULL,
             paragraph_index INTEGER NOT NULL,
-            content TEXT NOT NULL
+            passage_id INTEGER NOT NULL
         )
     ''')
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_paragraphs_position
+        ON paragraphs(document_id, layer, paragraph_index)
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_paragraphs_passage ON paragraphs(passage_id)')
     
-    # 词元分析结果表
+    # 词元表，按 (段落内容, 序号) 聚簇存储
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS tokens (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            paragraph_id INTEGER NOT NULL,
+            passage_id INTEGER NOT NULL,
             token_index INTEGER NOT NULL,
             surface TEXT NOT NULL,
-            features TEXT NOT NULL,
-            FOREIGN KEY (paragraph_id) REFERENCES paragraphs(id) ON DELETE CASCADE
-        )
+            lexeme_id INTEGER NOT NULL,
+            PRIMARY KEY (passage_id, token_index)
+        ) WITHOUT ROWID
     ''')
     
-    # 索引
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_tokens_para ON tokens(paragraph_id)')
-    
-    conn.commit()
-    conn.close()
+    # 文境界索引表：每段各句（文节）的词元范围 [start_token, end_token)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sentences (
+            passage_id INTEGER NOT NULL,
+            level INTEGER NOT NULL,
+            sentence_index INTEGER NOT NULL,
+            start_token INTEGER NOT NULL,
+            end_token INTEGER NOT NULL,
+            PRIMARY KEY (passage_id, level, sentence_index)
+        ) WITHOUT ROWID
+    ''')
 
 
-def save_document(title: str, content: str, dictionary: str, paragraphs: List[Dict],
-                  tags: List[str] = None, metadata: Dict[str, str] = None) -> int:
+def _create_lexemes_table(cursor):
+    """词素表：每种特征组合只保存一次（JSON），词元按ID引用"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS lexemes (
+            id INTEGER PRIMARY KEY,
+            features TEXT UNIQUE NOT NULL
+        )
+    ''')
+
+
+def _create_token_indexes(cursor):
+    """词元表索引（按词素查找出现位置）"""
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_tokens_lexeme ON tokens(lexeme_id)')
+
+
+def _drop_token_indexes(cursor):
+    """删除词元表索引（向空数据库批量写入前调用，写入后由 _create_token_indexes 一次性重建）"""
+    cursor.execute('DROP INDEX IF EXISTS idx_tokens_lexeme')
+
+
+def _create_layers_table(cursor):
+    """附加分析层表：同一段落划分下用其他辞书得到的词元层"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS layers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            dictionary TEXT UNIQUE NOT NULL
+        )
+    ''')
+
+
+def _create_compression_table(cursor):
+    """压缩字典表：压缩词素特征时共享的字典（每种方式一个，ID 由内容决定，见 app/compression.py）"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS compression_dictionaries (
+            id INTEGER PRIMARY KEY,
+            method TEXT NOT NULL,
+            dictionary BLOB NOT NULL
+        )
+    ''')
+
+
+def _unpacker(conn, schema: str = 'main'):
     """
-    保存文档到独立数据库
+    返回把数据库中保存的值（可能已压缩）还原为文本的函数
     
     Args:
-        title: 文档标题
-        content: 原文内容
-        dictionary: 使用的辞书
-        paragraphs: 解析后的段落数据
-        tags: 标签列表
-        metadata: 元数据字典 (如 author, era 等)
-    
-    Returns:
-        文档ID
+        conn: 连接或游标
+        schema: 值所在的数据库（ATTACH 的其他数据库中的值按该库的字典解压）
     """
-    content_hash = compute_hash(content, dictionary)
-    
-    # 检查是否已存在
-    conn = get_registry_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT id FROM documents WHERE content_hash = ?', (content_hash,))
-    existing = cursor.fetchone()
-    if existing:
-        conn.close()
-        return existing['id']
-    
-    # 计算统计信息
-    paragraph_count = len(paragraphs)
-    token_count = sum(len(p.get('tokens', [])) for p in paragraphs)
-    
-    # 先插入主索引记录获取ID
-    cursor.execute('''
-        INSERT INTO documents (title, db_filename, content_hash, dictionary, paragraph_count, token_count)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (title, 'temp', content_hash, dictionary, paragraph_count, token_count))
-    doc_id = cursor.lastrowid
-    
-    # 生成并更新数据库文件名
-    db_filename = generate_db_filename(title, doc_id)
-    cursor.execute('UPDATE documents SET db_filename = ? WHERE id = ?', (db_filename, doc_id))
-    
-    # 添加标签
-    if tags:
-        for tag_name in tags:
-            # 确保标签存在
-            cursor.execute('INSERT OR IGNORE INTO tags (name, category) VALUES (?, ?)', 
-                         (tag_name, 'general'))
-            cursor.execute('SELECT id FROM tags WHERE name = ?', (tag_name,))
-            tag_row = cursor.fetchone()
-            if tag_row:
-                cursor.execute('INSERT OR IGNORE INTO document_tags (document_id, tag_id) VALUES (?, ?)',
-                             (doc_id, tag_row['id']))
-    
-    # 添加元数据
-    if metadata:
-        for key, value in metadata.items():
-            if value:
-                cursor.execute('''
-                    INSERT OR REPLACE INTO document_metadata (document_id, key, value)
-                    VALUES (?, ?, ?)
-                ''', (doc_id, key, value))
-    
-    conn.commit()
-    conn.close()
-    
-    # 创建文档数据库
-    db_path = os.path.join(DOCUMENTS_DIR, db_filename)
-    create_document_db(db_path)
+    conn = getattr(conn, 'connection', conn)
     
-    # 保存文档内容和分析结果
-    doc_conn = sqlite3.connect(db_path)
-    doc_cursor = doc_conn.cursor()
+    def load_dictionary(dictionary_id: int) -> Optional[bytes]:
+        row = conn.execute(f'SELECT dictionary FROM {schema}.compression_dictionaries WHERE id = ?',
+                           (dictionary_id,)).fetchone()
+        return row[0] if row else None
     
-    doc_cursor.execute('INSERT INTO content (id, original_text) VALUES (1, ?)', (content,))
-    
-    for para_idx, para in enumerate(paragraphs):
-        doc_cursor.execute('''
-            INSERT INTO paragraphs (paragraph_index, content) VALUES (?, ?)
-        ''', (para_idx, para['content']))
-        para_id = doc_cursor.lastrowid
-        
-        for token_idx, token in enumerate(para.get('tokens', [])):
-            doc_cursor.execute('''
-                INSERT INTO tokens (paragraph_id, token_index, surface, features)
-                VALUES (?, ?, ?, ?)
-            ''', (para_id, token_idx, token['surface'], json.dumps(token['features'], ensure_ascii=False)))
+    return lambda value: compression.unpack(value, load_dictionary)
+
+
+def _features_packer(cursor, samples: List[str]) -> compression.Packer:
+    """
+    压缩词素特征的 Packer：使用数据库中该方式的共享字典
     
-    doc_conn.commit()
-    doc_conn.close()
+    还没有字典时用 samples（本次写入的特征 JSON）训练并保存，样本不足时本次不用字典。
+    须在写事务中调用（同一数据库每种方式只训练一次）。
+    """
+    if COMPRESSION == 'none':
+        return compression.Packer(COMPRESSION)
+    row = cursor.execute('SELECT dictionary FROM compression_dictionaries WHERE method = ? LIMIT 1',
+                         (COMPRESSION,)).fetchone()
+    if row:
+        return compression.Packer(COMPRESSION, row[0])
+    dictionary = compression.train_dictionary(samples, COMPRESSION)
+    if dictionary is not None:
+        cursor.execute('INSERT INTO compression_dictionaries (id, method, dictionary) VALUES (?, ?, ?)',
+                       (compression.dictionary_id(dictionary), COMPRESSION, dictionary))
+    return compression.Packer(COMPRESSION, dictionary)
+
+
+_INSERT_PASSAGE = 'INSERT INTO passages (id, hash, content, refcount) VALUES (?, ?, ?, 1)'
+_INSERT_PARAGRAPH = '''
+    INSERT INTO paragraphs (document_id, layer, paragraph_index, passage_id) VALUES (?, ?, ?, ?)
+'''
+_INSERT_LEXEME = 'INSERT INTO lexemes (id, features) VALUES (?, ?)'
+_INSERT_TOKEN = 'INSERT INTO tokens (passage_id, token_index, surface, lexeme_id) VALUES (?, ?, ?, ?)'
+_INSERT_SENTENCE = '''
+    INSERT INTO sentences (passage_id, level, sentence_index, start_token, end_token)
+    VALUES (?, ?, ?, ?, ?)
+'''
+
+
+class _Lexicon:
+    """
+    文档数据库的词素表：特征元组 -> 词素ID
     
-    return doc_id
+    新词素在写入词元行时预先分配ID，行暂存在 pending 中，由 _RowBuffer 与词元行一起写入（write）。
+    """
 
+    def __init__(self, cursor):
+        unpack = _unpacker(cursor)
+        cursor.execute('SELECT id, features FROM lexemes')
+        self.ids: Dict[Tuple[str, ...], int] = {
+            features_from_json(unpack(features)): lexeme_id for lexeme_id, features in cursor.fetchall()}
+        self.next_id = max(self.ids.values(), default=0) + 1
+        self.pending: List[Tuple[int, str]] = []
 
-def get_document(doc_id: int) -> Optional[Dict[str, Any]]:
-    """获取文档的完整信息（元数据 + 分析结果）"""
-    conn = get_registry_connection()
-    cursor = conn.cursor()
+    def id_for(self, features: Tuple[str, ...]) -> int:
+        lexeme_id = self.ids.get(features)
+        if lexeme_id is None:
+            lexeme_id = self.ids[features] = self.next_id
+            self.next_id += 1
+            self.pending.append((lexeme_id, features_to_json(features)))
+        return lexeme_id
+
+    def write(self, cursor):
+        """写入暂存的新词素（按当前压缩方式）"""
+        if self.pending:
+            pack = _features_packer(cursor, [raw for _, raw in self.pending]).pack
+            cursor.executemany(_INSERT_LEXEME, [(lexeme_id, pack(raw)) for lexeme_id, raw in self.pending])
+            self.pending.clear()
+
+
+class _Passages:
+    """
+    文档数据库的段落内容表：(段落文本, 辞书) -> 段落内容ID
     
-    # 获取文档元数据
+    已保存的内容只增加引用计数；新内容预先分配ID，行（文本按当前压缩方式压缩）暂存在 pending 中，
+    由 _RowBuffer 与词元行一起写入。引用计数的增量暂存在 references 中，随之一起写入。
+    """
+
+    def __init__(self, cursor, dictionary: str):
+        self.cursor = cursor
+        self.dictionary = dictionary
+        self.pack = compression.Packer(COMPRESSION).pack
+        self.ids: Dict[bytes, int] = {}
+        cursor.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM passages')
+        self.next_id = cursor.fetchone()[0]
+        self.pending: List[Tuple[int, bytes, str]] = []
+        self.references: Counter = Counter()
+
+    def reference(self, content: str) -> Tuple[int, bool]:
+        """引用段落内容，返回 (段落内容ID, 是否需要写入词元)"""
+        key = _passage_hash(content, self.dictionary)
+        passage_id = self.ids.get(key)
+        if passage_id is None:
+            row = self.cursor.execute('SELECT id FROM passages WHERE hash = ?', (key,)).fetchone()
+            if row is None:
+                passage_id = self.ids[key] = self.next_id
+                self.next_id += 1
+                self.pending.append((passage_id, key, self.pack(content)))
+                return passage_id, True
+            passage_id = self.ids[key] = row[0]
+        self.references[passage_id] += 1
+        return passage_id, False
+
+
+def _load_lexemes(conn) -> Dict[int, Tuple[str, ...]]:
+    """读取文档的全部词素：词素ID -> 共享的特征元组（词素数为词汇量，远小于词元数）"""
+    unpack = _unpacker(conn)
+    return {lexeme_id: features_from_json(unpack(features))
+            for lexeme_id, features in conn.execute('SELECT id, features FROM lexemes')}
+
+
+def _token_rows(passage_id: int, tokens: Iterable[Token], lexicon: _Lexicon) -> List[Tuple]:
+    """段落内容词元的 tokens 表行"""
+    return [(passage_id, token_idx, token.surface, lexicon.id_for(token.features))
+            for token_idx, token in enumerate(tokens)]
+
+
+def _sentence_rows(key: Tuple, para: Dict) -> List[Tuple]:
+    """段落的文境界索引行 key + (层级, 序号, 起, 止)（段落数据中没有时根据词元计算）"""
+    tokens = para.get('tokens', [])
+    levels = (
+        (SENTENCE_LEVEL, para.get('sentences') or sentence_spans(tokens)),
+        (CLAUSE_LEVEL, para.get('clauses') or sentence_spans(tokens, clauses=True)),
+    )
+    return [key + (level, index, start, end)
+            for level, spans in levels
+            for index, (start, end) in enumerate(spans)]
+
+
+class _RowBuffer:
+    """
+    批量写入缓冲：先把各表的行攒成元组列表，超过 BULK_BATCH_ROWS 行后用 executemany 一次写入
+    """
+
+    def __init__(self, cursor, lexicon: _Lexicon, passages: _Passages):
+        self.cursor = cursor
+        self.lexicon = lexicon
+        self.passages = passages
+        self.paragraphs: List[Tuple] = []
+        self.tokens: List[Tuple] = []
+        self.sentences: List[Tuple] = []
+
+    def add_paragraph(self, doc_key: int, layer: int, para_idx: int, content: str, para: Dict):
+        """加入一个段落行；段落内容尚未保存时连同词元和文境界索引一起写入"""
+        passage_id, new = self.passages.reference(content)
+        self.paragraphs.append((doc_key, layer, para_idx, passage_id))
+        if new:
+            self.tokens.extend(_token_rows(passage_id, para.get('tokens', []), self.lexicon))
+            self.sentences.extend(_sentence_rows((passage_id,), para))
+        if len(self.paragraphs) + len(self.tokens) + len(self.sentences) >= BULK_BATCH_ROWS:
+            self.flush()
+
+    def flush(self):
+        self.lexicon.write(self.cursor)
+        for sql, rows in ((_INSERT_PASSAGE, self.passages.pending),
+                          (_INSERT_PARAGRAPH, self.paragraphs),
+                          (_INSERT_TOKEN, self.tokens),
+                          (_INSERT_SENTENCE, self.sentences)):
+            if rows:
+                self.cursor.executemany(sql, rows)
+                rows.clear()
+        if self.passages.references:
+            self.cursor.executemany('UPDATE passages SET refcount = refcount + ? WHERE id = ?',
+                                    [(count, passage_id)
+                                     for passage_id, count in self.passages.references.items()])
+            self.passages.references.clear()
+
+
+class _BatchWriter:
+    """
+    逐段保存用的分批写入：段落先暂存在内存中，约 BULK_BATCH_ROWS 行时在一个短事务中写入并提交
+
+    事务只在 flush 内开启，不跨越调用方的 yield。批次之间其他连接可能写入了同一数据库
+    （分片中的其他文档），因此段落内容ID在每批的事务内查找、分配；
+    PRAGMA data_version 表明有其他连接提交过时重新读取词素表。
+    """
+
+    def __init__(self, conn, dictionary: str):
+        self.conn = conn
+        self.dictionary = dictionary
+        self.pending: List[Tuple] = []
+        self.rows = 0
+        self.lexicon: Optional[_Lexicon] = None
+        self.data_version = None
+
+    def add_paragraph(self, doc_key: int, layer: int, para_idx: int, content: str, para: Dict):
+        self.pending.append((doc_key, layer, para_idx, content, para))
+        self.rows += 1 + len(para.get('tokens', []))
+        if self.rows >= BULK_BATCH_ROWS:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        with connections.bulk_write(self.conn, checkpoint=False):
+            cursor = self.conn.cursor()
+            data_version = cursor.execute('PRAGMA data_version').fetchone()[0]
+            if self.lexicon is None or data_version != self.data_version:
+                self.lexicon = _Lexicon(cursor)
+            buffer = _RowBuffer(cursor, self.lexicon, _Passages(cursor, self.dictionary))
+            for args in self.pending:
+                buffer.add_paragraph(*args)
+            buffer.flush()
+        # 本连接自己的提交不改变 data_version
+        self.data_version = data_version
+        self.pending.clear()
+        self.rows = 0
+
+
+def _release_paragraphs(cursor, where: str, params: Tuple):
+    """
+    删除符合条件的段落行并减少所引用段落内容的引用计数，
+    不再被引用的段落内容连同其词元和文境界索引一起删除
+    """
+    cursor.execute(f'''
+        SELECT passage_id, COUNT(*) FROM paragraphs WHERE {where} GROUP BY passage_id
+    ''', params)
+    references = cursor.fetchall()
+    cursor.execute(f'DELETE FROM paragraphs WHERE {where}', params)
+    cursor.executemany('UPDATE passages SET refcount = refcount - ? WHERE id = ?',
+                       [(count, passage_id) for passage_id, count in references])
+    cursor.execute('''
+        SELECT id FROM passages WHERE id IN (SELECT value FROM json_each(?)) AND refcount <= 0
+    ''', (json.dumps([passage_id for passage_id, _ in references]),))
+    orphans = cursor.fetchall()
+    # 按主键前缀 passage_id 删除，避免扫描整个分片
+    for table in ('tokens', 'sentences'):
+        cursor.executemany(f'DELETE FROM {table} WHERE passage_id = ?', orphans)
+    cursor.executemany('DELETE FROM passages WHERE id = ?', orphans)
+
+
+# ===== v5 及以前的结构（词元、文境界索引按段落保存，仅用于升级旧版本的文档数据库） =====
+
+def _create_v5_tokens_table(cursor):
+    """v5 的词元表（layer 0 为主辞书），按 (层, 段落, 序号) 聚簇存储"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS tokens (
+            layer INTEGER NOT NULL DEFAULT 0,
+            paragraph_id INTEGER NOT NULL,
+            token_index INTEGER NOT NULL,
+            surface TEXT NOT NULL,
+            lexeme_id INTEGER NOT NULL,
+            PRIMARY KEY (layer, paragraph_id, token_index)
+        ) WITHOUT ROWID
+    ''')
+
+
+def _create_v5_sentences_table(cursor):
+    """v5 的文境界索引表"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sentences (
+            paragraph_id INTEGER NOT NULL,
+            layer INTEGER NOT NULL DEFAULT 0,
+            level INTEGER NOT NULL,
+            sentence_index INTEGER NOT NULL,
+            start_token INTEGER NOT NULL,
+            end_token INTEGER NOT NULL,
+            PRIMARY KEY (layer, paragraph_id, level, sentence_index)
+        ) WITHOUT ROWID
+    ''')
+
+
+def _backfill_sentences(cursor):
+    """根据已保存的词元为旧文档生成文境界索引"""
+    cursor.execute('''
+        SELECT layer, paragraph_id, surface, features FROM tokens
+        ORDER BY layer, paragraph_id, token_index
+    ''')
+    rows = cursor.fetchall()
+    for (layer, para_id), group in groupby(rows, key=lambda r: (r[0], r[1])):
+        tokens = [Token(surface, features_from_json(features)) for _, _, surface, features in group]
+        cursor.executemany('''
+            INSERT INTO sentences (paragraph_id, layer, level, sentence_index, start_token, end_token)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', _sentence_rows((para_id, layer), {'tokens': tokens}))
+
+
+def _migrate_tokens_to_lexemes(conn: sqlite3.Connection):
+    """将每行保存特征JSON的旧词元表改写为词素表 + 按词素ID引用的词元表"""
+    cursor = conn.cursor()
+    cursor.execute('ALTER TABLE tokens RENAME TO tokens_v2')
+    _create_lexemes_table(cursor)
+    _create_v5_tokens_table(cursor)
+    
+    lexicon = _Lexicon(cursor)
+    batch = []
+    
+    def flush():
+        cursor.executemany(_INSERT_LEXEME, lexicon.pending)
+        cursor.executemany('''
+            INSERT INTO tokens (layer, paragraph_id, token_index, surface, lexeme_id) VALUES (?, ?, ?, ?, ?)
+        ''', batch)
+        lexicon.pending.clear()
+        batch.clear()
+    
+    rows = conn.execute('''
+        SELECT layer, paragraph_id, token_index, surface, features FROM tokens_v2
+        ORDER BY layer, paragraph_id, token_index
+    ''')
+    for layer, para_id, token_idx, surface, features in rows:
+        batch.append((layer, para_id, token_idx, surface, lexicon.id_for(features_from_json(features))))
+        if len(batch) >= BULK_BATCH_ROWS:
+            flush()
+    flush()
+    
+    cursor.execute('DROP TABLE tokens_v2')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_tokens_lexeme ON tokens(lexeme_id)')
+
+
+def _registry_dictionaries(conn: sqlite3.Connection) -> Dict[int, str]:
+    """数据库中各文档键的主辞书（从主索引读取；主索引中没有的文档不包含在内）"""
+    db_path = os.path.abspath(conn.execute('PRAGMA database_list').fetchone()['file'])
+    name = os.path.basename(db_path)
+    # 升级可能发生在主索引初始化的过程中，直接连接而不等待初始化
+    registry = _connect_registry()
+    try:
+        rows = registry.execute('''
+            SELECT db_filename, dictionary FROM documents WHERE db_filename = ? OR db_filename LIKE ?
+        ''', (name, name + '#%')).fetchall()
+    except sqlite3.OperationalError:
+        rows = []
+    finally:
+        registry.close()
+    dictionaries = {}
+    for row in rows:
+        path, doc_key = document_location(row['db_filename'])
+        if os.path.abspath(path) == db_path:
+            dictionaries[doc_key] = row['dictionary']
+    return dictionaries
+
+
+def _migrate_to_passages(conn: sqlite3.Connection):
+    """将按段落保存词元的 v5 结构改写为按内容寻址的段落内容表（见 _create_passage_tables）"""
+    cursor = conn.cursor()
+    for table in ('paragraphs', 'tokens', 'sentences'):
+        cursor.execute(f'ALTER TABLE {table} RENAME TO {table}_v5')
+    # 索引随表改名，先删除以免与新表的索引重名
+    for index in ('idx_paragraphs_doc', 'idx_paragraphs_position', 'idx_tokens_lexeme', 'idx_tokens_layer_para'):
+        cursor.execute(f'DROP INDEX IF EXISTS {index}')
+    _create_passage_tables(cursor)
+    
+    dictionaries = _registry_dictionaries(conn)
+    layer_names = {row['id']: row['dictionary'] for row in cursor.execute('SELECT id, dictionary FROM layers')}
+    doc_layers: Dict[int, List[int]] = {}
+    for doc_key, layer in cursor.execute('''
+            SELECT DISTINCT p.document_id, t.layer FROM tokens_v5 t
+            JOIN paragraphs_v5 p ON p.id = t.paragraph_id
+            WHERE t.layer != 0
+            '''):
+        doc_layers.setdefault(doc_key, []).append(layer)
+    
+    # 每种 (段落文本, 辞书) 的第一次出现提供词元，之后的出现只引用
+    passages: Dict[bytes, List] = {}
+    paragraph_rows = []
+    sources = []
+    rows = cursor.execute('SELECT id, document_id, paragraph_index, content FROM paragraphs_v5 ORDER BY id')
+    for para_id, doc_key, para_idx, content in rows.fetchall():
+        for layer in [0] + sorted(doc_layers.get(doc_key, [])):
+            dictionary = layer_names[layer] if layer else dictionaries.get(doc_key, '')
+            key = _passage_hash(content, dictionary)
+            passage = passages.get(key)
+            if passage is None:
+                passage = passages[key] = [len(passages) + 1, key, content, 0]
+                sources.append((layer, para_id, passage[0]))
+            passage[3] += 1
+            paragraph_rows.append((doc_key, layer, para_idx, passage[0]))
+    
+    cursor.executemany('INSERT INTO passages (id, hash, content, refcount) VALUES (?, ?, ?, ?)',
+                       passages.values())
+    cursor.executemany(_INSERT_PARAGRAPH, paragraph_rows)
+    cursor.execute('CREATE TEMP TABLE passage_sources (layer INTEGER, paragraph_id INTEGER, passage_id INTEGER)')
+    cursor.executemany('INSERT INTO temp.passage_sources VALUES (?, ?, ?)', sources)
+    cursor.execute('''
+        INSERT INTO tokens (passage_id, token_index, surface, lexeme_id)
+        SELECT s.passage_id, t.token_index, t.surface, t.lexeme_id
+        FROM temp.passage_sources s
+        JOIN tokens_v5 t ON t.layer = s.layer AND t.paragraph_id = s.paragraph_id
+        ORDER BY s.passage_id, t.token_index
+    ''')
+    cursor.execute('''
+        INSERT INTO sentences (passage_id, level, sentence_index, start_token, end_token)
+        SELECT s.passage_id, v.level, v.sentence_index, v.start_token, v.end_token
+        FROM temp.passage_sources s
+        JOIN sentences_v5 v ON v.layer = s.layer AND v.paragraph_id = s.paragraph_id
+        ORDER BY s.passage_id, v.level, v.sentence_index
+    ''')
+    cursor.execute('DROP TABLE temp.passage_sources')
+    for table in ('paragraphs', 'tokens', 'sentences'):
+        cursor.execute(f'DROP TABLE {table}_v5')
+    _create_token_indexes(cursor)
+
+
+def migrate_document_db(conn: sqlite3.Connection):
+    """将旧版本的文档数据库升级到当前结构（按 PRAGMA user_version 逐版本执行）"""
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    if version >= DOCUMENT_SCHEMA_VERSION:
+        return
+    
+    # 取得写锁后重新确认版本（其他进程可能已完成升级）
+    conn.execute('BEGIN IMMEDIATE')
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    if version >= DOCUMENT_SCHEMA_VERSION:
+        conn.commit()
+        return
+    
+    cursor = conn.cursor()
+    
+    if version < 1:
+        # v1: 多辞书分析层
+        columns = [row[1] for row in cursor.execute('PRAGMA table_info(tokens)')]
+        if 'layer' not in columns:
+            cursor.execute('ALTER TABLE tokens ADD COLUMN layer INTEGER NOT NULL DEFAULT 0')
+        _create_layers_table(cursor)
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_tokens_layer_para ON tokens(layer, paragraph_id)')
+    
+    if version < 2:
+        # v2: 文境界索引
+        _create_v5_sentences_table(cursor)
+        _backfill_sentences(cursor)
+    
+    if version < 3:
+        # v3: 词素表（词元只保存词素ID）
+        _migrate_tokens_to_lexemes(conn)
+    
+    if version < 4:
+        # v4: 段落带文档键（同一数据库可存放多个文档，独立文件中为 1）
+        columns = [row[1] for row in cursor.execute('PRAGMA table_info(paragraphs)')]
+        if 'document_id' not in columns:
+            cursor.execute('ALTER TABLE paragraphs ADD COLUMN document_id INTEGER NOT NULL DEFAULT 1')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_paragraphs_doc ON paragraphs(document_id, id)')
+    
+    if version < 5:
+        # v5: 按段落序号查找段落（语料检索的上下文）
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_paragraphs_position ON paragraphs(document_id, paragraph_index)')
+    
+    if version < 6:
+        # v6: 段落内容按 (文本, 辞书) 寻址，重复的段落只保存一次
+        _migrate_to_passages(conn)
+    
+    if version < 7:
+        # v7: 压缩字典（原文、段落文本和词素特征可以压缩保存）
+        _create_compression_table(cursor)
+    
+    cursor.execute(f'PRAGMA user_version = {DOCUMENT_SCHEMA_VERSION}')
+    conn.commit()
+    
+    if version < 6:
+        # 回收旧表占用的空间（WAL 模式下检查点后文件才会缩小）
+        conn.execute('VACUUM')
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+
+def open_document_db(db_filename: str) -> connections.PooledConnection:
+    """
+    从连接池借出文档所在数据库的连接（首次打开时升级结构），用完后 close() 即归还
+    分片中有多个文档，查询时需按 document_location 得到的文档键筛选
+    """
+    return connections.connect(document_location(db_filename)[0], prepare=migrate_document_db)
+
+
+def _delete_document_rows(cursor, doc_key: int):
+    """删除数据库中一个文档的原文和段落（以及不再被引用的段落内容、词元和文境界索引）"""
+    _release_paragraphs(cursor, 'document_id = ?', (doc_key,))
+    cursor.execute('DELETE FROM content WHERE id = ?', (doc_key,))
+    # 不再被引用的词素
+    cursor.execute('''
+        DELETE FROM lexemes WHERE NOT EXISTS (SELECT 1 FROM tokens WHERE lexeme_id = lexemes.id)
+    ''')
+
+
+def create_document(title: str, content: str, dictionary: str,
+                    tags: List[str] = None, metadata: Dict[str, str] = None) -> int:
+    """
+    注册新文档并创建其数据库（仅保存原文，段落由 iter_save_paragraphs 逐段写入）
+    
+    Args:
+        title: 文档标题
+        content: 原文内容
+        dictionary: 使用的辞书
+        tags: 标签列表
+        metadata: 元数据字典 (如 author, era 等)
+    
+    Returns:
+        文档ID
+
+    Raises:
+        DocumentExists: 同一内容的文档已登记（包括其他请求或进程正在保存的）
+    """
+    content_hash = compute_hash(content, dictionary)
+
+    conn = get_registry_connection()
+    cursor = conn.cursor()
+
+    # 先插入主索引记录获取ID（状态为保存中，统计信息在段落写入完成后更新）
+    try:
+        cursor.execute('''
+            INSERT INTO documents (title, db_filename, content_hash, dictionary, paragraph_count, token_count, status)
+            VALUES (?, ?, ?, ?, 0, 0, ?)
+        ''', (title, 'temp', content_hash, dictionary, DOCUMENT_SAVING))
+    except sqlite3.IntegrityError:
+        conn.rollback()
+        conn.close()
+        existing = _find_registered(content_hash)
+        if existing is None or existing['stale']:
+            # 已被删除，或是中断的保存留下的文档：删除后重新登记
+            if existing is not None:
+                delete_document(existing['id'])
+            return create_document(title, content, dictionary, tags, metadata)
+        raise DocumentExists(existing['id'], existing['status'] == DOCUMENT_SAVING) from None
+    doc_id = cursor.lastrowid
+    
+    # 生成并更新数据库文件名
+    db_filename = generate_db_filename(title, doc_id)
+    cursor.execute('UPDATE documents SET db_filename = ? WHERE id = ?', (db_filename, doc_id))
+    
+    # 添加标签
+    if tags:
+        for tag_name in tags:
+            # 确保标签存在
+            cursor.execute('INSERT OR IGNORE INTO tags (name, category) VALUES (?, ?)', 
+                         (tag_name, 'general'))
+            cursor.execute('SELECT id FROM tags WHERE name = ?', (tag_name,))
+            tag_row = cursor.fetchone()
+            if tag_row:
+                cursor.execute('INSERT OR IGNORE INTO document_tags (document_id, tag_id) VALUES (?, ?)',
+                             (doc_id, tag_row['id']))
+    
+    # 添加元数据
+    if metadata:
+        for key, value in metadata.items():
+            if value:
+                cursor.execute('''
+                    INSERT OR REPLACE INTO document_metadata (document_id, key, value)
+                    VALUES (?, ?, ?)
+                ''', (doc_id, key, value))
+    
+    conn.commit()
+    conn.close()
+    
+    # 创建文档数据库（分片已存在时沿用）并保存原文，失败时撤销主索引的登记
+    try:
+        db_path, doc_key = document_location(db_filename)
+        if not os.path.exists(db_path):
+            create_document_db(db_path)
+
+        doc_conn = open_document_db(db_filename)
+        try:
+            with doc_conn:
+                doc_conn.execute('INSERT INTO content (id, original_text) VALUES (?, ?)',
+                                 (doc_key, compression.Packer(COMPRESSION).pack(content)))
+        finally:
+            doc_conn.close()
+    except BaseException:
+        delete_document(doc_id)
+        raise
+
+    return doc_id
+
+
+def iter_save_paragraphs(doc_id: int, paragraphs: Iterable[Dict]) -> Iterator[Dict]:
+    """
+    逐段写入分析结果，每处理一段即返回该段落
+    
+    段落可以来自 analyzer.iter_analyze_text 等生成器，整篇文档无需同时驻留内存。
+    数据库中已有同一 (段落文本, 辞书) 的段落只引用已保存的内容，不再写入词元。
+    段落按批在短事务中提交（见 _BatchWriter），等待下一段时不占用文档数据库的写锁。
+    全部写入后更新主索引并把文档标为已完成（见 _complete_document）；中途失败、被中断或更新主索引失败时
+    删除该文档（包括已提交的批次）。
+    """
+    conn = get_registry_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT db_filename, dictionary FROM documents WHERE id = ?', (doc_id,))
+    row = cursor.fetchone()
+    conn.close()
+    if not row:
+        raise ValueError(f"文档不存在: {doc_id}")
+    
+    doc_conn = open_document_db(row['db_filename'])
+    doc_key = document_location(row['db_filename'])[1]
+    # 独立文件的新数据库：写入完成后再建索引，比逐行维护索引快
+    # （分片中可能同时有其他文档写入和删除，保留索引）
+    new_db = '#' not in row['db_filename'] and \
+        doc_conn.execute('SELECT 1 FROM passages LIMIT 1').fetchone() is None
+    
+    paragraph_count = 0
+    token_count = 0
+    postings: Dict[Tuple[str, ...], array] = {}
+    surface_lexemes = set()
+    surfaces = Counter()
+    completed = False
+    heartbeat = time.monotonic()
+    
+    try:
+        if new_db:
+            _drop_token_indexes(doc_conn.cursor())
+        writer = _BatchWriter(doc_conn, row['dictionary'])
+        for para_idx, para in enumerate(paragraphs):
+            tokens = para.get('tokens', [])
+            writer.add_paragraph(doc_key, 0, para_idx, para['content'], para)
+            
+            paragraph_count += 1
+            token_count += len(tokens)
+            _add_positions(postings, surface_lexemes, para_idx, tokens)
+            surfaces.update(token.surface for token in tokens)
+            if time.monotonic() - heartbeat >= SAVE_HEARTBEAT_SECONDS:
+                _touch_document(doc_id)
+                heartbeat = time.monotonic()
+            yield para
+        writer.flush()
+        
+        if new_db:
+            _create_token_indexes(doc_conn.cursor())
+        # 各批次不做检查点，最后一次确定到磁盘（见 connections.bulk_write）
+        doc_conn.execute('PRAGMA wal_checkpoint(FULL)')
+        completed = True
+    finally:
+        doc_conn.close()
+        if completed:
+            _complete_document(doc_id, row['db_filename'], paragraph_count, token_count,
+                               {features_to_json(features): positions for features, positions in postings.items()},
+                               {(features_to_json(features), surface) for features, surface in surface_lexemes},
+                               surfaces)
+        else:
+            # 写入未完成，不保留残缺文档
+            delete_document(doc_id)
+
+
+# 保存完成时分批更新主索引：每个事务写入的检索表段落数和 N-gram 数，以及事务之间的间隔（秒）。
+# 间隔不短于 SQLite 等待锁时重试的最长间隔（100 毫秒），使等待中的其他写入能在批次之间取得锁
+INDEX_BATCH_PARAGRAPHS = 2000
+INDEX_BATCH_NGRAMS = 50000
+INDEX_BATCH_PAUSE = 0.1
+
+
+def _complete_document(doc_id: int, db_filename: str, paragraph_count: int, token_count: int,
+                       postings: Dict[str, array], surface_lexemes: set, surfaces: Counter):
+    """
+    更新已写入文档数据库的文档的主索引，并把文档标为已完成
+
+    段落文本和 N-gram 从已提交的文档数据库中逐段读取（不在逐段写入时累积整篇文档）。
+    N-gram 先在临时表中计数合计（只写临时表，不占用主索引的写锁），检索表的段落和 N-gram
+    再分批在短事务中写入（见 INDEX_BATCH_PARAGRAPHS），最后一个事务写入其余索引并标为已完成，
+    其他写入不会被长时间阻塞。标为已完成前文档不出现在列表和检索结果中；
+    已加入 ngrams 的部分记在 ngram_progress 中，失败或进程被终止时由 delete_document 减去。
+    失败时删除该文档后重新抛出异常。
+    """
+    conn = get_registry_connection()
+    try:
+        cursor = conn.cursor()
+        ngrams = _read_ngrams(cursor, db_filename)
+        ngram_count = _sum_ngrams(cursor, ngrams)
+        conn.commit()
+        
+        with conn:
+            cursor.execute('DELETE FROM search_paragraphs WHERE document_id = ?', (doc_id,))
+        texts = _read_paragraph_texts(db_filename)
+        for index, batch in enumerate(iter(lambda: list(islice(texts, INDEX_BATCH_PARAGRAPHS)), [])):
+            if index:
+                time.sleep(INDEX_BATCH_PAUSE)
+            with conn:
+                _insert_paragraphs(cursor, doc_id, batch)
+        
+        heartbeat = time.monotonic()
+        for first in range(1, ngram_count + 1, INDEX_BATCH_NGRAMS):
+            if first > 1:
+                time.sleep(INDEX_BATCH_PAUSE)
+            last = min(first + INDEX_BATCH_NGRAMS - 1, ngram_count)
+            with conn:
+                _add_ngram_batch(cursor, doc_id, first, last)
+                if time.monotonic() - heartbeat >= SAVE_HEARTBEAT_SECONDS:
+                    cursor.execute('UPDATE documents SET updated_at = CURRENT_TIMESTAMP WHERE id = ?', (doc_id,))
+                    heartbeat = time.monotonic()
+        
+        with conn:
+            cursor.execute('''
+                UPDATE documents SET paragraph_count = ?, token_count = ?, status = ? WHERE id = ?
+            ''', (paragraph_count, token_count, DOCUMENT_COMPLETE, doc_id))
+            _index_tokens(cursor, doc_id, postings, surface_lexemes)
+            _index_frequencies(cursor, doc_id, surfaces)
+            _index_features(cursor, doc_id)
+            _index_lemma_sequence(cursor, doc_id, ngrams)
+            cursor.execute('DELETE FROM ngram_progress WHERE document_id = ?', (doc_id,))
+    except BaseException:
+        # 主索引更新失败：文档仍为保存中，连同已写入的索引和文档数据库中的内容一起删除
+        conn.rollback()
+        conn.close()
+        delete_document(doc_id)
+        raise
+    conn.close()
+
+
+def _add_ngram_batch(cursor, doc_id: int, first: int, last: int):
+    """把 document_ngram_totals 中 rowid 从 first 到 last 的 N-gram 加入合计，并记入 ngram_progress"""
+    _add_ngrams(cursor, first, last)
+    cursor.execute('''
+        INSERT INTO ngram_progress (document_id, kind, gram)
+        SELECT ?, kind, gram FROM temp.document_ngram_totals WHERE rowid = ?
+        ON CONFLICT (document_id) DO UPDATE SET kind = excluded.kind, gram = excluded.gram
+    ''', (doc_id, last))
+
+
+def save_document(title: str, content: str, dictionary: str, paragraphs: Iterable[Dict],
+                  tags: List[str] = None, metadata: Dict[str, str] = None) -> int:
+    """
+    保存文档到独立数据库
+    
+    Args:
+        title: 文档标题
+        content: 原文内容
+        dictionary: 使用的辞书
+        paragraphs: 解析后的段落数据（列表或逐段生成的迭代器）
+        tags: 标签列表
+        metadata: 元数据字典 (如 author, era 等)
+    
+    Returns:
+        文档ID
+    """
+    # 检查是否已存在（同一内容正在其他请求中保存时抛出 DocumentExists）
+    existing_id = find_document_id(content, dictionary)
+    if existing_id is not None:
+        return existing_id
+    
+    try:
+        doc_id = create_document(title, content, dictionary, tags, metadata)
+    except DocumentExists as e:
+        if e.in_progress:
+            raise
+        return e.doc_id
+    for _ in iter_save_paragraphs(doc_id, paragraphs):
+        pass
+    
+    return doc_id
+
+
+def save_layer(doc_id: int, dictionary: str, paragraphs: Iterable[Dict]) -> int:
+    """
+    保存附加分析层（同一原文用其他辞书分析的词元），已存在的同名层会被替换
+    
+    Args:
+        doc_id: 文档ID
+        dictionary: 该层使用的辞书
+        paragraphs: 解析后的段落数据（段落划分须与文档一致，段落文本以文档为准）
+    
+    Returns:
+        该层的词元数
+    """
+    conn = get_registry_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT db_filename, dictionary FROM documents WHERE id = ?', (doc_id,))
+    row = cursor.fetchone()
+    conn.close()
+    if not row:
+        raise ValueError(f"文档不存在: {doc_id}")
+    if dictionary == row['dictionary']:
+        raise ValueError(f"{dictionary} 是该文档的主辞书")
+    
+    doc_conn = open_document_db(row['db_filename'])
+    doc_key = document_location(row['db_filename'])[1]
+    
+    try:
+        with connections.bulk_write(doc_conn):
+            doc_cursor = doc_conn.cursor()
+            doc_cursor.execute('INSERT OR IGNORE INTO layers (dictionary) VALUES (?)', (dictionary,))
+            doc_cursor.execute('SELECT id FROM layers WHERE dictionary = ?', (dictionary,))
+            layer_id = doc_cursor.fetchone()['id']
+            _release_paragraphs(doc_cursor, 'document_id = ? AND layer = ?', (doc_key, layer_id))
+            
+            # 各层共用文档的段落划分，按段落序号对应
+            doc_cursor.execute('''
+                SELECT p.paragraph_index, ps.content FROM paragraphs p
+                JOIN passages ps ON ps.id = p.passage_id
+                WHERE p.document_id = ? AND p.layer = 0
+            ''', (doc_key,))
+            unpack = _unpacker(doc_cursor)
+            contents = {r['paragraph_index']: unpack(r['content']) for r in doc_cursor.fetchall()}
+            
+            lexicon = _Lexicon(doc_cursor)
+            buffer = _RowBuffer(doc_cursor, lexicon, _Passages(doc_cursor, dictionary))
+            token_count = 0
+            for para_idx, para in enumerate(paragraphs):
+                content = contents.get(para_idx)
+                if content is None:
+                    raise ValueError(f"段落划分与文档不一致: 段落 {para_idx} 不存在")
+                buffer.add_paragraph(doc_key, layer_id, para_idx, content, para)
+                token_count += len(para.get('tokens', []))
+            buffer.flush()
+    finally:
+        doc_conn.close()
+    
+    conn = get_registry_connection()
+    conn.execute('''
+        INSERT OR REPLACE INTO document_layers (document_id, dictionary, token_count)
+        VALUES (?, ?, ?)
+    ''', (doc_id, dictionary, token_count))
+    conn.commit()
+    conn.close()
+    
+    return token_count
+
+
+def save_document_layers(title: str, content: str, layers: Dict[str, List[Dict]],
+                         primary: str = None, tags: List[str] = None,
+                         metadata: Dict[str, str] = None) -> int:
+    """
+    保存同一原文的多辞书分析结果：主辞书作为文档本身，其余作为附加分析层
+    
+    Args:
+        title: 文档标题
+        content: 原文内容
+        layers: 辞书 -> 解析后的段落数据（analyzer.analyze_text_multi 的结果）
+        primary: 主辞书（省略时为 layers 的第一个辞书）
+        tags: 标签列表
+        metadata: 元数据字典
+    
+    Returns:
+        文档ID
+    """
+    primary = primary or next(iter(layers))
+    doc_id = save_document(title, content, primary, layers[primary], tags, metadata)
+    
+    for dictionary, paragraphs in layers.items():
+        if dictionary != primary:
+            save_layer(doc_id, dictionary, paragraphs)
+    
+    return doc_id
+
+
+def _load_document_info(doc_id: int, dictionary: str = None) -> Optional[Dict[str, Any]]:
+    """读取主索引中的文档信息（标签、元数据、分析层），指定的层不存在时返回 None"""
+    conn = get_registry_connection()
+    cursor = conn.cursor()
+    
+    # 获取文档元数据
     cursor.execute('SELECT * FROM documents WHERE id = ?', (doc_id,))
     doc_row = cursor.fetchone()
     if not doc_row:
@@ -323,114 +1545,1266 @@ def get_document(doc_id: int) -> Optional[Dict[str, Any]]:
     
     # 获取标签
     cursor.execute('''
-        SELECT t.name, t.category FROM tags t
-        JOIN document_tags dt ON t.id = dt.tag_id
-        WHERE dt.document_id = ?
+        SELECT t.name, t.category FROM tags t
+        JOIN document_tags dt ON t.id = dt.tag_id
+        WHERE dt.document_id = ?
+    ''', (doc_id,))
+    doc['tags'] = [{'name': row['name'], 'category': row['category']} for row in cursor.fetchall()]
+    
+    # 获取元数据
+    cursor.execute('SELECT key, value FROM document_metadata WHERE document_id = ?', (doc_id,))
+    doc['metadata'] = {row['key']: row['value'] for row in cursor.fetchall()}
+    
+    # 获取分析层（主辞书在前）
+    cursor.execute('''
+        SELECT dictionary, token_count FROM document_layers
+        WHERE document_id = ? ORDER BY dictionary
+    ''', (doc_id,))
+    extra_layers = {row['dictionary']: row['token_count'] for row in cursor.fetchall()}
+    doc['layers'] = [doc['dictionary']] + list(extra_layers)
+    
+    conn.close()
+    
+    if dictionary is None or dictionary == doc['dictionary']:
+        doc['layer'] = doc['dictionary']
+    elif dictionary in extra_layers:
+        doc['layer'] = dictionary
+        doc['token_count'] = extra_layers[dictionary]
+    else:
+        return None
+    
+    return doc
+
+
+class Document:
+    """
+    惰性加载的文档
+    
+    打开时只读取主索引中的信息；原文、段落和词元在访问或迭代时才从文档数据库读取，
+    迭代时逐行取出，同一时刻只有一个段落驻留内存，可用于导出超大文档。
+    """
+    
+    def __init__(self, info: Dict[str, Any]):
+        self.info = info
+        # 所在数据库与库内的文档键（分片中存放多个文档）
+        self.db_path, self.doc_key = document_location(info['db_filename'])
+    
+    @property
+    def id(self) -> int:
+        return self.info['id']
+    
+    @property
+    def title(self) -> str:
+        return self.info['title']
+    
+    @property
+    def dictionary(self) -> str:
+        """主辞书"""
+        return self.info['dictionary']
+    
+    @property
+    def layer(self) -> str:
+        """读取的分析层（辞书名）"""
+        return self.info['layer']
+    
+    @property
+    def sharded(self) -> bool:
+        """是否存放在分片中"""
+        return '#' in self.info['db_filename']
+    
+    def exists(self) -> bool:
+        """文档数据库文件是否存在"""
+        return os.path.exists(self.db_path)
+    
+    @property
+    def content(self) -> str:
+        """原文"""
+        conn = open_document_db(self.info['db_filename'])
+        try:
+            row = conn.execute('SELECT original_text FROM content WHERE id = ?', (self.doc_key,)).fetchone()
+            return _unpacker(conn)(row['original_text']) if row else ''
+        finally:
+            conn.close()
+    
+    def _layer_id(self, conn) -> int:
+        """分析层在文档数据库中的编号（主辞书为 0，不存在时为 -1）"""
+        if self.layer == self.dictionary:
+            return 0
+        row = conn.execute('SELECT id FROM layers WHERE dictionary = ?', (self.layer,)).fetchone()
+        return row['id'] if row else -1
+    
+    def _load_lexemes(self, conn, layer_id: int) -> Dict[int, Tuple[str, ...]]:
+        """读取词素表（分片中只读取本文档用到的词素）"""
+        if not self.sharded:
+            return _load_lexemes(conn)
+        rows = conn.execute('''
+            SELECT id, features FROM lexemes WHERE id IN (
+                SELECT t.lexeme_id FROM paragraphs p
+                JOIN tokens t ON t.passage_id = p.passage_id
+                WHERE p.document_id = ? AND p.layer = ?
+            )
+        ''', (self.doc_key, layer_id))
+        unpack = _unpacker(conn)
+        return {lexeme_id: features_from_json(unpack(features)) for lexeme_id, features in rows}
+    
+    def iter_paragraphs(self) -> Iterator[Dict[str, Any]]:
+        """
+        逐段返回段落（id, paragraph_index, content, tokens, sentences, clauses）
+        
+        段落、词元、文境界索引各用一个按段落序号排序的查询并行读取，边读边按段落合并。
+        词素表先整体读入，词元只需按ID查表。段落划分和文本以主辞书层为准。
+        """
+        conn = open_document_db(self.info['db_filename'])
+        try:
+            layer_id = self._layer_id(conn)
+            lexemes = self._load_lexemes(conn, layer_id)
+            
+            # 按段落序号顺序逐段查找词元表的主键 (段落内容, 序号)，无需排序
+            token_rows = conn.execute('''
+                SELECT p.paragraph_index, t.surface, t.lexeme_id FROM paragraphs p
+                JOIN tokens t ON t.passage_id = p.passage_id
+                WHERE p.document_id = ? AND p.layer = ?
+                ORDER BY p.paragraph_index, t.token_index
+            ''', (self.doc_key, layer_id))
+            tokens = _merge_by_paragraph(
+                (para_idx, [Token(surface, lexemes[lexeme_id]) for _, surface, lexeme_id in group])
+                for para_idx, group in groupby(token_rows, key=lambda r: r[0]))
+            spans = _merge_by_paragraph(_iter_paragraph_spans(conn, layer_id, self.doc_key))
+            unpack = _unpacker(conn)
+            
+            for para_id, para_idx, content in conn.execute('''
+                    SELECT p.id, p.paragraph_index, ps.content FROM paragraphs p
+                    JOIN passages ps ON ps.id = p.passage_id
+                    WHERE p.document_id = ? AND p.layer = 0
+                    ORDER BY p.paragraph_index
+                    ''', (self.doc_key,)):
+                levels = spans(para_idx) or {}
+                yield {
+                    'id': para_id,
+                    'paragraph_index': para_idx,
+                    'content': unpack(content),
+                    'tokens': tokens(para_idx) or [],
+                    'sentences': levels.get(SENTENCE_LEVEL, []),
+                    'clauses': levels.get(CLAUSE_LEVEL, [])
+                }
+        finally:
+            conn.close()
+    
+    def iter_tokens(self) -> Iterator[Tuple[int, int, Token]]:
+        """逐个返回 (段落序号, 段内词元序号, 词元)"""
+        conn = open_document_db(self.info['db_filename'])
+        try:
+            layer_id = self._layer_id(conn)
+            lexemes = self._load_lexemes(conn, layer_id)
+            rows = conn.execute('''
+                SELECT p.paragraph_index, t.token_index, t.surface, t.lexeme_id
+                FROM paragraphs p JOIN tokens t ON t.passage_id = p.passage_id
+                WHERE p.document_id = ? AND p.layer = ?
+                ORDER BY p.paragraph_index, t.token_index
+            ''', (self.doc_key, layer_id))
+            for para_idx, token_idx, surface, lexeme_id in rows:
+                yield para_idx, token_idx, Token(surface, lexemes[lexeme_id])
+        finally:
+            conn.close()
+    
+    def iter_lexeme_tokens(self, features: Iterable[str]) -> Iterator[Tuple[int, int, Token]]:
+        """逐个返回与给定特征完全一致的词元 (段落序号, 段内词元序号, 词元)，经词素索引查找"""
+        conn = open_document_db(self.info['db_filename'])
+        try:
+            raw = features_to_json(features)
+            row = conn.execute('SELECT id FROM lexemes WHERE features = ?', (raw,)).fetchone()
+            if row is None:
+                # 压缩保存的词素不能按值查找，逐个解压比较（词素数为词汇量）
+                unpack = _unpacker(conn)
+                row = next((r for r in conn.execute("SELECT id, features FROM lexemes WHERE typeof(features) = 'blob'")
+                            if unpack(r['features']) == raw), None)
+            if row is None:
+                return
+            shared = features_from_json(raw)
+            rows = conn.execute('''
+                SELECT p.paragraph_index, t.token_index, t.surface
+                FROM tokens t JOIN paragraphs p ON p.passage_id = t.passage_id
+                WHERE t.lexeme_id = ? AND p.document_id = ? AND p.layer = ?
+                ORDER BY p.paragraph_index, t.token_index
+            ''', (row['id'], self.doc_key, self._layer_id(conn)))
+            for para_idx, token_idx, surface in rows:
+                yield para_idx, token_idx, Token(surface, shared)
+        finally:
+            conn.close()
+
+    def token_ranges(self, ranges: Iterable[Tuple[int, int, int]]) -> List[List[Token]]:
+        """读取多个段内词元区间 (段落序号, 起, 止) 的词元，只读取这些段落"""
+        conn = open_document_db(self.info['db_filename'])
+        try:
+            layer_id = self._layer_id(conn)
+            lexemes = None
+            result = []
+            for para_idx, start, end in ranges:
+                # CROSS JOIN: 先按段落序号找到段落，再按主键范围读取词元
+                rows = conn.execute('''
+                    SELECT t.surface, t.lexeme_id FROM paragraphs p
+                    CROSS JOIN tokens t ON t.passage_id = p.passage_id
+                    WHERE p.document_id = ? AND p.layer = ? AND p.paragraph_index = ?
+                    AND t.token_index >= ? AND t.token_index < ?
+                    ORDER BY t.token_index
+                ''', (self.doc_key, layer_id, para_idx, start, end)).fetchall()
+                if lexemes is None and rows:
+                    lexemes = self._load_lexemes(conn, layer_id)
+                result.append([Token(surface, lexemes[lexeme_id]) for surface, lexeme_id in rows])
+            return result
+        finally:
+            conn.close()
+
+    def to_dict(self) -> Dict[str, Any]:
+        """读取全部内容，返回 get_document 形式的字典"""
+        doc = dict(self.info)
+        if self.exists():
+            doc['content'] = self.content
+            doc['paragraphs'] = list(self.iter_paragraphs())
+        return doc
+
+
+def _merge_by_paragraph(groups: Iterator[Tuple[int, Any]]):
+    """
+    将按段落序号升序排列的 (段落序号, 值) 序列变为查找函数：按升序依次传入段落序号，
+    返回该段落的值（没有时返回 None），已跳过的段落不再保留
+    """
+    groups = iter(groups)
+    pending = next(groups, None)
+    
+    def lookup(para_idx: int):
+        nonlocal pending
+        while pending is not None and pending[0] < para_idx:
+            pending = next(groups, None)
+        return pending[1] if pending is not None and pending[0] == para_idx else None
+    
+    return lookup
+
+
+def _iter_paragraph_spans(conn, layer_id: int, doc_key: int) -> Iterator[Tuple[int, Dict[int, List[List[int]]]]]:
+    """按段落序号顺序逐段返回 (段落序号, {层级: [[起, 止], ...]})"""
+    rows = conn.execute('''
+        SELECT p.paragraph_index, s.level, s.start_token, s.end_token FROM paragraphs p
+        JOIN sentences s ON s.passage_id = p.passage_id
+        WHERE p.document_id = ? AND p.layer = ?
+        ORDER BY p.paragraph_index, s.level, s.sentence_index
+    ''', (doc_key, layer_id))
+    for para_idx, group in groupby(rows, key=lambda r: r[0]):
+        levels: Dict[int, List[List[int]]] = {}
+        for _, level, start, end in group:
+            levels.setdefault(level, []).append([start, end])
+        yield para_idx, levels
+
+
+def open_document(doc_id: int, dictionary: str = None) -> Optional[Document]:
+    """
+    打开文档（惰性加载，段落和词元在迭代时才读取）
+    
+    Args:
+        doc_id: 文档ID
+        dictionary: 要读取的分析层（省略时为主辞书；指定的层不存在时返回 None）
+    """
+    info = _load_document_info(doc_id, dictionary)
+    return Document(info) if info else None
+
+
+def iter_paragraphs(doc_id: int, dictionary: str = None) -> Iterator[Dict[str, Any]]:
+    """逐段读取文档的段落（文档不存在时不返回任何段落）"""
+    document = open_document(doc_id, dictionary)
+    if document and document.exists():
+        yield from document.iter_paragraphs()
+
+
+def iter_tokens(doc_id: int, dictionary: str = None) -> Iterator[Tuple[int, int, Token]]:
+    """逐个读取文档的词元 (段落序号, 段内词元序号, 词元)"""
+    document = open_document(doc_id, dictionary)
+    if document and document.exists():
+        yield from document.iter_tokens()
+
+
+def get_document(doc_id: int, dictionary: str = None) -> Optional[Dict[str, Any]]:
+    """
+    获取文档的完整信息（元数据 + 分析结果）
+    
+    Args:
+        doc_id: 文档ID
+        dictionary: 要读取的分析层（省略时为主辞书；指定的层不存在时返回 None）
+    """
+    document = open_document(doc_id, dictionary)
+    return document.to_dict() if document else None
+
+
+# 文档列表缓存：(标签筛选, 类别筛选) -> 文档列表，主索引的修改计数变化时整体清空
+_listing_cache: Dict[Tuple, List[Dict[str, Any]]] = {}
+_listing_generation: Optional[int] = None
+_listing_lock = threading.Lock()
+
+
+def list_documents(tag_filter: List[str] = None, category_filter: str = None) -> List[Dict[str, Any]]:
+    """
+    列出所有文档
+    
+    结果按筛选条件缓存在进程内，主索引没有写入时直接返回缓存
+    （返回的各文档字典在调用之间共享，不要修改）。
+    
+    Args:
+        tag_filter: 按标签筛选
+        category_filter: 按标签类别筛选
+    """
+    global _listing_generation
+    key = (tuple(tag_filter or ()), category_filter)
+    
+    conn = get_registry_connection()
+    try:
+        # 在同一个读事务中确认修改计数并读取列表，缓存内容与计数一致
+        conn.execute('BEGIN')
+        generation = conn.execute('SELECT generation FROM registry_state WHERE id = 1').fetchone()[0]
+        with _listing_lock:
+            if generation != _listing_generation:
+                _listing_cache.clear()
+                _listing_generation = generation
+            cached = _listing_cache.get(key)
+        if cached is not None:
+            return list(cached)
+        
+        documents = _query_documents(conn.cursor(), tag_filter, category_filter)
+    finally:
+        conn.close()
+    
+    with _listing_lock:
+        if generation == _listing_generation:
+            _listing_cache[key] = documents
+    return list(documents)
+
+
+def _query_documents(cursor, tag_filter: List[str] = None, category_filter: str = None) -> List[Dict[str, Any]]:
+    """读取文档列表（文档、标签、元数据、分析层各一次查询，与文档数无关）"""
+    query = '''
+        SELECT DISTINCT d.id, d.title, d.dictionary, d.paragraph_count, d.token_count, 
+               d.created_at, d.updated_at
+        FROM documents d
+    '''
+    
+    # 保存中的文档不列出
+    conditions = ['d.status = ?']
+    params = [DOCUMENT_COMPLETE]
+
+    if tag_filter or category_filter:
+        query += ' JOIN document_tags dt ON d.id = dt.document_id'
+        query += ' JOIN tags t ON dt.tag_id = t.id'
+
+        if tag_filter:
+            placeholders = ','.join('?' * len(tag_filter))
+            conditions.append(f't.name IN ({placeholders})')
+            params.extend(tag_filter)
+        if category_filter:
+            conditions.append('t.category = ?')
+            params.append(category_filter)
+
+    query += ' WHERE ' + ' AND '.join(conditions)
+    query += ' ORDER BY d.updated_at DESC'
+    
+    cursor.execute(query, params)
+    documents = [dict(row) for row in cursor.fetchall()]
+    
+    # 全部文档的标签
+    tags: Dict[int, List[Dict[str, str]]] = {}
+    cursor.execute('''
+        SELECT dt.document_id, t.name, t.category FROM document_tags dt
+        JOIN tags t ON t.id = dt.tag_id
+        ORDER BY dt.document_id, dt.tag_id
+    ''')
+    for r in cursor.fetchall():
+        tags.setdefault(r['document_id'], []).append({'name': r['name'], 'category': r['category']})
+    
+    # 全部文档的元数据
+    metadata: Dict[int, Dict[str, str]] = {}
+    cursor.execute('SELECT document_id, key, value FROM document_metadata ORDER BY document_id, id')
+    for r in cursor.fetchall():
+        metadata.setdefault(r['document_id'], {})[r['key']] = r['value']
+    
+    # 附加分析层
+    cursor.execute('SELECT document_id, dictionary FROM document_layers ORDER BY dictionary')
+    extra_layers: Dict[int, List[str]] = {}
+    for r in cursor.fetchall():
+        extra_layers.setdefault(r['document_id'], []).append(r['dictionary'])
+    
+    for doc in documents:
+        doc['tags'] = tags.get(doc['id'], [])
+        doc['metadata'] = metadata.get(doc['id'], {})
+        doc['layers'] = [doc['dictionary']] + extra_layers.get(doc['id'], [])
+    
+    return documents
+
+
+# ===== 全文检索 =====
+
+# trigram 分词器只能用三个字以上的词匹配，更短的检索词改为扫描检索表（仍只读主索引）
+SEARCH_MIN_MATCH_LENGTH = 3
+SEARCH_SNIPPET_TOKENS = 32    # 摘要的长度（trigram 的词数，约等于字数）
+SEARCH_SNIPPET_CHARS = 40     # 短检索词的摘要中命中位置前后保留的字数
+# 摘要中标记命中位置的控制字符（HTML 转义后替换为 <mark>）
+_MARK_OPEN, _MARK_CLOSE = '\x02', '\x03'
+
+
+def _read_paragraph_texts(db_filename: str) -> Iterator[Tuple[int, str]]:
+    """从文档数据库逐段读取 (段落序号, 段落文本)"""
+    db_path, doc_key = document_location(db_filename)
+    if not os.path.exists(db_path):
+        return
+    doc_conn = open_document_db(db_filename)
+    try:
+        unpack = _unpacker(doc_conn)
+        for para_idx, content in doc_conn.execute('''
+            SELECT p.paragraph_index, ps.content FROM paragraphs p
+            JOIN passages ps ON ps.id = p.passage_id
+            WHERE p.document_id = ? AND p.layer = 0
+            ORDER BY p.paragraph_index
+        ''', (doc_key,)):
+            yield para_idx, unpack(content)
+    finally:
+        doc_conn.close()
+
+
+def _index_paragraphs(cursor, doc_id: int, texts: Iterable[Tuple[int, str]]):
+    """把文档的段落写入检索表（替换该文档已有的索引）"""
+    cursor.execute('DELETE FROM search_paragraphs WHERE document_id = ?', (doc_id,))
+    _insert_paragraphs(cursor, doc_id, texts)
+
+
+def _insert_paragraphs(cursor, doc_id: int, texts: Iterable[Tuple[int, str]]):
+    """把段落追加到检索表"""
+    cursor.executemany('''
+        INSERT INTO search_paragraphs (document_id, paragraph_index, content) VALUES (?, ?, ?)
+    ''', ((doc_id, para_idx, content) for para_idx, content in texts))
+
+
+def rebuild_search_index() -> int:
+    """
+    从各文档数据库重建全文检索索引（索引与文档不一致时使用）
+
+    Returns:
+        建立索引的段落数
+    """
+    conn = get_registry_connection()
+    try:
+        with conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM search_paragraphs')
+            cursor.execute("DELETE FROM index_backfill WHERE name = 'search'")
+            cursor.execute("INSERT INTO paragraph_fts (paragraph_fts) VALUES ('rebuild')")
+            cursor.execute('SELECT id, db_filename FROM documents WHERE status = ?', (DOCUMENT_COMPLETE,))
+            for row in cursor.fetchall():
+                _index_paragraphs(cursor, row['id'], _read_paragraph_texts(row['db_filename']))
+            cursor.execute("INSERT INTO paragraph_fts (paragraph_fts) VALUES ('optimize')")
+            return cursor.execute('SELECT COUNT(*) FROM search_paragraphs').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def _highlight(snippet: str) -> str:
+    """HTML 转义摘要，并把命中标记换成 <mark>"""
+    return html.escape(snippet).replace(_MARK_OPEN, '<mark>').replace(_MARK_CLOSE, '</mark>')
+
+
+def _short_snippet(content: str, query: str) -> str:
+    """短检索词的摘要：第一处命中位置前后各 SEARCH_SNIPPET_CHARS 字，标记其中所有命中"""
+    pattern = re.compile(re.escape(query), re.IGNORECASE)
+    match = pattern.search(content)
+    position = match.start() if match else 0
+    start = max(0, position - SEARCH_SNIPPET_CHARS)
+    end = min(len(content), position + len(query) + SEARCH_SNIPPET_CHARS)
+    marked = pattern.sub(lambda m: _MARK_OPEN + m.group(0) + _MARK_CLOSE, content[start:end])
+    return ('…' if start > 0 else '') + marked + ('…' if end < len(content) else '')
+
+
+def search_paragraphs(query: str, limit: int = 20, offset: int = 0) -> List[Dict[str, Any]]:
+    """
+    在全部文档的段落中检索包含 query 的段落
+
+    检索词按原样作为短语匹配（不区分大小写）。三个字以上的检索词用 FTS5 索引，
+    按 bm25 相关度排序；更短的检索词按文档ID和段落顺序返回。
+
+    Args:
+        query: 检索词
+        limit: 返回的最大件数
+        offset: 跳过的件数（分页）
+
+    Returns:
+        命中列表，每项包含 document_id、title、paragraph_index 和 snippet
+        （HTML 转义后的摘要，命中部分以 <mark> 标记）
+    """
+    query = query.strip()
+    if not query:
+        return []
+
+    conn = get_registry_connection()
+    try:
+        if len(query) >= SEARCH_MIN_MATCH_LENGTH:
+            phrase = '"' + query.replace('"', '""') + '"'
+            rows = conn.execute(f'''
+                SELECT s.document_id, d.title, s.paragraph_index,
+                       snippet(paragraph_fts, 0, ?, ?, '…', {SEARCH_SNIPPET_TOKENS}) AS snippet
+                FROM paragraph_fts
+                JOIN search_paragraphs s ON s.id = paragraph_fts.rowid
+                JOIN documents d ON d.id = s.document_id
+                WHERE paragraph_fts MATCH ? AND d.status = ?
+                ORDER BY paragraph_fts.rank
+                LIMIT ? OFFSET ?
+            ''', (_MARK_OPEN, _MARK_CLOSE, phrase, DOCUMENT_COMPLETE, limit, offset)).fetchall()
+            hits = [dict(row) for row in rows]
+        else:
+            pattern = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            rows = conn.execute('''
+                SELECT s.document_id, d.title, s.paragraph_index, s.content
+                FROM search_paragraphs s
+                JOIN documents d ON d.id = s.document_id
+                WHERE s.content LIKE ? ESCAPE '\\' AND d.status = ?
+                ORDER BY s.document_id, s.paragraph_index
+                LIMIT ? OFFSET ?
+            ''', (f'%{pattern}%', DOCUMENT_COMPLETE, limit, offset)).fetchall()
+            hits = [{'document_id': row['document_id'], 'title': row['title'],
+                     'paragraph_index': row['paragraph_index'],
+                     'snippet': _short_snippet(row['content'], query)} for row in rows]
+    finally:
+        conn.close()
+
+    for hit in hits:
+        hit['snippet'] = _highlight(hit['snippet'])
+    return hits
+
+
+# ===== 语料索引 =====
+
+# 语料索引的检索键：键名 -> 特征序号
+INDEX_FIELDS = {
+    'lemma': (9,),           # 书字形（基本形）
+    'reading': (18,),        # 语汇素读音
+    'pos': (0, 1, 2, 3),     # 品词（大、中、小、细分类）
+    'ctype': (4,),           # 活用型
+    'cform': (5,),           # 活用形
+}
+# 分级的键：每一级都建键（名詞、名詞-普通名詞……；連用形、連用形-一般……）
+HIERARCHICAL_FIELDS = frozenset({'pos', 'ctype', 'cform'})
+_EMPTY_FEATURES = ('', '*')
+
+
+def lexeme_keys(features: Tuple[str, ...]) -> List[Tuple[str, str]]:
+    """词素的检索键 (键名, 值)，空值和 '*' 不建键"""
+    keys = []
+    for field, indexes in INDEX_FIELDS.items():
+        values = [features[i] if i < len(features) else '' for i in indexes]
+        if field not in HIERARCHICAL_FIELDS:
+            keys.extend((field, value) for value in values if value not in _EMPTY_FEATURES)
+            continue
+        if len(values) == 1:
+            values = values[0].split('-')
+        levels = []
+        for value in values:
+            if value in _EMPTY_FEATURES:
+                break
+            levels.append(value)
+            keys.append((field, '-'.join(levels)))
+    return keys
+
+
+def _pack_positions(positions: array) -> bytes:
+    """位置列表转为 postings.positions 的存储形式"""
+    if sys.byteorder == 'big':
+        positions = array('I', positions)
+        positions.byteswap()
+    return positions.tobytes()
+
+
+def unpack_positions(blob: bytes) -> array:
+    """postings.positions 转为位置列表（段落序号、段内词元序号交替排列）"""
+    positions = array('I')
+    positions.frombytes(blob)
+    if sys.byteorder == 'big':
+        positions.byteswap()
+    return positions
+
+
+def _add_positions(postings: Dict[Tuple[str, ...], array], surface_lexemes: set, para_idx: int,
+                   tokens: Iterable[Token]):
+    """把段落中各词元的位置加入 特征元组 -> 位置列表，(特征元组, 表层形) 加入 surface_lexemes"""
+    for token_idx, token in enumerate(tokens):
+        surface_lexemes.add((token.features, token.surface))
+        positions = postings.get(token.features)
+        if positions is None:
+            positions = postings[token.features] = array('I')
+        positions.append(para_idx)
+        positions.append(token_idx)
+
+
+def _read_postings(db_filename: str) -> Tuple[Dict[str, array], set]:
+    """从文档数据库读取主辞书层各词素（特征 JSON）的位置列表，以及出现过的 (特征 JSON, 表层形)"""
+    db_path, doc_key = document_location(db_filename)
+    if not os.path.exists(db_path):
+        return {}, set()
+    doc_conn = open_document_db(db_filename)
+    try:
+        positions: Dict[int, array] = {}
+        surfaces = set()
+        rows = doc_conn.execute('''
+            SELECT t.lexeme_id, t.surface, p.paragraph_index, t.token_index FROM paragraphs p
+            JOIN tokens t ON t.passage_id = p.passage_id
+            WHERE p.document_id = ? AND p.layer = 0
+            ORDER BY p.paragraph_index, t.token_index
+        ''', (doc_key,))
+        for lexeme_id, surface, para_idx, token_idx in rows:
+            lexeme_positions = positions.get(lexeme_id)
+            if lexeme_positions is None:
+                lexeme_positions = positions[lexeme_id] = array('I')
+            lexeme_positions.append(para_idx)
+            lexeme_positions.append(token_idx)
+            surfaces.add((lexeme_id, surface))
+        features = doc_conn.execute('''
+            SELECT id, features FROM lexemes WHERE id IN (SELECT value FROM json_each(?))
+        ''', (json.dumps(list(positions)),))
+        unpack = _unpacker(doc_conn)
+        raw = {row['id']: unpack(row['features']) for row in features}
+        return ({raw[lexeme_id]: lexeme_positions for lexeme_id, lexeme_positions in positions.items()},
+                {(raw[lexeme_id], surface) for lexeme_id, surface in surfaces})
+    finally:
+        doc_conn.close()
+
+
+def _corpus_lexeme_ids(cursor, features: List[str]) -> Dict[str, int]:
+    """特征 JSON -> 全文库共用的词素编号（新词素同时登记检索键）"""
+    cursor.execute('''
+        SELECT l.features, l.id FROM json_each(?) j JOIN corpus_lexemes l ON l.features = j.value
+    ''', (json.dumps(features, ensure_ascii=False),))
+    ids = {row[0]: row[1] for row in cursor.fetchall()}
+    for raw in features:
+        if raw in ids:
+            continue
+        cursor.execute('INSERT INTO corpus_lexemes (features) VALUES (?)', (raw,))
+        ids[raw] = cursor.lastrowid
+        cursor.executemany('INSERT OR IGNORE INTO lexeme_keys (field, value, lexeme_id) VALUES (?, ?, ?)',
+                           [(field, value, ids[raw]) for field, value in lexeme_keys(features_from_json(raw))])
+    return ids
+
+
+def _index_tokens(cursor, doc_id: int, postings: Dict[str, array], surface_lexemes: Iterable[Tuple[str, str]]):
+    """把文档的位置列表和 (特征 JSON, 表层形) 写入语料索引（替换该文档已有的位置列表）"""
+    cursor.execute('DELETE FROM postings WHERE document_id = ?', (doc_id,))
+    if not postings:
+        return
+    ids = _corpus_lexeme_ids(cursor, list(postings))
+    cursor.executemany('''
+        INSERT INTO postings (lexeme_id, document_id, token_count, positions) VALUES (?, ?, ?, ?)
+    ''', ((ids[raw], doc_id, len(positions) // 2, _pack_positions(positions))
+          for raw, positions in postings.items()))
+    cursor.executemany('INSERT OR IGNORE INTO surface_lexemes (surface, lexeme_id) VALUES (?, ?)',
+                       ((surface, ids[raw]) for raw, surface in surface_lexemes))
+
+
+def rebuild_corpus_index() -> int:
+    """
+    从各文档数据库重建语料索引（索引与文档不一致时使用）
+
+    Returns:
+        建立索引的词元数
+    """
+    conn = get_registry_connection()
+    try:
+        with conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM postings')
+            cursor.execute('DELETE FROM surface_lexemes')
+            cursor.execute("DELETE FROM index_backfill WHERE name = 'postings'")
+            cursor.execute('SELECT id, db_filename FROM documents WHERE status = ?', (DOCUMENT_COMPLETE,))
+            for row in cursor.fetchall():
+                _index_tokens(cursor, row['id'], *_read_postings(row['db_filename']))
+            return cursor.execute('SELECT COALESCE(SUM(token_count), 0) FROM postings').fetchone()[0]
+    finally:
+        conn.close()
+
+
+# ===== 频度表 =====
+
+# 频度表的键名：表层形以及语料索引的各检索键（分级的键每一级都计数）
+FREQUENCY_FIELDS = ('surface',) + tuple(INDEX_FIELDS)
+
+
+def _read_surface_counts(db_filename: str) -> Dict[str, int]:
+    """从文档数据库读取主辞书层各表层形的词元数"""
+    db_path, doc_key = document_location(db_filename)
+    if not os.path.exists(db_path):
+        return {}
+    doc_conn = open_document_db(db_filename)
+    try:
+        rows = doc_conn.execute('''
+            SELECT t.surface, COUNT(*) FROM paragraphs p
+            JOIN tokens t ON t.passage_id = p.passage_id
+            WHERE p.document_id = ? AND p.layer = 0
+            GROUP BY t.surface
+        ''', (doc_key,))
+        return dict(rows.fetchall())
+    finally:
+        doc_conn.close()
+
+
+def _unindex_frequencies(cursor, doc_id: int):
+    """从全文库合计中减去文档的频度，删除该文档的频度表"""
+    cursor.execute('''
+        UPDATE corpus_frequencies
+        SET token_count = corpus_frequencies.token_count - f.token_count,
+            document_count = corpus_frequencies.document_count - 1
+        FROM frequencies f
+        WHERE f.document_id = ? AND f.field = corpus_frequencies.field AND f.value = corpus_frequencies.value
+    ''', (doc_id,))
+    cursor.execute('''
+        DELETE FROM corpus_frequencies WHERE document_count <= 0
+        AND (field, value) IN (SELECT field, value FROM frequencies WHERE document_id = ?)
+    ''', (doc_id,))
+    cursor.execute('DELETE FROM frequencies WHERE document_id = ?', (doc_id,))
+
+
+def _index_frequencies(cursor, doc_id: int, surfaces: Dict[str, int]):
+    """
+    建立文档的频度表并计入全文库合计（替换该文档已有的频度）
+
+    表层形以外的键由该文档的 postings 和 lexeme_keys 求得，须在 _index_tokens 之后调用。
+    """
+    _unindex_frequencies(cursor, doc_id)
+    cursor.executemany('''
+        INSERT INTO frequencies (document_id, field, value, token_count) VALUES (?, 'surface', ?, ?)
+    ''', ((doc_id, surface, count) for surface, count in surfaces.items()))
+    cursor.execute('''
+        INSERT INTO frequencies (document_id, field, value, token_count)
+        SELECT p.document_id, k.field, k.value, SUM(p.token_count)
+        FROM postings p JOIN lexeme_keys k ON k.lexeme_id = p.lexeme_id
+        WHERE p.document_id = ?
+        GROUP BY k.field, k.value
+    ''', (doc_id,))
+    cursor.execute('''
+        INSERT INTO corpus_frequencies (field, value, token_count, document_count)
+        SELECT field, value, token_count, 1 FROM frequencies WHERE document_id = ?
+        ON CONFLICT (field, value) DO UPDATE SET
+            token_count = token_count + excluded.token_count,
+            document_count = document_count + 1
+    ''', (doc_id,))
+
+
+def rebuild_frequencies() -> int:
+    """
+    从语料索引和各文档数据库重建频度表（须先保证语料索引是最新的，见 rebuild_corpus_index）
+
+    Returns:
+        计入频度表的词元数
+    """
+    conn = get_registry_connection()
+    try:
+        with conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM frequencies')
+            cursor.execute('DELETE FROM corpus_frequencies')
+            cursor.execute("DELETE FROM index_backfill WHERE name = 'frequencies'")
+            cursor.execute('SELECT id, db_filename FROM documents WHERE status = ?', (DOCUMENT_COMPLETE,))
+            for row in cursor.fetchall():
+                _index_frequencies(cursor, row['id'], _read_surface_counts(row['db_filename']))
+            return cursor.execute('''
+                SELECT COALESCE(SUM(token_count), 0) FROM corpus_frequencies WHERE field = 'surface'
+            ''').fetchone()[0]
+    finally:
+        conn.close()
+
+
+# ===== 聚合立方体 =====
+
+# 立方体的维度：文档维度（同名类别的标签，时代也包括元数据 era）和词元维度（语料索引的分级键）
+CUBE_DOCUMENT_DIMENSIONS = ('era', 'style')
+CUBE_TOKEN_DIMENSIONS = ('pos', 'ctype', 'cform')
+CUBE_DIMENSIONS = CUBE_DOCUMENT_DIMENSIONS + CUBE_TOKEN_DIMENSIONS
+
+
+def _cube_features(features: Tuple[str, ...]) -> Tuple[str, ...]:
+    """词素在各词元维度上的值（最细一级的检索键，没有时为空字符串）"""
+    values = dict.fromkeys(CUBE_TOKEN_DIMENSIONS, '')
+    for field, value in lexeme_keys(features):
+        if field in values:
+            values[field] = value    # 分级的键由粗到细排列，保留最后一级
+    return tuple(values.values())
+
+
+def _document_cells(cursor, doc_id: int) -> List[Tuple[str, str]]:
+    """
+    文档所属的 (时代, 文体) 单元
+
+    有多个时代或文体标签的文档计入每一个组合；没有的维度记为空字符串。
+    """
+    cursor.execute('''
+        SELECT t.category, t.name FROM document_tags dt JOIN tags t ON t.id = dt.tag_id
+        WHERE dt.document_id = ? AND t.category IN ('era', 'style')
+        UNION
+        SELECT 'era', value FROM document_metadata WHERE document_id = ? AND key = 'era' AND value != ''
+    ''', (doc_id, doc_id))
+    values = {'era': set(), 'style': set()}
+    for category, name in cursor.fetchall():
+        values[category].add(name)
+    return list(product(sorted(values['era']) or [''], sorted(values['style']) or ['']))
+
+
+def _count_cube(cursor, doc_id: int):
+    """按文档当前的标签把 document_features 计入立方体"""
+    cursor.executemany('INSERT INTO document_cells (document_id, era, style) VALUES (?, ?, ?)',
+                       [(doc_id, era, style) for era, style in _document_cells(cursor, doc_id)])
+    cursor.execute('''
+        INSERT INTO feature_cube (era, style, pos, ctype, cform, token_count)
+        SELECT c.era, c.style, f.pos, f.ctype, f.cform, f.token_count
+        FROM document_cells c JOIN document_features f ON f.document_id = c.document_id
+        WHERE c.document_id = ?
+        ON CONFLICT (era, style, pos, ctype, cform) DO UPDATE SET
+            token_count = token_count + excluded.token_count
     ''', (doc_id,))
-    doc['tags'] = [{'name': row['name'], 'category': row['category']} for row in cursor.fetchall()]
-    
-    # 获取元数据
-    cursor.execute('SELECT key, value FROM document_metadata WHERE document_id = ?', (doc_id,))
-    doc['metadata'] = {row['key']: row['value'] for row in cursor.fetchall()}
-    
-    conn.close()
-    
-    # 获取分析结果
-    db_path = os.path.join(DOCUMENTS_DIR, doc['db_filename'])
-    if os.path.exists(db_path):
-        doc_conn = sqlite3.connect(db_path)
-        doc_conn.row_factory = sqlite3.Row
-        doc_cursor = doc_conn.cursor()
-        
-        # 获取原文
-        doc_cursor.execute('SELECT original_text FROM content WHERE id = 1')
-        content_row = doc_cursor.fetchone()
-        doc['content'] = content_row['original_text'] if content_row else ''
-        
-        # 获取段落和词元
-        doc['paragraphs'] = []
-        doc_cursor.execute('SELECT * FROM paragraphs ORDER BY paragraph_index')
-        para_rows = doc_cursor.fetchall()
-        
-        for para_row in para_rows:
-            paragraph = dict(para_row)
-            paragraph['tokens'] = []
-            
-            doc_cursor.execute('''
-                SELECT * FROM tokens WHERE paragraph_id = ? ORDER BY token_index
-            ''', (para_row['id'],))
-            
-            for token_row in doc_cursor.fetchall():
-                token = dict(token_row)
-                token['features'] = json.loads(token['features'])
-                paragraph['tokens'].append(token)
-            
-            doc['paragraphs'].append(paragraph)
-        
+
+
+def _uncount_cube(cursor, doc_id: int):
+    """从立方体中减去文档计入的部分（按 document_cells 记录的单元）"""
+    cursor.execute('''
+        UPDATE feature_cube SET token_count = feature_cube.token_count - d.token_count
+        FROM (SELECT c.era, c.style, f.pos, f.ctype, f.cform, f.token_count
+              FROM document_cells c JOIN document_features f ON f.document_id = c.document_id
+              WHERE c.document_id = ?) AS d
+        WHERE feature_cube.era = d.era AND feature_cube.style = d.style AND feature_cube.pos = d.pos
+        AND feature_cube.ctype = d.ctype AND feature_cube.cform = d.cform
+    ''', (doc_id,))
+    cursor.execute('''
+        DELETE FROM feature_cube WHERE token_count <= 0
+        AND (era, style) IN (SELECT era, style FROM document_cells WHERE document_id = ?)
+    ''', (doc_id,))
+    cursor.execute('DELETE FROM document_cells WHERE document_id = ?', (doc_id,))
+
+
+def _recount_cube(cursor, doc_id: int):
+    """文档的标签或时代改变后更新立方体"""
+    _uncount_cube(cursor, doc_id)
+    _count_cube(cursor, doc_id)
+
+
+def _index_features(cursor, doc_id: int):
+    """
+    由文档的 postings 建立 document_features 并计入立方体（替换该文档已有的计数）
+
+    须在 _index_tokens 之后调用。
+    """
+    _uncount_cube(cursor, doc_id)
+    cursor.execute('DELETE FROM document_features WHERE document_id = ?', (doc_id,))
+    cursor.execute('''
+        SELECT l.features, p.token_count FROM postings p JOIN corpus_lexemes l ON l.id = p.lexeme_id
+        WHERE p.document_id = ?
+    ''', (doc_id,))
+    counts = Counter()
+    for raw, token_count in cursor.fetchall():
+        counts[_cube_features(features_from_json(raw))] += token_count
+    cursor.executemany('''
+        INSERT INTO document_features (document_id, pos, ctype, cform, token_count) VALUES (?, ?, ?, ?, ?)
+    ''', ((doc_id,) + values + (token_count,) for values, token_count in counts.items()))
+    _count_cube(cursor, doc_id)
+
+
+def rebuild_cube() -> int:
+    """
+    从语料索引重建聚合立方体（须先保证语料索引是最新的，见 rebuild_corpus_index）
+
+    Returns:
+        计入立方体的词元数（多个时代、文体标签的文档按组合数重复计入）
+    """
+    conn = get_registry_connection()
+    try:
+        with conn:
+            cursor = conn.cursor()
+            for table in ('feature_cube', 'document_cells', 'document_features'):
+                cursor.execute(f'DELETE FROM {table}')
+            cursor.execute("DELETE FROM index_backfill WHERE name = 'cube'")
+            cursor.execute('SELECT id FROM documents WHERE status = ?', (DOCUMENT_COMPLETE,))
+            for row in cursor.fetchall():
+                _index_features(cursor, row['id'])
+            return cursor.execute('SELECT COALESCE(SUM(token_count), 0) FROM feature_cube').fetchone()[0]
+    finally:
+        conn.close()
+
+
+# ===== N-gram 与搭配 =====
+
+NGRAM_KINDS = ('surface', 'lemma')
+NGRAM_SIZES = range(2, 6)
+NGRAM_SEPARATOR = ' '
+NGRAM_MIN_COUNT = 2              # prune_ngrams 的默认阈值
+# N-gram 和搭配窗口不跨越的品词（标点、空白）
+_NGRAM_BREAK_POS = frozenset({'補助記号', '空白'})
+_LEMMA_FEATURE = INDEX_FIELDS['lemma'][0]
+
+
+class _NgramCounter:
+    """
+    累计一个文档的 N-gram，并保留基本形序列（搭配统计用，见 _index_lemma_sequence）
+
+    各段落的词依次接在一个序列中，标点和段落末尾处为 None，段落 i 从序列的 starts[i] 开始，
+    段内词元序号与序列中的位置一一对应。每积累一定词数后对新增部分计数，把各块的次数追加到
+    主索引连接的临时表 document_ngrams 中（块的边界在段落末尾，不会切断 N-gram），
+    由 _sum_ngrams 在 SQL 中合计，内存中只保留一块的计数；含 None（跨越了标点或段落）的条目不计。
+    文档内的所有 N-gram 都按实际次数计入（索引的大小由 prune_ngrams 按全文库的次数限制）。
+    基本形为空的词（未知词等）以表层形代替。
+    基本形序列以文档内的编号（lemma_ids，从 1 开始，0 为标点和段落末尾）保存在 sequence 中。
+    """
+
+    FLUSH_TOKENS = 65536
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        cursor.execute('''
+            CREATE TEMP TABLE IF NOT EXISTS document_ngrams (
+                kind TEXT NOT NULL,
+                gram TEXT NOT NULL,
+                n INTEGER NOT NULL,
+                token_count INTEGER NOT NULL
+            )
+        ''')
+        cursor.execute('DELETE FROM temp.document_ngrams')
+        self._surfaces: List[Optional[str]] = []
+        self._lemmas: List[Optional[str]] = []
+        self.lemma_ids: Dict[str, int] = {}
+        self.sequence = array('I')
+        self.starts = array('I')
+
+    def add(self, tokens: Iterable[Token]):
+        """累计一个段落"""
+        surfaces, lemmas = self._surfaces, self._lemmas
+        self.starts.append(len(self.sequence))
+        for token in tokens:
+            features = token.features
+            if features and features[0] in _NGRAM_BREAK_POS:
+                surfaces.append(None)
+                lemmas.append(None)
+                self.sequence.append(0)
+                continue
+            surfaces.append(token.surface)
+            lemma = features[_LEMMA_FEATURE] if len(features) > _LEMMA_FEATURE else ''
+            lemma = token.surface if lemma in _EMPTY_FEATURES else lemma
+            lemmas.append(lemma)
+            self.sequence.append(self.lemma_ids.setdefault(lemma, len(self.lemma_ids) + 1))
+        surfaces.append(None)
+        lemmas.append(None)
+        self.sequence.append(0)
+        if len(surfaces) >= self.FLUSH_TOKENS:
+            self.flush()
+
+    def flush(self):
+        """把未计数的部分的次数追加到临时表"""
+        for kind, sequence in (('surface', self._surfaces), ('lemma', self._lemmas)):
+            counts = Counter()
+            for n in NGRAM_SIZES:
+                counts.update(zip(*(sequence[i:] for i in range(n))))
+            self.cursor.executemany('''
+                INSERT INTO temp.document_ngrams (kind, gram, n, token_count) VALUES (?, ?, ?, ?)
+            ''', ((kind, NGRAM_SEPARATOR.join(gram), len(gram), count)
+                  for gram, count in counts.items() if None not in gram))
+            sequence.clear()
+
+
+def _read_ngrams(cursor, db_filename: str) -> _NgramCounter:
+    """从文档数据库的主辞书层重新计数（计数写入 cursor 所在连接的临时表）"""
+    counter = _NgramCounter(cursor)
+    db_path, doc_key = document_location(db_filename)
+    if not os.path.exists(db_path):
+        return counter
+    doc_conn = open_document_db(db_filename)
+    try:
+        lexemes = _load_lexemes(doc_conn)
+        rows = doc_conn.execute('''
+            SELECT p.paragraph_index, t.surface, t.lexeme_id FROM paragraphs p
+            JOIN tokens t ON t.passage_id = p.passage_id
+            WHERE p.document_id = ? AND p.layer = 0
+            ORDER BY p.paragraph_index, t.token_index
+        ''', (doc_key,))
+        paragraphs = groupby(rows, key=lambda row: row[0])
+        next_index = 0
+        for para_idx, tokens in paragraphs:
+            # 没有词元的段落也要占一个位置
+            for _ in range(next_index, para_idx):
+                counter.add([])
+            counter.add([Token(surface, lexemes[lexeme_id]) for _, surface, lexeme_id in tokens])
+            next_index = para_idx + 1
+    finally:
         doc_conn.close()
-    
-    return doc
+    return counter
 
 
-def list_documents(tag_filter: List[str] = None, category_filter: str = None) -> List[Dict[str, Any]]:
+def _sum_ngrams(cursor, counter: _NgramCounter) -> int:
     """
-    列出所有文档
-    
+    把临时表中各块的次数合计到临时表 document_ngram_totals，返回文档的 N-gram 数
+
+    合计按主键 (kind, gram) 的顺序写入，rowid 从 1 开始连续，可以按 rowid 的范围分批加入全文库
+    （见 _add_ngrams）。只写临时表，不占用主索引的写锁。
+    """
+    counter.flush()
+    cursor.execute('''
+        CREATE TEMP TABLE IF NOT EXISTS document_ngram_totals (
+            kind TEXT NOT NULL,
+            gram TEXT NOT NULL,
+            n INTEGER NOT NULL,
+            token_count INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('DELETE FROM temp.document_ngram_totals')
+    cursor.execute('''
+        INSERT INTO temp.document_ngram_totals (rowid, kind, gram, n, token_count)
+        SELECT ROW_NUMBER() OVER (ORDER BY kind, gram), kind, gram, MIN(n), SUM(token_count)
+        FROM temp.document_ngrams GROUP BY kind, gram
+    ''')
+    cursor.execute('DELETE FROM temp.document_ngrams')
+    return cursor.execute('SELECT COUNT(*) FROM temp.document_ngram_totals').fetchone()[0]
+
+
+def _add_ngrams(cursor, first: int, last: int, sign: int = 1):
+    """把 document_ngram_totals 中 rowid 在 first～last 的 N-gram 加入（sign=1）或减出（sign=-1）全文库的合计"""
+    if sign > 0:
+        cursor.execute('''
+            INSERT INTO ngrams (kind, gram, n, token_count, document_count)
+            SELECT kind, gram, n, token_count, 1 FROM temp.document_ngram_totals WHERE rowid BETWEEN ? AND ?
+            ON CONFLICT (kind, gram) DO UPDATE SET
+                token_count = token_count + excluded.token_count,
+                document_count = document_count + 1
+        ''', (first, last))
+        return
+    # 减出：已被 prune_ngrams 删除的行不再恢复，次数降到 0 以下的行删除
+    cursor.execute('''
+        UPDATE ngrams SET token_count = ngrams.token_count - d.token_count,
+                          document_count = ngrams.document_count - 1
+        FROM (SELECT kind, gram, token_count FROM temp.document_ngram_totals WHERE rowid BETWEEN ? AND ?) AS d
+        WHERE ngrams.kind = d.kind AND ngrams.gram = d.gram
+    ''', (first, last))
+    cursor.execute('''
+        DELETE FROM ngrams WHERE token_count <= 0 AND (kind, gram) IN (
+            SELECT kind, gram FROM temp.document_ngram_totals WHERE rowid BETWEEN ? AND ?
+        )
+    ''', (first, last))
+
+
+def _index_ngrams(cursor, counter: _NgramCounter, sign: int = 1, until: Optional[Tuple[str, str]] = None):
+    """
+    把一个文档的 N-gram 加入（sign=1）或减出（sign=-1）全文库的合计
+
+    until 为 (kind, gram) 时只处理主键不大于它的部分（分批加入中途停止时已加入的部分，见 ngram_progress）。
+    """
+    last = _sum_ngrams(cursor, counter)
+    if until is not None:
+        last = cursor.execute('''
+            SELECT COALESCE(MAX(rowid), 0) FROM temp.document_ngram_totals WHERE (kind, gram) <= (?, ?)
+        ''', until).fetchone()[0]
+    _add_ngrams(cursor, 1, last, sign)
+
+
+def _index_lemma_sequence(cursor, doc_id: int, counter: _NgramCounter):
+    """
+    保存文档的基本形序列（替换已有的），并计入 lemma_terms 的词频
+
+    序列中的基本形以 lemma_terms 的编号保存，标点和段落末尾为 0。
+    """
+    _unindex_lemma_sequence(cursor, doc_id)
+    counts = Counter(counter.sequence)
+    counts.pop(0, None)
+    if not counts:
+        return
+    lemmas = [''] * (len(counter.lemma_ids) + 1)
+    for lemma, local_id in counter.lemma_ids.items():
+        lemmas[local_id] = lemma
+    cursor.execute('''
+        SELECT t.lemma, t.id FROM json_each(?) j JOIN lemma_terms t ON t.lemma = j.value
+    ''', (json.dumps(lemmas[1:], ensure_ascii=False),))
+    ids = dict(cursor.fetchall())
+    term_ids = array('I', [0] * len(lemmas))
+    for local_id, count in counts.items():
+        lemma = lemmas[local_id]
+        if lemma in ids:
+            cursor.execute('UPDATE lemma_terms SET token_count = token_count + ? WHERE id = ?',
+                           (count, ids[lemma]))
+        else:
+            cursor.execute('INSERT INTO lemma_terms (lemma, token_count) VALUES (?, ?)', (lemma, count))
+            ids[lemma] = cursor.lastrowid
+        term_ids[local_id] = ids[lemma]
+    sequence = array('I', (term_ids[local_id] for local_id in counter.sequence))
+    cursor.execute('''
+        INSERT INTO lemma_sequences (document_id, lemmas, paragraph_starts) VALUES (?, ?, ?)
+    ''', (doc_id, _pack_positions(sequence), _pack_positions(counter.starts)))
+
+
+def _unindex_lemma_sequence(cursor, doc_id: int):
+    """删除文档的基本形序列，从 lemma_terms 中减去其词频"""
+    row = cursor.execute('SELECT lemmas FROM lemma_sequences WHERE document_id = ?', (doc_id,)).fetchone()
+    if row is None:
+        return
+    counts = Counter(unpack_positions(row[0]))
+    counts.pop(0, None)
+    cursor.executemany('UPDATE lemma_terms SET token_count = token_count - ? WHERE id = ?',
+                       ((count, term_id) for term_id, count in counts.items()))
+    cursor.executemany('DELETE FROM lemma_terms WHERE id = ? AND token_count <= 0',
+                       ((term_id,) for term_id in counts))
+    cursor.execute('DELETE FROM lemma_sequences WHERE document_id = ?', (doc_id,))
+
+
+def prune_ngrams(min_count: int = NGRAM_MIN_COUNT) -> int:
+    """
+    删除全文库中出现次数低于阈值的 N-gram，限制索引的大小
+
+    被删除的条目之后再次出现时从 0 重新计数，因此剪枝后的次数是下限；
+    需要精确次数时用 rebuild_ngrams 重建。
+
+    Returns:
+        删除的 N-gram 数
+    """
+    conn = get_registry_connection()
+    try:
+        with conn:
+            return conn.execute('DELETE FROM ngrams WHERE token_count < ?', (min_count,)).rowcount
+    finally:
+        conn.close()
+
+
+def rebuild_ngrams(min_count: int = 1) -> int:
+    """
+    从各文档数据库重建 N-gram 索引和基本形序列，min_count 大于 1 时按全文库的次数剪枝
+
+    Returns:
+        索引中的 N-gram 数
+    """
+    conn = get_registry_connection()
+    try:
+        with conn:
+            cursor = conn.cursor()
+            for table in ('ngrams', 'lemma_sequences', 'lemma_terms'):
+                cursor.execute(f'DELETE FROM {table}')
+            cursor.execute("DELETE FROM index_backfill WHERE name = 'ngrams'")
+            cursor.execute('''
+                DELETE FROM ngram_progress WHERE document_id IN (SELECT id FROM documents WHERE status = ?)
+            ''', (DOCUMENT_COMPLETE,))
+            cursor.execute('SELECT id, db_filename FROM documents WHERE status = ?', (DOCUMENT_COMPLETE,))
+            for row in cursor.fetchall():
+                ngrams = _read_ngrams(cursor, row['db_filename'])
+                _index_ngrams(cursor, ngrams)
+                _index_lemma_sequence(cursor, row['id'], ngrams)
+            cursor.execute('DELETE FROM ngrams WHERE token_count < ?', (min_count,))
+            return cursor.execute('SELECT COUNT(*) FROM ngrams').fetchone()[0]
+    finally:
+        conn.close()
+
+
+# ===== 索引补建 =====
+
+# 旧版本文库中补建的索引（index_backfill.name），按建立顺序排列：频度表和立方体由语料索引求得
+BACKFILL_INDEXES = ('search', 'postings', 'frequencies', 'cube', 'ngrams')
+
+
+def backfill_pending() -> int:
+    """还需补建索引的文档数"""
+    conn = get_registry_connection()
+    try:
+        return conn.execute('''
+            SELECT COUNT(DISTINCT b.document_id) FROM index_backfill b JOIN documents d ON d.id = b.document_id
+        ''').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def backfill_indexes(progress=None) -> dict:
+    """
+    为旧版本文库的已有文档补建新增的索引（init_registry 首次创建索引表时记入 index_backfill 的部分）
+
+    逐个文档建立索引：检索表的段落和 N-gram 像保存时一样分批在短事务中写入（见 INDEX_BATCH_PARAGRAPHS），
+    其余索引在最后一个事务中写入并删除该文档的 index_backfill 记录。中断后再次调用即可继续，
+    已加入的 N-gram 记在 ngram_progress 中，不会重复计入。补建完成前的检索和统计不包括未补建的文档。
+
     Args:
-        tag_filter: 按标签筛选
-        category_filter: 按标签类别筛选
+        progress: 每补建完一个文档调用 progress(doc_id, 补建的索引名列表)
+
+    Returns:
+        {'documents': 补建的文档数, 'seconds': 耗时}
     """
+    start = time.time()
+    count = 0
     conn = get_registry_connection()
+    try:
+        cursor = conn.cursor()
+        while True:
+            row = cursor.execute('''
+                SELECT b.document_id, d.db_filename FROM index_backfill b JOIN documents d ON d.id = b.document_id
+                ORDER BY b.document_id LIMIT 1
+            ''').fetchone()
+            if row is None:
+                break
+            doc_id, db_filename = row
+            cursor.execute('SELECT name FROM index_backfill WHERE document_id = ?', (doc_id,))
+            names = [name for (name,) in cursor.fetchall()]
+            if count:
+                time.sleep(INDEX_BATCH_PAUSE)
+            _backfill_document(conn, doc_id, db_filename, names)
+            count += 1
+            if progress:
+                progress(doc_id, [name for name in BACKFILL_INDEXES if name in names])
+    finally:
+        conn.close()
+    return {'documents': count, 'seconds': time.time() - start}
+
+
+def _backfill_waiting(cursor, doc_id: int, name: str) -> bool:
+    """文档的该索引是否仍待补建（补建中文档可能被删除，或索引被整体重建）"""
+    cursor.execute('SELECT 1 FROM index_backfill WHERE document_id = ? AND name = ?', (doc_id, name))
+    return cursor.fetchone() is not None
+
+
+def _backfill_document(conn, doc_id: int, db_filename: str, names: List[str]):
+    """补建一个文档的索引（见 backfill_indexes）"""
     cursor = conn.cursor()
-    
-    query = '''
-        SELECT DISTINCT d.id, d.title, d.dictionary, d.paragraph_count, d.token_count, 
-               d.created_at, d.updated_at
-        FROM documents d
-    '''
-    
-    params = []
-    
-    if tag_filter or category_filter:
-        query += ' JOIN document_tags dt ON d.id = dt.document_id'
-        query += ' JOIN tags t ON dt.tag_id = t.id'
-        
-        conditions = []
-        if tag_filter:
-            placeholders = ','.join('?' * len(tag_filter))
-            conditions.append(f't.name IN ({placeholders})')
-            params.extend(tag_filter)
-        if category_filter:
-            conditions.append('t.category = ?')
-            params.append(category_filter)
-        
-        query += ' WHERE ' + ' AND '.join(conditions)
-    
-    query += ' ORDER BY d.updated_at DESC'
-    
-    cursor.execute(query, params)
-    rows = cursor.fetchall()
-    
-    documents = []
-    for row in rows:
-        doc = dict(row)
-        
-        # 获取该文档的所有标签
-        cursor.execute('''
-            SELECT t.name, t.category FROM tags t
-            JOIN document_tags dt ON t.id = dt.tag_id
-            WHERE dt.document_id = ?
-        ''', (doc['id'],))
-        doc['tags'] = [{'name': r['name'], 'category': r['category']} for r in cursor.fetchall()]
-        
-        # 获取元数据
-        cursor.execute('SELECT key, value FROM document_metadata WHERE document_id = ?', (doc['id'],))
-        doc['metadata'] = {r['key']: r['value'] for r in cursor.fetchall()}
-        
-        documents.append(doc)
-    
-    conn.close()
-    return documents
+    if 'search' in names:
+        with conn:
+            cursor.execute('DELETE FROM search_paragraphs WHERE document_id = ?', (doc_id,))
+        texts = _read_paragraph_texts(db_filename)
+        for index, batch in enumerate(iter(lambda: list(islice(texts, INDEX_BATCH_PARAGRAPHS)), [])):
+            if index:
+                time.sleep(INDEX_BATCH_PAUSE)
+            with conn:
+                if not _backfill_waiting(cursor, doc_id, 'search'):
+                    break
+                _insert_paragraphs(cursor, doc_id, batch)
+
+    ngrams = None
+    if 'ngrams' in names:
+        ngrams = _read_ngrams(cursor, db_filename)
+        ngram_count = _sum_ngrams(cursor, ngrams)
+        conn.commit()
+        while True:
+            # 从 ngram_progress 记录的位置继续（上次中断或其他进程已加入的部分）
+            with conn:
+                if not _backfill_waiting(cursor, doc_id, 'ngrams'):
+                    break
+                first = cursor.execute('''
+                    SELECT COALESCE(MAX(t.rowid), 0) + 1 FROM temp.document_ngram_totals t
+                    JOIN ngram_progress p ON (t.kind, t.gram) <= (p.kind, p.gram)
+                    WHERE p.document_id = ?
+                ''', (doc_id,)).fetchone()[0]
+                if first > ngram_count:
+                    break
+                _add_ngram_batch(cursor, doc_id, first, min(first + INDEX_BATCH_NGRAMS - 1, ngram_count))
+            time.sleep(INDEX_BATCH_PAUSE)
+
+    postings, surface_lexemes = _read_postings(db_filename) if 'postings' in names else (None, None)
+    surfaces = _read_surface_counts(db_filename) if 'frequencies' in names else None
+    with conn:
+        waiting = [name for name in BACKFILL_INDEXES if name in names and _backfill_waiting(cursor, doc_id, name)]
+        if 'postings' in waiting:
+            _index_tokens(cursor, doc_id, postings, surface_lexemes)
+        if 'frequencies' in waiting:
+            _index_frequencies(cursor, doc_id, surfaces)
+        if 'cube' in waiting:
+            _index_features(cursor, doc_id)
+        if 'ngrams' in waiting:
+            _index_lemma_sequence(cursor, doc_id, ngrams)
+            cursor.execute('DELETE FROM ngram_progress WHERE document_id = ?', (doc_id,))
+        cursor.executemany('DELETE FROM index_backfill WHERE document_id = ? AND name = ?',
+                           ((doc_id, name) for name in waiting))
 
 
 def delete_document(doc_id: int) -> bool:
@@ -439,27 +2813,321 @@ def delete_document(doc_id: int) -> bool:
     cursor = conn.cursor()
     
     # 获取数据库文件名
-    cursor.execute('SELECT db_filename FROM documents WHERE id = ?', (doc_id,))
+    cursor.execute('SELECT db_filename, status FROM documents WHERE id = ?', (doc_id,))
     row = cursor.fetchone()
     if not row:
         conn.close()
         return False
     
     db_filename = row['db_filename']
+    # N-gram 索引只有合计，要在删除文档数据库前重新计数后减去
+    # （保存中或补建中的文档只减去 ngram_progress 记录的已加入部分）
+    cursor.execute("SELECT 1 FROM index_backfill WHERE document_id = ? AND name = 'ngrams'", (doc_id,))
+    indexed = row['status'] == DOCUMENT_COMPLETE and cursor.fetchone() is None
+    progress = None
+    if not indexed:
+        progress = cursor.execute('SELECT kind, gram FROM ngram_progress WHERE document_id = ?',
+                                  (doc_id,)).fetchone()
+    ngrams = _read_ngrams(cursor, db_filename) if indexed or progress else None
     
     # 删除索引记录（会级联删除标签关联和元数据）
     cursor.execute('DELETE FROM documents WHERE id = ?', (doc_id,))
+    cursor.execute('DELETE FROM document_layers WHERE document_id = ?', (doc_id,))
+    cursor.execute('DELETE FROM index_backfill WHERE document_id = ?', (doc_id,))
+    cursor.execute('DELETE FROM search_paragraphs WHERE document_id = ?', (doc_id,))
+    cursor.execute('DELETE FROM postings WHERE document_id = ?', (doc_id,))
+    _unindex_frequencies(cursor, doc_id)
+    _uncount_cube(cursor, doc_id)
+    cursor.execute('DELETE FROM document_features WHERE document_id = ?', (doc_id,))
+    if ngrams is not None:
+        _index_ngrams(cursor, ngrams, -1, tuple(progress) if progress else None)
+    cursor.execute('DELETE FROM ngram_progress WHERE document_id = ?', (doc_id,))
+    _unindex_lemma_sequence(cursor, doc_id)
     conn.commit()
     conn.close()
     
-    # 删除数据库文件
-    db_path = os.path.join(DOCUMENTS_DIR, db_filename)
-    if os.path.exists(db_path):
-        os.remove(db_path)
+    db_path, doc_key = document_location(db_filename)
+    if '#' in db_filename:
+        # 分片：只删除该文档的行
+        if os.path.exists(db_path):
+            doc_conn = open_document_db(db_filename)
+            try:
+                with doc_conn:
+                    _delete_document_rows(doc_conn.cursor(), doc_key)
+            finally:
+                doc_conn.close()
+    else:
+        # 删除数据库文件（先关闭连接池中的连接，连同 WAL 文件一起删除）
+        _remove_db_file(db_path)
+    
+    return True
+
+
+def _remove_db_file(db_path: str):
+    """关闭连接池中的连接，删除数据库文件及其 WAL 文件"""
+    connections.discard(db_path)
+    for path in (db_path, db_path + '-wal', db_path + '-shm'):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def list_shards() -> List[str]:
+    """现有分片数据库的路径（按分片编号排序）"""
+    if not os.path.isdir(SHARDS_DIR):
+        return []
+    return sorted(os.path.join(SHARDS_DIR, name) for name in os.listdir(SHARDS_DIR)
+                  if re.fullmatch(r'shard_\d+\.db', name))
+
+
+def connect_corpus() -> sqlite3.Connection:
+    """
+    打开跨分片查询用的连接（用完后 close()）
+    
+    全部分片以 shard_NN 为名 ATTACH，并建立合并各分片的临时视图:
+        corpus_paragraphs(shard, document_id, paragraph_id, paragraph_index, content)
+        corpus_tokens(shard, document_id, paragraph_id, paragraph_index, token_index,
+                      layer_dictionary, surface, features)
+    document_id 即主索引中的文档ID；layer_dictionary 为附加分析层的辞书名（主辞书层为 NULL）；
+    features 为特征的JSON。独立文件中的文档不在视图中（可先用 migrate_document_to_shard 迁移）。
+    压缩保存的 content 和 features 在视图中解压（也可对各分片的表使用 SQL 函数 unpack_text）。
+    """
+    shards = list_shards()
+    conn = sqlite3.connect(':memory:', timeout=connections.BUSY_TIMEOUT)
+    conn.row_factory = sqlite3.Row
+    limit = conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+    if len(shards) > limit:
+        conn.close()
+        raise ValueError(f"分片数 {len(shards)} 超过 SQLite 可同时 ATTACH 的上限 {limit}")
+    
+    schemas = []
+    
+    def load_dictionary(dictionary_id: int) -> Optional[bytes]:
+        for schema in schemas:
+            row = conn.execute(f'SELECT dictionary FROM {schema}.compression_dictionaries WHERE id = ?',
+                               (dictionary_id,)).fetchone()
+            if row:
+                return row[0]
+        return None
+    
+    conn.create_function('unpack_text', 1, lambda value: compression.unpack(value, load_dictionary),
+                         deterministic=True)
+    
+    paragraph_selects = []
+    token_selects = []
+    for path in shards:
+        number = int(re.search(r'(\d+)', os.path.basename(path)).group(1))
+        schema = f'shard_{number:02d}'
+        # 旧结构的分片先升级
+        connections.connect(path, prepare=migrate_document_db).close()
+        conn.execute(f'ATTACH DATABASE ? AS {schema}', (path,))
+        schemas.append(schema)
+        # 未压缩的值（TEXT）不经过 Python 函数
+        paragraph_selects.append(f'''
+            SELECT {number} AS shard, p.document_id, p.id AS paragraph_id, p.paragraph_index,
+                   CASE WHEN typeof(ps.content) = 'blob' THEN unpack_text(ps.content) ELSE ps.content END
+                   AS content
+            FROM {schema}.paragraphs p
+            JOIN {schema}.passages ps ON ps.id = p.passage_id
+            WHERE p.layer = 0
+        ''')
+        token_selects.append(f'''
+            SELECT {number} AS shard, p.document_id, p.id AS paragraph_id, p.paragraph_index, t.token_index,
+                   ly.dictionary AS layer_dictionary, t.surface,
+                   CASE WHEN typeof(l.features) = 'blob' THEN unpack_text(l.features) ELSE l.features END
+                   AS features
+            FROM {schema}.paragraphs p
+            JOIN {schema}.tokens t ON t.passage_id = p.passage_id
+            JOIN {schema}.lexemes l ON l.id = t.lexeme_id
+            LEFT JOIN {schema}.layers ly ON ly.id = p.layer
+        ''')
+    
+    if shards:
+        conn.execute('CREATE TEMP VIEW corpus_paragraphs AS ' + ' UNION ALL '.join(paragraph_selects))
+        conn.execute('CREATE TEMP VIEW corpus_tokens AS ' + ' UNION ALL '.join(token_selects))
+    return conn
+
+
+def migrate_document_to_shard(doc_id: int, shard_count: int = None) -> bool:
+    """
+    把独立文件中的文档迁移到分片（用 ATTACH 在分片连接上直接复制各表）
+    
+    复制在一个事务中完成，之后更新主索引的存储位置并删除原文件。
+    中途中断时原文件和主索引不变，重新执行即可（分片中残留的行会先被删除）。
+    
+    Args:
+        doc_id: 文档ID
+        shard_count: 分片数（省略时为 SHARD_COUNT）
+    
+    Returns:
+        是否进行了迁移（文档不存在或已在分片中时为 False）
+    """
+    conn = get_registry_connection()
+    row = conn.execute('SELECT db_filename FROM documents WHERE id = ?', (doc_id,)).fetchone()
+    conn.close()
+    if not row or '#' in row['db_filename']:
+        return False
+    
+    src_path = document_location(row['db_filename'])[0]
+    target = f"{SHARD_FILENAME.format(doc_id % (shard_count or SHARD_COUNT))}#{doc_id}"
+    shard_path, doc_key = document_location(target)
+    ensure_directories()
+    if not os.path.exists(shard_path):
+        create_document_db(shard_path)
+    
+    if os.path.exists(src_path):
+        # 源文件先升级到当前结构
+        open_document_db(row['db_filename']).close()
+        
+        shard_conn = connections.connect(shard_path, prepare=migrate_document_db)
+        shard_conn.execute('ATTACH DATABASE ? AS src', (src_path,))
+        try:
+            with connections.bulk_write(shard_conn):
+                cursor = shard_conn.cursor()
+                _delete_document_rows(cursor, doc_key)
+                
+                cursor.execute('''
+                    INSERT INTO content (id, original_text)
+                    SELECT ?, original_text FROM src.content WHERE id = 1
+                ''', (doc_key,))
+                
+                # 分析层按辞书名、词素按特征、段落内容按哈希对应到分片中的编号
+                cursor.execute('INSERT OR IGNORE INTO layers (dictionary) SELECT dictionary FROM src.layers')
+                # 两边的词素可能以不同的方式（字典）压缩，解压后按特征对应，新词素按当前方式写入分片
+                lexicon = _Lexicon(cursor)
+                unpack = _unpacker(cursor, 'src')
+                cursor.execute('SELECT id, features FROM src.lexemes')
+                lexeme_map = [(src_id, lexicon.id_for(features_from_json(unpack(features))))
+                              for src_id, features in cursor.fetchall()]
+                lexicon.write(cursor)
+                cursor.execute('DROP TABLE IF EXISTS temp.lexeme_map')
+                cursor.execute('CREATE TEMP TABLE lexeme_map (src_id INTEGER PRIMARY KEY, dst_id INTEGER NOT NULL)')
+                cursor.executemany('INSERT INTO temp.lexeme_map (src_id, dst_id) VALUES (?, ?)', lexeme_map)
+                # 分片中还没有的段落内容先以引用计数 0 加入（文本的压缩不用字典，按原样复制），只为这些内容复制词元
+                cursor.execute('''
+                    INSERT INTO main.passages (hash, content, refcount)
+                    SELECT hash, content, 0 FROM src.passages
+                    WHERE hash NOT IN (SELECT hash FROM main.passages)
+                    ORDER BY id
+                ''')
+                new_passages = '''
+                    WITH passage_map (src_id, dst_id) AS (
+                        SELECT s.id, m.id FROM src.passages s
+                        JOIN main.passages m ON m.hash = s.hash
+                        WHERE m.refcount = 0
+                    )
+                '''
+                cursor.execute(new_passages + '''
+                    INSERT INTO tokens (passage_id, token_index, surface, lexeme_id)
+                    SELECT pm.dst_id, t.token_index, t.surface, lm.dst_id
+                    FROM passage_map pm
+                    JOIN src.tokens t ON t.passage_id = pm.src_id
+                    JOIN temp.lexeme_map lm ON lm.src_id = t.lexeme_id
+                    ORDER BY pm.dst_id, t.token_index
+                ''')
+                cursor.execute('DROP TABLE temp.lexeme_map')
+                cursor.execute(new_passages + '''
+                    INSERT INTO sentences (passage_id, level, sentence_index, start_token, end_token)
+                    SELECT pm.dst_id, s.level, s.sentence_index, s.start_token, s.end_token
+                    FROM passage_map pm JOIN src.sentences s ON s.passage_id = pm.src_id
+                ''')
+                
+                cursor.execute('''
+                    WITH layer_map (src_id, dst_id) AS (
+                        SELECT 0, 0
+                        UNION ALL
+                        SELECT s.id, m.id FROM src.layers s JOIN main.layers m ON m.dictionary = s.dictionary
+                    )
+                    INSERT INTO paragraphs (document_id, layer, paragraph_index, passage_id)
+                    SELECT ?, lm.dst_id, p.paragraph_index, mp.id
+                    FROM src.paragraphs p
+                    JOIN layer_map lm ON lm.src_id = p.layer
+                    JOIN src.passages sp ON sp.id = p.passage_id
+                    JOIN main.passages mp ON mp.hash = sp.hash
+                    ORDER BY p.id
+                ''', (doc_key,))
+                cursor.execute('''
+                    UPDATE passages SET refcount = refcount + r.n
+                    FROM (SELECT passage_id, COUNT(*) AS n FROM paragraphs
+                          WHERE document_id = ? GROUP BY passage_id) AS r
+                    WHERE passages.id = r.passage_id
+                ''', (doc_key,))
+        finally:
+            shard_conn.execute('DETACH DATABASE src')
+            shard_conn.close()
+    
+    conn = get_registry_connection()
+    conn.execute('UPDATE documents SET db_filename = ? WHERE id = ?', (target, doc_id))
+    conn.commit()
+    conn.close()
     
+    _remove_db_file(src_path)
     return True
 
 
+def recompress_database(db_path: str) -> Tuple[int, int]:
+    """
+    按当前压缩方式（COMPRESSION）重写数据库中已保存的原文、段落文本和词素特征，之后 VACUUM 回收空间
+    
+    为 'none' 时解压为文本。在一个事务中完成，中断时数据库不变。
+    
+    Returns:
+        (重写前的文件大小, 重写后的文件大小)
+    """
+    before = os.path.getsize(db_path)
+    conn = connections.connect(db_path, prepare=migrate_document_db)
+    try:
+        with connections.bulk_write(conn):
+            cursor = conn.cursor()
+            unpack = _unpacker(cursor)
+            pack = compression.Packer(COMPRESSION).pack
+            for table, column in (('content', 'original_text'), ('passages', 'content')):
+                last_id = 0
+                while True:
+                    rows = cursor.execute(f'SELECT id, {column} FROM {table} WHERE id > ? ORDER BY id LIMIT ?',
+                                          (last_id, BULK_BATCH_ROWS)).fetchall()
+                    if not rows:
+                        break
+                    cursor.executemany(f'UPDATE {table} SET {column} = ? WHERE id = ?',
+                                       [(pack(unpack(value)), row_id) for row_id, value in rows])
+                    last_id = rows[-1][0]
+            
+            # 词素数为词汇量，一次读入（没有字典时以全部词素训练）
+            lexemes = [(lexeme_id, unpack(features))
+                       for lexeme_id, features in cursor.execute('SELECT id, features FROM lexemes').fetchall()]
+            pack = _features_packer(cursor, [raw for _, raw in lexemes]).pack
+            cursor.executemany('UPDATE lexemes SET features = ? WHERE id = ?',
+                               [(pack(raw), lexeme_id) for lexeme_id, raw in lexemes])
+        conn.execute('VACUUM')
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    finally:
+        conn.close()
+    return before, os.path.getsize(db_path)
+
+
+def recompress_storage(progress=None) -> Dict[str, Any]:
+    """
+    按当前压缩方式重写全部文档数据库（独立文件和分片）
+    
+    Args:
+        progress: 每个数据库完成后以 (路径, 重写前大小, 重写后大小) 调用的函数
+    
+    Returns:
+        {'databases': 数据库数, 'before': 重写前总字节数, 'after': 重写后总字节数}
+    """
+    paths = list_shards()
+    if os.path.isdir(DOCUMENTS_DIR):
+        paths += sorted(os.path.join(DOCUMENTS_DIR, name) for name in os.listdir(DOCUMENTS_DIR)
+                        if name.endswith('.db'))
+    stats = {'databases': len(paths), 'before': 0, 'after': 0}
+    for path in paths:
+        before, after = recompress_database(path)
+        stats['before'] += before
+        stats['after'] += after
+        if progress:
+            progress(path, before, after)
+    return stats
+
+
 def update_document_title(doc_id: int, title: str) -> bool:
     """更新文档标题"""
     conn = get_registry_connection()
@@ -483,6 +3151,8 @@ def update_document_metadata(doc_id: int, metadata: Dict[str, str]) -> bool:
             INSERT OR REPLACE INTO document_metadata (document_id, key, value)
             VALUES (?, ?, ?)
         ''', (doc_id, key, value))
+    if 'era' in metadata:
+        _recount_cube(cursor, doc_id)
     
     cursor.execute('UPDATE documents SET updated_at = ? WHERE id = ?', 
                   (datetime.now().isoformat(), doc_id))
@@ -509,6 +3179,7 @@ def update_document_tags(doc_id: int, tags: List[str]) -> bool:
         if tag_row:
             cursor.execute('INSERT INTO document_tags (document_id, tag_id) VALUES (?, ?)',
                          (doc_id, tag_row['id']))
+    _recount_cube(cursor, doc_id)
     
     cursor.execute('UPDATE documents SET updated_at = ? WHERE id = ?',
                   (datetime.now().isoformat(), doc_id))
@@ -531,6 +3202,10 @@ def ensure_era_tag(era_name: str) -> None:
         # 如果存在但类别不是era，更新为era
         if row['category'] != 'era':
             cursor.execute('UPDATE tags SET category = ? WHERE id = ?', ('era', row['id']))
+            # 已有该标签的文档改为按时代计入立方体
+            cursor.execute('SELECT document_id FROM document_tags WHERE tag_id = ?', (row['id'],))
+            for tagged in cursor.fetchall():
+                _recount_cube(cursor, tagged['document_id'])
     else:
         # 不存在则创建
         cursor.execute('INSERT INTO tags (name, category) VALUES (?, ?)', (era_name, 'era'))
@@ -568,18 +3243,47 @@ def get_tag_categories() -> List[Dict[str, Any]]:
     return categories
 
 
-def check_existing_analysis(content: str, dictionary: str) -> Optional[Dict[str, Any]]:
-    """检查是否已有相同内容的分析"""
+def find_document_id(content: str, dictionary: str) -> Optional[int]:
+    """按内容哈希查找已保存完毕的文档ID（保存中的文档不算）"""
     content_hash = compute_hash(content, dictionary)
     
     conn = get_registry_connection()
     cursor = conn.cursor()
-    cursor.execute('SELECT id FROM documents WHERE content_hash = ?', (content_hash,))
+    cursor.execute('SELECT id FROM documents WHERE content_hash = ? AND status = ?',
+                   (content_hash, DOCUMENT_COMPLETE))
     row = cursor.fetchone()
     conn.close()
     
-    if row:
-        return get_document(row['id'])
+    return row['id'] if row else None
+
+
+def _find_registered(content_hash: str) -> Optional[sqlite3.Row]:
+    """按内容哈希查找已登记的文档（包括保存中的），stale 表示保存已超时"""
+    conn = get_registry_connection()
+    try:
+        return conn.execute('''
+            SELECT id, status, status = ? AND updated_at < datetime('now', ?) AS stale
+            FROM documents WHERE content_hash = ?
+        ''', (DOCUMENT_SAVING, f'-{SAVE_STALE_SECONDS} seconds', content_hash)).fetchone()
+    finally:
+        conn.close()
+
+
+def _touch_document(doc_id: int):
+    """更新保存中文档的 updated_at（表示保存仍在进行，见 SAVE_STALE_SECONDS）"""
+    conn = get_registry_connection()
+    try:
+        with conn:
+            conn.execute('UPDATE documents SET updated_at = CURRENT_TIMESTAMP WHERE id = ?', (doc_id,))
+    finally:
+        conn.close()
+
+
+def check_existing_analysis(content: str, dictionary: str) -> Optional[Dict[str, Any]]:
+    """检查是否已有相同内容的分析"""
+    doc_id = find_document_id(content, dictionary)
+    if doc_id is not None:
+        return get_document(doc_id)
     return None
 
 
@@ -596,6 +3300,3 @@ def create_tag(name: str, category: str = 'general') -> int:
     conn.close()
     return tag_id
 
-
-# 初始化数据库
-init_registry()
@@ -0,0 +1,374 @@
+"""
+インポートジョブキュー - SQLiteに保存したジョブを別プロセスのワーカーで解析・保存する
+HTTPリクエストの中で解析せず、ジョブIDを返して進捗を問い合わせてもらう
+キューはファイルに保存されるため、サーバーを再起動しても未処理のジョブは失われない
+"""
+import json
+import os
+import sqlite3
+import time
+import traceback
+from typing import Any, Dict, List, Optional
+
+from . import analyzer
+from . import connections
+from . import document_manager
+
+JOBS_PATH = os.path.join(document_manager.DATA_DIR, "jobs.db")
+
+# デフォルト設定
+DEFAULT_MAX_ATTEMPTS = 3        # 失敗時の最大試行回数
+RETRY_BASE_DELAY = 5.0          # 再試行までの待ち時間（秒、試行ごとに倍増）
+POLL_INTERVAL = 1.0             # 空のキューを確認する間隔（秒）
+STALE_TIMEOUT = 120.0           # この秒数ハートビートがない実行中ジョブは中断とみなす
+PROGRESS_INTERVAL = 0.5         # 進捗を書き込む最小間隔（秒）
+
+# ジョブの状態
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def _connect(path: Optional[str] = None) -> connections.PooledConnection:
+    """ジョブデータベースの接続を借りる（close() で返却）"""
+    path = path or JOBS_PATH
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # ワーカーとWebサーバーが同時に読み書きするため、プールの接続（WAL）を使う
+    return connections.connect(path, prepare=_create_tables)
+
+
+def _create_tables(conn: sqlite3.Connection) -> None:
+    """ジョブテーブルを作成"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            status TEXT NOT NULL DEFAULT 'queued',
+            payload TEXT NOT NULL,
+            title TEXT,
+            dictionary TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL DEFAULT 3,
+            paragraphs_total INTEGER DEFAULT 0,
+            paragraphs_done INTEGER DEFAULT 0,
+            tokens_done INTEGER DEFAULT 0,
+            document_id INTEGER,
+            cached INTEGER DEFAULT 0,
+            error TEXT,
+            worker TEXT,
+            run_after REAL NOT NULL DEFAULT 0,
+            heartbeat REAL,
+            created_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, run_after)')
+    conn.commit()
+
+
+def _job_dict(row: sqlite3.Row) -> Dict[str, Any]:
+    """ジョブ行を応答用の辞書に変換（本文は含めない）"""
+    job = dict(row)
+    job.pop('payload', None)
+    job['cached'] = bool(job['cached'])
+    return job
+
+
+def submit_job(title: str, content: str, dictionary: str = 'unidic-chuko',
+               tags: List[str] = None, metadata: Dict[str, str] = None,
+               max_attempts: int = DEFAULT_MAX_ATTEMPTS, path: Optional[str] = None) -> int:
+    """
+    インポートジョブを登録し、ジョブIDを返す
+
+    Args:
+        title: 文書タイトル
+        content: 原文
+        dictionary: 使用する辞書
+        tags: タグリスト
+        metadata: メタデータ
+        max_attempts: 失敗時の最大試行回数
+    """
+    if dictionary not in analyzer.AVAILABLE_DICTIONARIES:
+        raise ValueError(f"不明な辞書: {dictionary}")
+
+    payload = json.dumps({
+        'title': title,
+        'content': content,
+        'dictionary': dictionary,
+        'tags': tags or [],
+        'metadata': metadata or {}
+    }, ensure_ascii=False)
+
+    conn = _connect(path)
+    with conn:
+        cursor = conn.execute('''
+            INSERT INTO jobs (payload, title, dictionary, max_attempts, paragraphs_total, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (payload, title, dictionary, max_attempts,
+              len(analyzer.split_paragraphs(content)), time.time()))
+        job_id = cursor.lastrowid
+    conn.close()
+    return job_id
+
+
+def get_job(job_id: int, path: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """ジョブの状態と進捗を取得"""
+    conn = _connect(path)
+    row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    conn.close()
+    return _job_dict(row) if row else None
+
+
+def list_jobs(status: Optional[str] = None, limit: int = 50,
+              path: Optional[str] = None) -> List[Dict[str, Any]]:
+    """最近のジョブを新しい順に取得"""
+    conn = _connect(path)
+    if status:
+        rows = conn.execute('SELECT * FROM jobs WHERE status = ? ORDER BY id DESC LIMIT ?',
+                            (status, limit)).fetchall()
+    else:
+        rows = conn.execute('SELECT * FROM jobs ORDER BY id DESC LIMIT ?', (limit,)).fetchall()
+    conn.close()
+    return [_job_dict(row) for row in rows]
+
+
+def retry_job(job_id: int, path: Optional[str] = None) -> bool:
+    """失敗したジョブを再びキューに戻す（試行回数はリセット）"""
+    conn = _connect(path)
+    with conn:
+        cursor = conn.execute('''
+            UPDATE jobs SET status = ?, attempts = 0, error = NULL, run_after = 0
+            WHERE id = ? AND status = ?
+        ''', (QUEUED, job_id, FAILED))
+    conn.close()
+    return cursor.rowcount > 0
+
+
+def requeue_stale(timeout: float = STALE_TIMEOUT, path: Optional[str] = None) -> int:
+    """
+    ハートビートが途絶えた実行中ジョブ（ワーカーの異常終了・再起動）をキューに戻す
+    試行回数を使い切ったジョブは失敗とする
+    """
+    now = time.time()
+    conn = _connect(path)
+    with conn:
+        conn.execute('''
+            UPDATE jobs SET status = ?, finished_at = ?, error = 'ワーカーが応答しなくなりました'
+            WHERE status = ? AND heartbeat < ? AND attempts >= max_attempts
+        ''', (FAILED, now, RUNNING, now - timeout))
+        cursor = conn.execute('''
+            UPDATE jobs SET status = ?, worker = NULL, run_after = 0
+            WHERE status = ? AND heartbeat < ?
+        ''', (QUEUED, RUNNING, now - timeout))
+    conn.close()
+    return cursor.rowcount
+
+
+def claim_job(worker: str, path: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """実行可能な最も古いジョブを1つ取り出して実行中にする（なければ None）"""
+    now = time.time()
+    conn = _connect(path)
+    try:
+        # 複数のワーカーが同じジョブを取らないよう書き込みロックを取ってから選ぶ
+        conn.execute('BEGIN IMMEDIATE')
+        row = conn.execute('''
+            UPDATE jobs
+            SET status = ?, worker = ?, attempts = attempts + 1,
+                started_at = ?, heartbeat = ?, paragraphs_done = 0, tokens_done = 0
+            WHERE id = (
+                SELECT id FROM jobs WHERE status = ? AND run_after <= ?
+                ORDER BY id LIMIT 1
+            )
+            RETURNING *
+        ''', (RUNNING, worker, now, now, QUEUED, now)).fetchone()
+        conn.commit()
+    finally:
+        conn.close()
+
+    if row is None:
+        return None
+    job = dict(row)
+    job['payload'] = json.loads(job['payload'])
+    return job
+
+
+def update_progress(job_id: int, paragraphs_done: int, tokens_done: int,
+                    path: Optional[str] = None) -> None:
+    """進捗（処理済みの段落数・語数）を記録し、ハートビートを更新"""
+    conn = _connect(path)
+    with conn:
+        conn.execute('''
+            UPDATE jobs SET paragraphs_done = ?, tokens_done = ?, heartbeat = ? WHERE id = ?
+        ''', (paragraphs_done, tokens_done, time.time(), job_id))
+    conn.close()
+
+
+def _set_document(job_id: int, document_id: Optional[int], path: Optional[str] = None) -> None:
+    """ジョブが作成中の文書IDを記録"""
+    conn = _connect(path)
+    with conn:
+        conn.execute('UPDATE jobs SET document_id = ? WHERE id = ?', (document_id, job_id))
+    conn.close()
+
+
+def complete_job(job_id: int, document_id: int, cached: bool = False,
+                 path: Optional[str] = None) -> None:
+    """ジョブを完了にする"""
+    conn = _connect(path)
+    with conn:
+        conn.execute('''
+            UPDATE jobs SET status = ?, document_id = ?, cached = ?, error = NULL,
+                            finished_at = ?, paragraphs_done = paragraphs_total
+            WHERE id = ?
+        ''', (DONE, document_id, int(cached), time.time(), job_id))
+    conn.close()
+
+
+def fail_job(job_id: int, error: str, path: Optional[str] = None) -> str:
+    """
+    ジョブの失敗を記録する
+    試行回数が残っていれば待ち時間を置いて再試行、なければ失敗とする
+
+    Returns:
+        更新後の状態（queued または failed）
+    """
+    now = time.time()
+    conn = _connect(path)
+    with conn:
+        row = conn.execute('SELECT attempts, max_attempts FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row and row['attempts'] < row['max_attempts']:
+            status = QUEUED
+            run_after = now + RETRY_BASE_DELAY * 2 ** (row['attempts'] - 1)
+        else:
+            status = FAILED
+            run_after = 0
+        conn.execute('''
+            UPDATE jobs SET status = ?, error = ?, run_after = ?, worker = NULL, document_id = NULL,
+                            finished_at = CASE WHEN ? = 'failed' THEN ? ELSE NULL END
+            WHERE id = ?
+        ''', (status, error, run_after, status, now, job_id))
+    conn.close()
+    return status
+
+
+def run_job(job: Dict[str, Any], path: Optional[str] = None) -> int:
+    """
+    ジョブを1つ実行し、保存した文書IDを返す
+    解析済みの同一テキストがあれば再解析せずにその文書を返す。
+    同じテキストを別のリクエスト・ワーカーが保存中なら、終わるのを待ってからその文書を返す
+    （保存が失敗して文書が削除された場合はこのジョブで保存する）
+    """
+    payload = job['payload']
+    content = payload['content']
+    dictionary = payload['dictionary']
+
+    # 前回の試行がワーカーごと中断した場合、書きかけの文書が残っているので削除する
+    if job.get('document_id'):
+        document_manager.delete_document(job['document_id'])
+
+    while True:
+        existing_id = document_manager.find_document_id(content, dictionary)
+        if existing_id:
+            complete_job(job['id'], existing_id, cached=True, path=path)
+            return existing_id
+        try:
+            doc_id = document_manager.create_document(
+                payload['title'], content, dictionary, payload['tags'], payload['metadata'])
+            break
+        except document_manager.DocumentExists:
+            # 待っている間もハートビートを更新する
+            update_progress(job['id'], 0, 0, path=path)
+            time.sleep(POLL_INTERVAL)
+    _set_document(job['id'], doc_id, path=path)
+
+    paragraphs_done = 0
+    tokens_done = 0
+    last_report = time.monotonic()
+    # ワーカー自体が並列に動くため、ジョブ内の解析は逐次で行う
+    for para in document_manager.iter_save_paragraphs(
+            doc_id, analyzer.iter_analyze_text(content, dictionary)):
+        paragraphs_done += 1
+        tokens_done += len(para['tokens'])
+        if time.monotonic() - last_report >= PROGRESS_INTERVAL:
+            update_progress(job['id'], paragraphs_done, tokens_done, path=path)
+            last_report = time.monotonic()
+
+    update_progress(job['id'], paragraphs_done, tokens_done, path=path)
+    complete_job(job['id'], doc_id, path=path)
+    return doc_id
+
+
+def worker_loop(worker: str, path: Optional[str] = None, cache_path: Optional[str] = None,
+                poll_interval: float = POLL_INTERVAL, max_jobs: Optional[int] = None) -> None:
+    """
+    ワーカーのメインループ: キューからジョブを取り出して順に実行する
+
+    Args:
+        worker: ワーカー名（ジョブに記録される）
+        path: ジョブデータベースのパス
+        cache_path: 段落解析キャッシュの保存先（None でメモリのみ）
+        poll_interval: キューが空の時に待つ秒数
+        max_jobs: この件数を処理したら終了（None で無制限）
+    """
+    analyzer.configure_cache(path=cache_path)
+    processed = 0
+
+    while max_jobs is None or processed < max_jobs:
+        requeue_stale(path=path)
+        job = claim_job(worker, path=path)
+        if job is None:
+            time.sleep(poll_interval)
+            continue
+
+        try:
+            run_job(job, path=path)
+        except Exception as e:
+            traceback.print_exc()
+            # 書きかけの文書が残っていれば削除してから再試行に回す
+            current = get_job(job['id'], path=path)
+            if current and current['document_id']:
+                document_manager.delete_document(current['document_id'])
+            fail_job(job['id'], f"{type(e).__name__}: {e}", path=path)
+        processed += 1
+
+
+def start_workers(count: int, path: Optional[str] = None,
+                  cache_path: Optional[str] = None) -> list:
+    """
+    ワーカープロセスを起動する（親プロセスの終了時に一緒に終了する）
+
+    Returns:
+        起動した multiprocessing.Process のリスト
+    """
+    import multiprocessing
+
+    # Webサーバーのスレッドや開いた接続を引き継がないよう spawn で起動する
+    context = multiprocessing.get_context('spawn')
+    processes = []
+    for index in range(count):
+        process = context.Process(
+            target=worker_loop, name=f'komachi-job-worker-{index}',
+            args=(f'worker-{os.getpid()}-{index}', path, cache_path), daemon=True)
+        process.start()
+        processes.append(process)
+    return processes
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Project Komachi インポートジョブワーカー')
+    parser.add_argument('--workers', type=int, default=1, help='ワーカープロセス数')
+    parser.add_argument('--db', default=None, help='ジョブデータベースのパス')
+    parser.add_argument('--cache', default=os.path.join(document_manager.DATA_DIR, 'analysis_cache.db'),
+                        help='段落解析キャッシュの保存先（空文字列でメモリのみ）')
+    args = parser.parse_args()
+
+    workers = start_workers(args.workers, args.db, args.cache or None)
+    print(f"ワーカーを{len(workers)}個起動しました（Ctrl+C で停止）")
+    try:
+        for process in workers:
+            process.join()
+    except KeyboardInterrupt:
+        pass
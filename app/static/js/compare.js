@@ -136,9 +136,12 @@ function updateSelectedDocsDisplay() {
 }
 
 // ===== 加载文档数据 =====
+// docId 为 "文档ID" 或 "文档ID@辞书"（同一文档的其他辞书分析层）
 async function loadDocument(docId) {
     try {
-        const response = await fetch(`/api/library/documents/${docId}`);
+        const [id, layer] = docId.split('@');
+        const query = layer ? `?dictionary=${encodeURIComponent(layer)}` : '';
+        const response = await fetch(`/api/library/documents/${id}${query}`);
         const data = await response.json();
         
         if (data.document) {
@@ -174,7 +177,7 @@ function renderComparePanels() {
                 <div class="panel-header">
                     <h3>${escapeHtml(doc.title)}</h3>
                     <div class="panel-meta">
-                        <span>${doc.dictionary}</span>
+                        <span>${doc.layer || doc.dictionary}</span>
                         <span>${doc.paragraph_count}段落</span>
                         <span>${doc.token_count}語句</span>
                     </div>
@@ -318,8 +318,8 @@ async function doImport() {
             return;
         }
         
-        // 然后进行解析
-        const analyzeResponse = await fetch('/api/library/import', {
+        // 然后登记导入任务（解析和保存由后台工作进程执行）
+        const submitResponse = await fetch('/api/library/jobs', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({
@@ -334,9 +334,19 @@ async function doImport() {
             })
         });
         
-        const analyzeData = await analyzeResponse.json();
+        const submitData = await submitResponse.json();
         
-        if (analyzeResponse.ok) {
+        if (!submitResponse.ok) {
+            alert(submitData.error || '解析に失敗しました');
+            return;
+        }
+        
+        document.getElementById('btn-do-import').disabled = true;
+        const job = await waitForJob(submitData.job.id);
+        document.getElementById('btn-do-import').disabled = false;
+        document.getElementById('import-progress').style.display = 'none';
+        
+        if (job.status === 'done') {
             hideAllModals();
             // 清空表单
             fileInput.value = '';
@@ -351,13 +361,45 @@ async function doImport() {
             
             alert('インポートが完了しました');
         } else {
-            alert(analyzeData.error || '解析に失敗しました');
+            alert(job.error || '解析に失敗しました');
         }
     } catch (error) {
+        document.getElementById('btn-do-import').disabled = false;
         alert('インポートに失敗しました: ' + error.message);
     }
 }
 
+// 轮询导入任务的状态，显示进度，直到完成或最终失败
+const JOB_POLL_INTERVAL = 1000;
+
+async function waitForJob(jobId) {
+    const progress = document.getElementById('import-progress');
+    const bar = document.getElementById('import-progress-bar');
+    const text = document.getElementById('import-progress-text');
+    progress.style.display = 'block';
+    
+    while (true) {
+        const response = await fetch(`/api/library/jobs/${jobId}`);
+        const data = await response.json();
+        if (!response.ok) throw new Error(data.error || 'ジョブの状態を取得できません');
+        
+        const job = data.job;
+        if (job.status === 'done' || job.status === 'failed') return job;
+        
+        bar.max = Math.max(job.paragraphs_total, 1);
+        bar.value = job.paragraphs_done;
+        if (job.status === 'queued') {
+            text.textContent = job.attempts > 0
+                ? `再試行待ち（${job.attempts}/${job.max_attempts}回目が失敗: ${job.error || ''}）`
+                : '待機中...';
+        } else {
+            text.textContent = `解析中: ${job.paragraphs_done}/${job.paragraphs_total}段落 · ${job.tokens_done}語`;
+        }
+        
+        await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL));
+    }
+}
+
 // ===== 标签输入 =====
 function setupTagInput(containerId, inputId, tagsArray) {
     const container = document.getElementById(containerId);
@@ -27,6 +27,9 @@ const elements = {
 let currentDocument = null;
 let selectedToken = null;
 let colorEnabled = false;  // カラー表示状態
+// 段落ごとのトークン要素と文節索引（トークン番号 → 文節番号）
+let paragraphViews = [];
+let highlightedTokens = [];
 
 // 特徴ラベルマッピング
 const featureLabels = {
@@ -186,7 +189,7 @@ async function analyzeText() {
     showLoading();
     
     try {
-        const response = await fetch('/api/analyze', {
+        const response = await fetch('/api/analyze/stream', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json'
@@ -194,15 +197,14 @@ async function analyzeText() {
             body: JSON.stringify({ text, title, dictionary })
         });
         
-        const data = await response.json();
-        
-        if (data.success) {
-            currentDocument = data.document;
-            renderResult(data.document, data.cached);
-            updateDocumentList();
-        } else {
+        if (!response.ok) {
+            const data = await response.json();
             alert('解析失敗: ' + data.error);
+            return;
         }
+        
+        await readAnalysisStream(response);
+        updateDocumentList();
     } catch (error) {
         alert('解析エラー: ' + error.message);
     } finally {
@@ -210,49 +212,106 @@ async function analyzeText() {
     }
 }
 
+// NDJSONストリームを読み込み、段落が届くたびに描画する
+async function readAnalysisStream(response) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    
+    const handleLine = (line) => {
+        if (!line.trim()) return;
+        const event = JSON.parse(line);
+        
+        if (event.type === 'document') {
+            currentDocument = { ...event.document, paragraphs: [] };
+            renderResult(currentDocument, event.cached);
+        } else if (event.type === 'paragraph') {
+            currentDocument.paragraphs.push(event.paragraph);
+            appendParagraph(event.paragraph, event.index);
+            updateResultInfo(currentDocument, null);
+            hideLoading();
+        } else if (event.type === 'error') {
+            throw new Error(event.error);
+        }
+    };
+    
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop();
+        lines.forEach(handleLine);
+    }
+    handleLine(buffer + decoder.decode());
+}
+
 // ===== 結果をレンダリング =====
 function renderResult(docData, cached) {
     elements.resultTitle.textContent = docData.title;
+    updateResultInfo(docData, cached);
+    
+    elements.resultContainer.innerHTML = '';
+    paragraphViews = [];
+    highlightedTokens = [];
+    docData.paragraphs.forEach((para, paraIdx) => appendParagraph(para, paraIdx));
+    
+    // 詳細パネルをリセット
+    resetDetailPanel();
+}
+
+// 結果情報（辞書・段落数）を更新（cached が null の場合は既存の表示を保つ）
+function updateResultInfo(docData, cached) {
+    if (cached !== null) {
+        elements.resultInfo.dataset.cached = cached ? '1' : '';
+    }
     
     const info = [];
     info.push(docData.dictionary);
     info.push(`${docData.paragraphs.length}段`);
-    if (cached) info.push('(キャッシュ)');
+    if (elements.resultInfo.dataset.cached) info.push('(キャッシュ)');
     elements.resultInfo.textContent = info.join(' · ');
-    
+}
+
+// 1段落分のHTMLを結果コンテナの末尾に追加
+function appendParagraph(para, paraIdx) {
     let html = '';
     
-    docData.paragraphs.forEach((para, paraIdx) => {
-        html += `<div class="paragraph" data-para="${paraIdx}">`;
-        html += `<div class="paragraph-index">第${paraIdx + 1}段</div>`;
-        html += `<div class="paragraph-content">`;
-        
-        para.tokens.forEach((token, tokenIdx) => {
-            const posValue = cleanFeatureValue(token.features[0]);
-            const color = posColors[posValue] || '#333333';
-            // デフォルトで下線を表示、data-colorに色を保存
-            html += `<span class="token" 
-                          data-para="${paraIdx}" 
-                          data-token="${tokenIdx}"
-                          data-color="${color}"
-                          data-surface="${escapeHtml(token.surface)}"
-                          style="border-bottom: 2px solid ${color};">`;
-            html += escapeHtml(token.surface);
-            html += `</span>`;
-        });
-        
-        html += `</div></div>`;
+    html += `<div class="paragraph" data-para="${paraIdx}">`;
+    html += `<div class="paragraph-index">第${paraIdx + 1}段</div>`;
+    html += `<div class="paragraph-content">`;
+    
+    para.tokens.forEach((token, tokenIdx) => {
+        const posValue = cleanFeatureValue(token.features[0]);
+        const color = posColors[posValue] || '#333333';
+        // デフォルトで下線を表示、data-colorに色を保存
+        html += `<span class="token" 
+                      data-para="${paraIdx}" 
+                      data-token="${tokenIdx}"
+                      data-color="${color}"
+                      data-surface="${escapeHtml(token.surface)}"
+                      style="border-bottom: 2px solid ${color};">`;
+        html += escapeHtml(token.surface);
+        html += `</span>`;
     });
     
-    elements.resultContainer.innerHTML = html;
+    html += `</div></div>`;
+    
+    elements.resultContainer.insertAdjacentHTML('beforeend', html);
     
     // トークンクリックイベントをバインド
-    document.querySelectorAll('.token').forEach(el => {
+    const paragraphEl = elements.resultContainer.lastElementChild;
+    paragraphEl.querySelectorAll('.token').forEach(el => {
         el.addEventListener('click', handleTokenClick);
     });
     
-    // 詳細パネルをリセット
-    resetDetailPanel();
+    const clauses = para.clauses || [];
+    paragraphViews[paraIdx] = {
+        tokens: Array.from(paragraphEl.querySelectorAll('.token')),
+        clauses: clauses,
+        clauseOf: buildSpanIndex(clauses, para.tokens.length)
+    };
 }
 
 function handleTokenClick(e) {
@@ -277,51 +336,34 @@ function handleTokenClick(e) {
     showTokenDetail(token);
 }
 
-// 文節区切り文字（句読点）
-const sentenceDelimiters = ['。', '、', '！', '？', '\n'];
+// 範囲リスト [[開始, 終了), ...] からトークン番号 → 範囲番号の索引を作成
+function buildSpanIndex(spans, tokenCount) {
+    const index = new Int32Array(tokenCount).fill(-1);
+    spans.forEach(([start, end], spanIdx) => index.fill(spanIdx, start, end));
+    return index;
+}
 
 function highlightSentence(clickedToken) {
     // まず全てのカラーをクリア
     clearSentenceColors();
     
-    const paraIdx = parseInt(clickedToken.dataset.para);
+    const view = paragraphViews[parseInt(clickedToken.dataset.para)];
     const tokenIdx = parseInt(clickedToken.dataset.token);
-    const paragraph = clickedToken.closest('.paragraph-content');
-    const tokens = Array.from(paragraph.querySelectorAll('.token'));
-    
-    // 前の句読点を探す（後ろ向き）
-    let startIdx = tokenIdx;
-    for (let i = tokenIdx - 1; i >= 0; i--) {
-        const surface = tokens[i].dataset.surface || tokens[i].textContent;
-        if (sentenceDelimiters.some(d => surface.includes(d))) {
-            startIdx = i + 1;
-            break;
-        }
-        if (i === 0) startIdx = 0;
-    }
+    if (!view) return;
     
-    // 次の句読点を探す（前向き）
-    let endIdx = tokenIdx;
-    for (let i = tokenIdx; i < tokens.length; i++) {
-        const surface = tokens[i].dataset.surface || tokens[i].textContent;
-        if (sentenceDelimiters.some(d => surface.includes(d))) {
-            endIdx = i;
-            break;
-        }
-        if (i === tokens.length - 1) endIdx = i;
-    }
+    // サーバーで計算済みの文節境界から範囲を引く
+    const spanIdx = view.clauseOf[tokenIdx];
+    if (spanIdx < 0) return;
+    const [startIdx, endIdx] = view.clauses[spanIdx];
     
     // 該当範囲のトークンにカラーを適用（高亮効果）
-    for (let i = startIdx; i <= endIdx; i++) {
-        const token = tokens[i];
-        token.classList.add('color-active');
-    }
+    highlightedTokens = view.tokens.slice(startIdx, endIdx);
+    highlightedTokens.forEach(token => token.classList.add('color-active'));
 }
 
 function clearSentenceColors() {
-    document.querySelectorAll('.token.color-active').forEach(el => {
-        el.classList.remove('color-active');
-    });
+    highlightedTokens.forEach(el => el.classList.remove('color-active'));
+    highlightedTokens = [];
 }
 
 function showTokenDetail(token) {
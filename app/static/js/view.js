@@ -49,6 +49,9 @@ const featureLabels = {
 // 状態
 let colorEnabled = false;
 let selectedToken = null;
+// 段落ごとのトークン要素と文節索引（トークン番号 → 文節番号）
+const paragraphViews = [];
+let highlightedTokens = [];
 
 // DOM 要素
 const detailContent = document.getElementById('detail-content');
@@ -58,6 +61,14 @@ const colorToggle = document.getElementById('color-toggle');
 document.addEventListener('DOMContentLoaded', init);
 
 function init() {
+    // 文節索引を段落ごとに作成
+    document.querySelectorAll('.paragraph-content').forEach(content => {
+        const paraIdx = parseInt(content.closest('.paragraph').dataset.para);
+        const tokens = Array.from(content.querySelectorAll('.token'));
+        const clauses = JSON.parse(decodeHtmlEntities(content.dataset.clauses || '[]'));
+        paragraphViews[paraIdx] = { tokens, clauses, clauseOf: buildSpanIndex(clauses, tokens.length) };
+    });
+    
     // トークンの下線色を設定
     document.querySelectorAll('.token').forEach(token => {
         const featuresStr = decodeHtmlEntities(token.dataset.features || '[]');
@@ -107,48 +118,33 @@ function handleTokenClick(tokenEl, features) {
     showTokenDetail(tokenEl, features);
 }
 
-// 句読点
-const sentenceDelimiters = ['。', '、', '！', '？', '\n'];
+// 範囲リスト [[開始, 終了), ...] からトークン番号 → 範囲番号の索引を作成
+function buildSpanIndex(spans, tokenCount) {
+    const index = new Int32Array(tokenCount).fill(-1);
+    spans.forEach(([start, end], spanIdx) => index.fill(spanIdx, start, end));
+    return index;
+}
 
 function highlightSentence(clickedToken) {
     clearSentenceColors();
     
-    const paragraph = clickedToken.closest('.paragraph-content');
-    const tokens = Array.from(paragraph.querySelectorAll('.token'));
-    const tokenIdx = tokens.indexOf(clickedToken);
-    
-    // 前の句読点を探す
-    let startIdx = tokenIdx;
-    for (let i = tokenIdx - 1; i >= 0; i--) {
-        const surface = tokens[i].dataset.surface;
-        if (sentenceDelimiters.some(d => surface.includes(d))) {
-            startIdx = i + 1;
-            break;
-        }
-        if (i === 0) startIdx = 0;
-    }
+    const view = paragraphViews[parseInt(clickedToken.dataset.para)];
+    const tokenIdx = parseInt(clickedToken.dataset.token);
+    if (!view) return;
     
-    // 次の句読点を探す
-    let endIdx = tokenIdx;
-    for (let i = tokenIdx; i < tokens.length; i++) {
-        const surface = tokens[i].dataset.surface;
-        if (sentenceDelimiters.some(d => surface.includes(d))) {
-            endIdx = i;
-            break;
-        }
-        if (i === tokens.length - 1) endIdx = i;
-    }
+    // サーバーで計算済みの文節境界から範囲を引く
+    const spanIdx = view.clauseOf[tokenIdx];
+    if (spanIdx < 0) return;
+    const [startIdx, endIdx] = view.clauses[spanIdx];
     
     // カラーを適用
-    for (let i = startIdx; i <= endIdx; i++) {
-        tokens[i].classList.add('color-active');
-    }
+    highlightedTokens = view.tokens.slice(startIdx, endIdx);
+    highlightedTokens.forEach(token => token.classList.add('color-active'));
 }
 
 function clearSentenceColors() {
-    document.querySelectorAll('.token.color-active').forEach(el => {
-        el.classList.remove('color-active');
-    });
+    highlightedTokens.forEach(el => el.classList.remove('color-active'));
+    highlightedTokens = [];
 }
 
 function showTokenDetail(tokenEl, features) {
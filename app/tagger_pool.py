@@ -0,0 +1,127 @@
+"""
+taggerプール - 辞書ごとに複数のMeCab taggerを用意し、スレッド間で安全に貸し出す
+MeCabのtaggerは再入可能ではないため、1つのインスタンスを同時に複数スレッドで使わない
+"""
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+
+# デフォルト設定
+DEFAULT_POOL_SIZE = 4          # 辞書ごとの最大tagger数
+DEFAULT_POOL_TIMEOUT = 30.0    # 空きtaggerを待つ最大秒数
+
+
+class TaggerPoolTimeout(TimeoutError):
+    """プールのtaggerが全て使用中のまま待ち時間を超えた"""
+
+
+class TaggerPool:
+    """
+    taggerの貸し出しプール
+
+    taggerは必要になった時に size まで遅延生成する。同じスレッドが貸し出し中に
+    再度 checkout した場合は同じtaggerを返すため、入れ子の呼び出しでも
+    デッドロックしない。
+    """
+
+    def __init__(self, factory: Callable[[], Any], size: int = DEFAULT_POOL_SIZE,
+                 timeout: Optional[float] = DEFAULT_POOL_TIMEOUT):
+        if size < 1:
+            raise ValueError(f"プールサイズは1以上である必要があります: {size}")
+        self.factory = factory
+        self.size = size
+        self.timeout = timeout
+
+        self._idle: "queue.LifoQueue[Any]" = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        self._created = 0
+        self._in_use = 0
+        self._peak_in_use = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._wait_time = 0.0
+
+    def _acquire(self, timeout: Optional[float]) -> Any:
+        """空きtaggerを取得（なければ生成、上限なら待機）"""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            create = self._created < self.size
+            if create:
+                self._created += 1
+        if create:
+            try:
+                return self.factory()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        # 全て使用中: 返却を待つ
+        with self._lock:
+            self._waits += 1
+        start = time.monotonic()
+        try:
+            return self._idle.get(timeout=timeout)
+        except queue.Empty:
+            with self._lock:
+                self._timeouts += 1
+            raise TaggerPoolTimeout(
+                f"taggerプールが枯渇しています（{self.size}個が使用中、{timeout}秒待機）") from None
+        finally:
+            with self._lock:
+                self._wait_time += time.monotonic() - start
+
+    @contextmanager
+    def checkout(self, timeout: Optional[float] = None) -> Iterator[Any]:
+        """
+        taggerを貸し出す
+
+        Args:
+            timeout: 空きを待つ最大秒数（None でプールの既定値）
+
+        Raises:
+            TaggerPoolTimeout: 待ち時間内に空きができなかった場合
+        """
+        held = getattr(self._local, 'tagger', None)
+        if held is not None:
+            # 同じスレッドの入れ子の貸し出しは同じtaggerを使う
+            yield held
+            return
+
+        tagger = self._acquire(self.timeout if timeout is None else timeout)
+        with self._lock:
+            self._in_use += 1
+            self._checkouts += 1
+            self._peak_in_use = max(self._peak_in_use, self._in_use)
+        self._local.tagger = tagger
+        try:
+            yield tagger
+        finally:
+            self._local.tagger = None
+            with self._lock:
+                self._in_use -= 1
+            self._idle.put(tagger)
+
+    def stats(self) -> Dict[str, Any]:
+        """プールの使用状況を取得"""
+        with self._lock:
+            return {
+                'size': self.size,
+                'created': self._created,
+                'in_use': self._in_use,
+                'idle': self._created - self._in_use,
+                'peak_in_use': self._peak_in_use,
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'timeouts': self._timeouts,
+                'wait_seconds': round(self._wait_time, 3)
+            }
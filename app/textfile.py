@@ -0,0 +1,25 @@
+"""
+テキストファイル読み込み - アップロード・一括インポートで共通の文字コード判定
+"""
+from typing import Optional
+
+# 試行する文字コード（先に成功したものを採用）
+ENCODINGS = ['utf-8', 'utf-8-sig', 'shift_jis', 'euc-jp', 'cp932', 'iso-2022-jp']
+
+# テキストとして扱う拡張子
+TEXT_EXTENSIONS = {'txt', 'text'}
+
+
+def is_text_file(filename: str) -> bool:
+    """テキストファイルの拡張子か判定"""
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in TEXT_EXTENSIONS
+
+
+def decode_text(data: bytes) -> Optional[str]:
+    """バイト列を候補の文字コードで順に復号（どれでも復号できなければ None）"""
+    for encoding in ENCODINGS:
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return None
@@ -0,0 +1,200 @@
+"""
+トークンモデル - 解析結果のトークンを省メモリに表現
+特徴値は文字列を intern し、同一の特徴タプルは全トークンで1つのオブジェクトを共有する
+"""
+import json
+import sys
+from functools import lru_cache
+from typing import Iterable, List, Sequence, Tuple, Dict, Any
+
+# UniDicの特徴フィールド数
+FEATURE_COUNT = 25
+
+# 品詞カラーマッピング（フロントエンドのハイライト用）
+POS_COLORS = {
+    "名詞": "#4A90D9",       # 青
+    "動詞": "#E74C3C",       # 赤
+    "形容詞": "#27AE60",     # 緑
+    "形状詞": "#2ECC71",     # 淡緑
+    "副詞": "#9B59B6",       # 紫
+    "連体詞": "#F39C12",     # オレンジ
+    "接続詞": "#1ABC9C",     # シアン
+    "感動詞": "#E91E63",     # ピンク
+    "助詞": "#95A5A6",       # グレー
+    "助動詞": "#7F8C8D",     # 濃いグレー
+    "接頭辞": "#3498DB",     # 淡青
+    "接尾辞": "#2980B9",     # 濃青
+    "記号": "#BDC3C7",       # 淡いグレー
+    "補助記号": "#BDC3C7",   # 淡いグレー
+    "空白": "#ECF0F1",       # 白グレー
+}
+DEFAULT_COLOR = "#333333"
+
+# 文境界の判定に使う補助記号の品詞細分
+# 文（sentence）は句点で、文節（clause）は句点・読点で区切る
+SENTENCE_TERMINATORS = frozenset({"句点"})
+CLAUSE_TERMINATORS = frozenset({"句点", "読点"})
+# 区切りの直後に続く場合、直前の文に含める記号（「…。」の閉じ括弧など）
+_TRAILING_DETAILS = frozenset({"括弧閉"})
+_SYMBOL_POS = frozenset({"補助記号", "記号"})
+
+# 文のトークン範囲 [開始, 終了)
+Span = Tuple[int, int]
+
+# 同一内容の特徴タプルを共有するための表（語彙の種類数で頭打ちになる）
+_feature_tuples: Dict[Tuple[str, ...], Tuple[str, ...]] = {}
+
+
+def intern_features(features: Iterable[str]) -> Tuple[str, ...]:
+    """特徴値を intern し、同一内容の共有タプルを返す"""
+    values = tuple(features)
+    shared = _feature_tuples.get(values)
+    if shared is None:
+        # 初出の特徴タプルのみ各値を intern して登録する
+        shared = tuple(sys.intern(str(f)) for f in values)
+        shared = _feature_tuples.setdefault(shared, shared)
+    return shared
+
+
+@lru_cache(maxsize=65536)
+def features_from_json(raw: str) -> Tuple[str, ...]:
+    """保存形式（JSON文字列）の特徴を共有タプルに変換（頻出語の json.loads を省く）"""
+    return intern_features(json.loads(raw))
+
+
+@lru_cache(maxsize=65536)
+def _features_json(features: Tuple[str, ...]) -> str:
+    return json.dumps(features, ensure_ascii=False)
+
+
+def features_to_json(features: Iterable[str]) -> str:
+    """特徴を保存形式（JSON文字列）に変換（頻出語の json.dumps を省く）"""
+    return _features_json(features if isinstance(features, tuple) else tuple(features))
+
+
+class Token:
+    """
+    1トークン分の解析結果
+
+    保持するのは表層形と特徴タプルのみで、品詞・読みなどの名前付きフィールドは
+    特徴タプルから必要な時に取り出す。
+    """
+
+    __slots__ = ('surface', 'features')
+
+    def __init__(self, surface: str, features: Tuple[str, ...]):
+        self.surface = surface
+        self.features = features
+
+    @classmethod
+    def from_features(cls, surface: str, features: Iterable[str]) -> 'Token':
+        """特徴リストから共有タプルを使ってトークンを作成"""
+        return cls(surface, intern_features(features))
+
+    def _feature(self, index: int) -> str:
+        return self.features[index] if len(self.features) > index else ""
+
+    @property
+    def pos(self) -> str:
+        """品詞"""
+        return self._feature(0)
+
+    @property
+    def pos_detail(self) -> str:
+        """品詞細分"""
+        return self._feature(1)
+
+    @property
+    def conjugation_type(self) -> str:
+        """活用型"""
+        return self._feature(4)
+
+    @property
+    def conjugation_form(self) -> str:
+        """活用形"""
+        return self._feature(5)
+
+    @property
+    def reading(self) -> str:
+        """読み"""
+        return self._feature(8)
+
+    @property
+    def base_form(self) -> str:
+        """基本形"""
+        return self._feature(9)
+
+    @property
+    def kana(self) -> str:
+        """仮名"""
+        return self._feature(11)
+
+    @property
+    def origin(self) -> str:
+        """語種"""
+        return self._feature(12)
+
+    @property
+    def taigen_yougen(self) -> str:
+        """体言/用言"""
+        return self._feature(19)
+
+    @property
+    def color(self) -> str:
+        """品詞の表示色"""
+        return POS_COLORS.get(self.pos, DEFAULT_COLOR)
+
+    def __getitem__(self, key: str) -> Any:
+        # 旧来の辞書形式のトークン（token['surface'] など）との互換用
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key, default)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Token):
+            return NotImplemented
+        return self.surface == other.surface and self.features == other.features
+
+    def __hash__(self) -> int:
+        return hash((self.surface, self.features))
+
+    def __repr__(self) -> str:
+        return f"Token({self.surface!r}, {self.pos!r})"
+
+    def to_dict(self) -> Dict[str, Any]:
+        """JSONシリアライズ用の辞書に変換"""
+        return {"surface": self.surface, "features": list(self.features)}
+
+
+def sentence_spans(tokens: Sequence[Token], clauses: bool = False) -> List[Span]:
+    """
+    補助記号トークンから段落内の文境界を求める
+
+    Args:
+        tokens: 段落のトークン列
+        clauses: True なら読点でも区切る（文節単位）
+
+    Returns:
+        文ごとのトークン範囲 [開始, 終了) のリスト（段落全体を隙間なく覆う）
+    """
+    terminators = CLAUSE_TERMINATORS if clauses else SENTENCE_TERMINATORS
+    spans: List[Span] = []
+    start = 0
+    closing = False
+    for index, token in enumerate(tokens):
+        is_symbol = token.pos in _SYMBOL_POS
+        detail = token.pos_detail if is_symbol else ""
+        if closing and detail not in terminators and detail not in _TRAILING_DETAILS:
+            # 区切り記号（と閉じ括弧）の後の最初のトークンから次の文が始まる
+            spans.append((start, index))
+            start = index
+            closing = False
+        if detail in terminators:
+            closing = True
+    if start < len(tokens):
+        spans.append((start, len(tokens)))
+    return spans
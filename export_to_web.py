@@ -5,57 +5,71 @@
 import sys
 import os
 import json
+import textwrap
 
 # 添加主应用路径
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 from app import document_manager
 
 
+def _indented_json(value, level: int) -> str:
+    """json.dump(indent=2) 中第 level 层的值的写法（首行不缩进）"""
+    text = json.dumps(value, ensure_ascii=False, indent=2)
+    return textwrap.indent(text, '  ' * level)[2 * level:]
+
+
+def dump_json_stream(f, head: dict, key: str, items):
+    """
+    写出 head 加上列表 key 的JSON对象，输出与 json.dump(..., indent=2) 相同，
+    但列表逐项写入，无需整个列表驻留内存
+    """
+    f.write('{\n')
+    for name, value in head.items():
+        f.write(f'  {json.dumps(name, ensure_ascii=False)}: {_indented_json(value, 1)},\n')
+    f.write(f'  {json.dumps(key, ensure_ascii=False)}: [')
+    first = True
+    for item in items:
+        f.write('\n    ' if first else ',\n    ')
+        f.write(_indented_json(item, 2))
+        first = False
+    f.write(']' if first else '\n  ]')
+    f.write('\n}')
+
+
 def export_document(doc_id: int, output_dir: str) -> dict:
-    """导出单个文档为JSON"""
-    doc = document_manager.get_document(doc_id)
+    """导出单个文档为JSON（逐段读取并写出，超大文档也只占用一个段落的内存）"""
+    doc = document_manager.open_document(doc_id)
     if not doc:
         return None
     
     # 生成源ID（使用原始ID的3位数格式）
     source_id = f"{doc_id:03d}"
     
-    # 准备源数据
-    source_data = {
-        'content': doc.get('content', ''),
-        'paragraphs': []
-    }
-    
-    for para in doc.get('paragraphs', []):
-        para_data = {
-            'content': para.get('content', ''),
-            'tokens': []
-        }
-        for token in para.get('tokens', []):
-            para_data['tokens'].append({
-                'surface': token['surface'],
-                'features': token['features']
-            })
-        source_data['paragraphs'].append(para_data)
+    exists = doc.exists()
+    paragraphs = ({
+        'content': para['content'],
+        'tokens': [token.to_dict() for token in para['tokens']]
+    } for para in (doc.iter_paragraphs() if exists else []))
     
     # 保存JSON文件
     output_path = os.path.join(output_dir, f"{source_id}.json")
     with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(source_data, f, ensure_ascii=False, indent=2)
+        dump_json_stream(f, {'content': doc.content if exists else ''}, 'paragraphs', paragraphs)
     
     # 返回索引信息
+    info = doc.info
     tag_categories = {}
-    for tag in doc.get('tags', []):
+    for tag in info.get('tags', []):
         tag_categories[tag['name']] = tag.get('category', 'general')
     
     return {
         'id': source_id,
         'original_id': doc_id,
-        'title': doc['title'],
-        'dictionary': doc.get('dictionary', 'unidic-chuko'),
-        'tags': [t['name'] for t in doc.get('tags', [])],
+        'title': info['title'],
+        'dictionary': info.get('dictionary', 'unidic-chuko'),
+        'tags': [t['name'] for t in info.get('tags', [])],
         'tag_categories': tag_categories,
-        'metadata': doc.get('metadata', {})
+        'metadata': info.get('metadata', {})
     }
 
 
@@ -0,0 +1,323 @@
+"""
+语料批量导入工具 - 将目录或压缩包中的 .txt 文件批量解析并登记到文库
+
+用法（在主项目目录运行）:
+    python import_corpus.py 语料目录/            # 目录（递归）
+    python import_corpus.py corpus.zip            # zip / tar / tar.gz 压缩包
+    python import_corpus.py 语料目录/ --dictionary unidic-kindaibungo --workers 4 --tags 物語
+
+清单文件（manifest.json 或 manifest.csv，放在目录或压缩包的根部，或用 --manifest 指定）
+为每个文件指定标题、标签、元数据和辞书:
+    manifest.json: {"源氏/桐壺.txt": {"title": "桐壺", "tags": ["物語"], "metadata": {"era": "平安時代"}}}
+    manifest.csv : file,title,tags,dictionary,author,era   （tags 以 ; 分隔，其余列作为元数据）
+
+已登记的文件（按内容哈希判断）会被跳过，因此中断后重新运行即可从中断处继续。
+正在由其他进程保存的文件也跳过；保存中途被强制终止、超过 SAVE_STALE_SECONDS 未更新的残留文档会重新导入。
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import tarfile
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# 添加主应用路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from app import analyzer
+from app import document_manager
+from app import textfile
+
+MANIFEST_NAMES = ('manifest.json', 'manifest.csv')
+
+
+# ===== 读取语料 =====
+
+def iter_directory(root: str) -> Iterator[Tuple[str, bytes]]:
+    """递归遍历目录，按路径顺序返回 (相对路径, 内容)"""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if textfile.is_text_file(filename):
+                path = os.path.join(dirpath, filename)
+                with open(path, 'rb') as f:
+                    yield os.path.relpath(path, root).replace(os.sep, '/'), f.read()
+
+
+def iter_zip(path: str) -> Iterator[Tuple[str, bytes]]:
+    """遍历 zip 压缩包中的文本文件"""
+    with zipfile.ZipFile(path) as archive:
+        for name in sorted(archive.namelist()):
+            if not name.endswith('/') and textfile.is_text_file(name):
+                yield name, archive.read(name)
+
+
+def iter_tar(path: str) -> Iterator[Tuple[str, bytes]]:
+    """遍历 tar（含 tar.gz 等）压缩包中的文本文件"""
+    with tarfile.open(path) as archive:
+        for member in sorted(archive.getmembers(), key=lambda m: m.name):
+            if member.isfile() and textfile.is_text_file(member.name):
+                yield member.name, archive.extractfile(member).read()
+
+
+def iter_source(source: str) -> Iterator[Tuple[str, bytes]]:
+    """根据来源类型（目录 / zip / tar）返回文本文件"""
+    if os.path.isdir(source):
+        return iter_directory(source)
+    if zipfile.is_zipfile(source):
+        return iter_zip(source)
+    if tarfile.is_tarfile(source):
+        return iter_tar(source)
+    raise ValueError(f"不支持的来源（需要目录、zip 或 tar 压缩包）: {source}")
+
+
+def read_source_file(source: str, name: str) -> Optional[bytes]:
+    """读取来源根部的指定文件（清单文件用），不存在时返回 None"""
+    if os.path.isdir(source):
+        path = os.path.join(source, name)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                return f.read()
+        return None
+    if zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            return archive.read(name) if name in archive.namelist() else None
+    with tarfile.open(source) as archive:
+        try:
+            return archive.extractfile(name).read()
+        except KeyError:
+            return None
+
+
+# ===== 清单 =====
+
+def parse_manifest(name: str, data: bytes) -> Dict[str, Dict[str, Any]]:
+    """解析清单文件，返回 相对路径 -> {title, tags, metadata, dictionary}"""
+    text = textfile.decode_text(data)
+    if text is None:
+        raise ValueError(f"无法识别清单文件的编码: {name}")
+    text = text.lstrip('\ufeff')
+
+    entries: Dict[str, Dict[str, Any]] = {}
+    if name.endswith('.json'):
+        raw = json.loads(text)
+        if isinstance(raw, list):
+            raw = {item['file']: item for item in raw}
+        for path, item in raw.items():
+            entries[path] = {
+                'title': item.get('title'),
+                'tags': list(item.get('tags', [])),
+                'metadata': dict(item.get('metadata', {})),
+                'dictionary': item.get('dictionary'),
+            }
+    else:
+        for row in csv.DictReader(io.StringIO(text)):
+            path = row.pop('file')
+            tags = row.pop('tags', '') or ''
+            entries[path] = {
+                'title': row.pop('title', None) or None,
+                'tags': [t.strip() for t in tags.split(';') if t.strip()],
+                'dictionary': row.pop('dictionary', None) or None,
+                'metadata': {k: v for k, v in row.items() if v},
+            }
+    return entries
+
+
+def load_manifest(source: str, manifest_path: Optional[str]) -> Dict[str, Dict[str, Any]]:
+    """读取 --manifest 指定的清单，或来源根部的 manifest.json / manifest.csv"""
+    if manifest_path:
+        with open(manifest_path, 'rb') as f:
+            return parse_manifest(manifest_path, f.read())
+    for name in MANIFEST_NAMES:
+        data = read_source_file(source, name)
+        if data is not None:
+            return parse_manifest(name, data)
+    return {}
+
+
+# ===== 解析（工作进程） =====
+
+def analyze_file(task: Dict[str, Any]) -> Dict[str, Any]:
+    """在工作进程中解析一个文件，返回带解析结果的任务"""
+    # 语料中的段落很少重复，不使用段落解析缓存以免占用内存
+    task['paragraphs'] = analyzer.analyze_text(task['content'], task['dictionary'], use_cache=False)
+    return task
+
+
+# ===== 导入 =====
+
+def registered_documents() -> Dict[str, Tuple[int, str, bool]]:
+    """取得已登记文档的 内容哈希 -> (文档ID, 状态, 是否为超时未更新的保存中文档)"""
+    conn = document_manager.get_registry_connection()
+    rows = conn.execute('''
+        SELECT id, content_hash, status, status = ? AND updated_at < datetime('now', ?) AS stale
+        FROM documents
+    ''', (document_manager.DOCUMENT_SAVING, f'-{document_manager.SAVE_STALE_SECONDS} seconds')).fetchall()
+    conn.close()
+    return {row['content_hash']: (row['id'], row['status'], bool(row['stale'])) for row in rows}
+
+
+def iter_tasks(source: str, manifest: Dict[str, Dict[str, Any]], dictionary: str,
+               tags: List[str], stats: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """读取文件并生成待解析的任务（跳过已登记的文件）"""
+    registered = registered_documents()
+
+    for name, data in iter_source(source):
+        if os.path.basename(name) in MANIFEST_NAMES:
+            continue
+        stats['seen'] += 1
+
+        content = textfile.decode_text(data)
+        if content is None:
+            print(f"  ✖ {name}: 无法识别文件编码")
+            stats['failed'] += 1
+            continue
+        content = content.strip()
+        if not content:
+            stats['skipped'] += 1
+            continue
+
+        entry = manifest.get(name, {})
+        task_dictionary = entry.get('dictionary') or dictionary
+        content_hash = document_manager.compute_hash(content, task_dictionary)
+        existing = registered.get(content_hash)
+        if existing:
+            doc_id, status, stale = existing
+            if status == document_manager.DOCUMENT_COMPLETE:
+                stats['skipped'] += 1
+                continue
+            if not stale:
+                # 应用或另一个导入进程正在保存同一内容
+                print(f"  … {name}: 同一内容的文档正在保存中 [{doc_id}]，跳过")
+                stats['skipped'] += 1
+                continue
+            # 保存中途被强制终止而残留的文档：重新导入，保存时删除残留的文档（见 create_document）
+
+        metadata = dict(entry.get('metadata', {}))
+        task_tags = list(dict.fromkeys(tags + entry.get('tags', [])))
+        if metadata.get('era') and metadata['era'] not in task_tags:
+            task_tags.append(metadata['era'])
+
+        # 同一次导入中内容重复的文件只解析一次
+        registered[content_hash] = (0, document_manager.DOCUMENT_COMPLETE, False)
+        yield {
+            'name': name,
+            'title': entry.get('title') or os.path.splitext(os.path.basename(name))[0],
+            'content': content,
+            'dictionary': task_dictionary,
+            'tags': task_tags,
+            'metadata': metadata,
+        }
+
+
+def save_result(task: Dict[str, Any], stats: Dict[str, Any]) -> None:
+    """把解析结果写入文库"""
+    if task['metadata'].get('era'):
+        document_manager.ensure_era_tag(task['metadata']['era'])
+    doc_id = document_manager.save_document(
+        title=task['title'],
+        content=task['content'],
+        dictionary=task['dictionary'],
+        paragraphs=task['paragraphs'],
+        tags=task['tags'],
+        metadata=task['metadata']
+    )
+    token_count = sum(len(p['tokens']) for p in task['paragraphs'])
+    stats['imported'] += 1
+    stats['tokens'] += token_count
+    elapsed = time.perf_counter() - stats['start']
+    print(f"  ✓ [{doc_id}] {task['name']}  {len(task['paragraphs'])}段落 {token_count}词  "
+          f"({stats['imported'] / elapsed:.2f} 文件/秒, {stats['tokens'] / elapsed:.0f} 词/秒)")
+
+
+def import_corpus(source: str, dictionary: str = 'unidic-chuko', workers: Optional[int] = None,
+                  tags: List[str] = None, manifest_path: Optional[str] = None) -> Dict[str, Any]:
+    """
+    批量导入语料
+
+    Args:
+        source: 语料目录或压缩包
+        dictionary: 默认辞书（清单中可按文件指定）
+        workers: 解析用的进程数（None 为 CPU 数）
+        tags: 附加到所有文件的标签
+        manifest_path: 清单文件路径（省略时使用来源根部的清单）
+
+    Returns:
+        统计信息（文件数、跳过数、失败数、词数、耗时）
+    """
+    manifest = load_manifest(source, manifest_path)
+    workers = workers or os.cpu_count() or 1
+    stats = {'seen': 0, 'imported': 0, 'skipped': 0, 'failed': 0, 'tokens': 0,
+             'start': time.perf_counter()}
+
+    tasks = iter_tasks(source, manifest, dictionary, tags or [], stats)
+    # 解析在进程池中并行进行，写入由主进程逐个完成（SQLite 单写入者）
+    # 同时在途的文件数有上限，避免大语料全部驻留内存
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = {}
+        for task in tasks:
+            if task['dictionary'] not in analyzer.AVAILABLE_DICTIONARIES:
+                print(f"  ✖ {task['name']}: 不明的辞书 {task['dictionary']}")
+                stats['failed'] += 1
+                continue
+            pending[executor.submit(analyze_file, task)] = task['name']
+            if len(pending) >= workers * 2:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    _finish(future, pending.pop(future), stats)
+        for future in list(pending):
+            _finish(future, pending.pop(future), stats)
+
+    stats['seconds'] = time.perf_counter() - stats.pop('start')
+    return stats
+
+
+def _finish(future, name: str, stats: Dict[str, Any]) -> None:
+    """处理一个已完成的解析任务（失败时只记录，不中断整体导入）"""
+    try:
+        save_result(future.result(), stats)
+    except document_manager.DocumentExists as e:
+        # 解析期间其他进程开始保存同一内容
+        print(f"  … {name}: {e}，跳过")
+        stats['skipped'] += 1
+    except Exception as e:
+        print(f"  ✖ {name}: {type(e).__name__}: {e}")
+        stats['failed'] += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Project Komachi 语料批量导入')
+    parser.add_argument('source', help='语料目录，或 zip / tar 压缩包')
+    parser.add_argument('--dictionary', default='unidic-chuko', help='默认辞书')
+    parser.add_argument('--workers', type=int, default=None, help='解析进程数（默认为 CPU 数）')
+    parser.add_argument('--tags', default='', help='附加到所有文件的标签（逗号分隔）')
+    parser.add_argument('--manifest', default=None, help='清单文件（manifest.json / manifest.csv）')
+    args = parser.parse_args()
+
+    if args.dictionary not in analyzer.AVAILABLE_DICTIONARIES:
+        parser.error(f"不明的辞书: {args.dictionary}")
+
+    print("=" * 50)
+    print("Project Komachi - 语料批量导入")
+    print("=" * 50)
+    tags = [t.strip() for t in args.tags.split(',') if t.strip()]
+    stats = import_corpus(args.source, args.dictionary, args.workers, tags, args.manifest)
+
+    seconds = stats['seconds']
+    print()
+    print("=" * 50)
+    print(f"✓ 导入完成: {stats['imported']} 个文件（跳过 {stats['skipped']}，失败 {stats['failed']}，共 {stats['seen']}）")
+    print(f"  - 词数: {stats['tokens']}")
+    print(f"  - 耗时: {seconds:.1f} 秒")
+    if seconds > 0:
+        print(f"  - 吞吐: {stats['imported'] / seconds:.2f} 文件/秒, {stats['tokens'] / seconds:.0f} 词/秒")
+    print("=" * 50)
+    sys.exit(1 if stats['failed'] else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""
+存储迁移工具 - 将每文档一个数据库文件的文库迁移到分片存储，将旧数据库并入文库，改变压缩方式，或补建索引
+
+用法（在主项目目录运行）:
+    python migrate_storage.py                 # 迁移到默认数量（KOMACHI_SHARDS，默认 1）的分片
+    python migrate_storage.py --shards 4
+    python migrate_storage.py --legacy        # 将旧数据库 data/komachi.db 的文档并入文库
+    python migrate_storage.py --compression zlib   # 按 zlib/zstd/auto 重写已有文档（none 为解压）
+    python migrate_storage.py --backfill      # 为旧版本文库的已有文档补建新增的索引
+
+新导入的文档默认存入分片（KOMACHI_STORAGE=shards），以前的版本默认每文档一个文件，
+迁移后这些文档与新文档共用重复的段落（各分片内去重，默认一个分片即整个文库）。
+每个文档单独迁移并在完成后删除原文件，中断后重新运行即可继续。
+旧数据库按内容哈希去重（文库中已有的文档不再保存），全部并入后改名为 komachi.db.migrated 保留
+（确认无误后可手动删除）；
+应用启动时也会自动并入。
+压缩方式只决定新写入的值，已压缩和未压缩的数据可以混在一起读取；
+重写已有数据后，需要以 KOMACHI_COMPRESSION=方式 启动应用，新文档才会同样压缩。
+旧版本文库新增的索引在应用启动后于后台补建，也可以事先用 --backfill 补建（中断后重新运行即可继续）。
+"""
+import argparse
+import os
+import sys
+import time
+
+# 添加主应用路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from app import compression, database, document_manager
+
+
+def directory_usage(path: str):
+    """目录中的数据库文件数和总字节数（含 WAL 文件）"""
+    if not os.path.isdir(path):
+        return 0, 0
+    entries = [entry for entry in os.scandir(path) if entry.is_file()]
+    return (sum(1 for entry in entries if entry.name.endswith('.db')),
+            sum(entry.stat().st_size for entry in entries))
+
+
+def migrate_to_shards(shard_count: int) -> dict:
+    """迁移主索引中全部仍为独立文件的文档"""
+    documents = document_manager.list_documents()
+    migrated = 0
+    start = time.time()
+    for doc in documents:
+        if document_manager.migrate_document_to_shard(doc['id'], shard_count):
+            migrated += 1
+            print(f"  ✓ {doc['id']}: {doc['title']}")
+    return {'documents': len(documents), 'migrated': migrated, 'seconds': time.time() - start}
+
+
+def migrate_legacy():
+    """将旧数据库的文档并入文库"""
+    if not database.legacy_database_exists():
+        print(f"旧数据库不存在: {database.DATABASE_PATH}")
+        return
+
+    def progress(doc, doc_id, duplicate):
+        mark = '=' if duplicate else '✓'
+        print(f"  {mark} {doc['id']} → {doc_id}: {doc['title']}")
+
+    print("=" * 50)
+    print("Project Komachi - 旧数据库并入文库")
+    print("=" * 50)
+    stats = database.migrate_to_library(progress)
+    print()
+    print("=" * 50)
+    print(f"✓ 并入完成: {stats['migrated']} 个文档，重复 {stats['duplicates']} 个"
+          f"（共 {stats['documents']}），耗时 {stats['seconds']:.1f} 秒")
+    size = os.path.getsize(stats['backup']) if stats['backup'] else 0
+    print(f"  - 旧数据库已改名保留: {stats['backup']} ({size / 1024 / 1024:.1f} MiB，确认后可删除)")
+    print("=" * 50)
+
+
+def recompress(method: str):
+    """按指定压缩方式重写全部文档数据库"""
+    document_manager.configure_storage(compression_method=method)
+    print("=" * 50)
+    print(f"Project Komachi - 重写压缩方式: {document_manager.COMPRESSION}")
+    print("=" * 50)
+
+    def progress(path, before, after):
+        print(f"  ✓ {os.path.basename(path)}: {before / 1024 / 1024:.1f} → {after / 1024 / 1024:.1f} MiB")
+
+    start = time.time()
+    stats = document_manager.recompress_storage(progress)
+    print()
+    print("=" * 50)
+    print(f"✓ 重写完成: {stats['databases']} 个数据库，耗时 {time.time() - start:.1f} 秒")
+    print(f"  - {stats['before'] / 1024 / 1024:.1f} MiB → {stats['after'] / 1024 / 1024:.1f} MiB")
+    print(f"  新文档也要以此方式保存时，请以 KOMACHI_COMPRESSION={document_manager.COMPRESSION} 启动应用")
+    print("=" * 50)
+
+
+def backfill():
+    """为已有文档补建新增的索引"""
+    print("=" * 50)
+    print(f"Project Komachi - 补建索引: {document_manager.backfill_pending()} 个文档")
+    print("=" * 50)
+
+    def progress(doc_id, names):
+        print(f"  ✓ {doc_id}: {', '.join(names)}")
+
+    stats = document_manager.backfill_indexes(progress)
+    print()
+    print("=" * 50)
+    print(f"✓ 补建完成: {stats['documents']} 个文档，耗时 {stats['seconds']:.1f} 秒")
+    print("=" * 50)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Project Komachi 存储迁移（独立文件 → 分片）')
+    parser.add_argument('--shards', type=int, default=document_manager.SHARD_COUNT, help='分片数')
+    parser.add_argument('--legacy', action='store_true', help='将旧数据库 data/komachi.db 并入文库')
+    parser.add_argument('--compression', choices=compression.METHODS + ('auto',),
+                        help='按此压缩方式重写已有文档的原文、段落文本和词素特征')
+    parser.add_argument('--backfill', action='store_true', help='为旧版本文库的已有文档补建新增的索引')
+    args = parser.parse_args()
+    if args.shards < 1:
+        parser.error("分片数必须大于 0")
+    if args.legacy:
+        migrate_legacy()
+        return
+    if args.backfill:
+        backfill()
+        return
+    if args.compression:
+        try:
+            compression.resolve_method(args.compression)
+        except ValueError as e:
+            parser.error(str(e))
+        recompress(args.compression)
+        return
+
+    print("=" * 50)
+    print("Project Komachi - 存储迁移")
+    print("=" * 50)
+    before = [directory_usage(document_manager.DOCUMENTS_DIR), directory_usage(document_manager.SHARDS_DIR)]
+    stats = migrate_to_shards(args.shards)
+    after = [directory_usage(document_manager.DOCUMENTS_DIR), directory_usage(document_manager.SHARDS_DIR)]
+
+    print()
+    print("=" * 50)
+    print(f"✓ 迁移完成: {stats['migrated']} 个文档（共 {stats['documents']}），耗时 {stats['seconds']:.1f} 秒")
+    for label, (files, size) in (('迁移前', map(sum, zip(*before))), ('迁移后', map(sum, zip(*after)))):
+        print(f"  - {label}: {files} 个文件, {size / 1024 / 1024:.1f} MiB")
+    if document_manager.STORAGE_BACKEND != 'shards':
+        print("  新文档也要存入分片时，请以 KOMACHI_STORAGE=shards 启动应用")
+    print("=" * 50)
+
+
+if __name__ == '__main__':
+    main()
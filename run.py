@@ -10,7 +10,7 @@ from threading import Timer
 # プロジェクトパスを追加
 sys.path.insert(0, os.path.dirname(__file__))
 
-from app.app import app
+from app.app import app, start_warm_up, start_job_workers
 
 def open_browser():
     """ブラウザを開く"""
@@ -31,5 +31,11 @@ if __name__ == '__main__':
     # 2秒後に自動的にブラウザを開く
     Timer(2, open_browser).start()
     
+    # KOMACHI_WARMUP で指定された辞書を起動後にバックグラウンドで読み込む
+    start_warm_up('127.0.0.1', 5000)
+    
+    # インポートジョブを処理するワーカープロセスを起動（KOMACHI_JOB_WORKERS 個）
+    start_job_workers()
+    
     # Flaskアプリを起動
     app.run(host='127.0.0.1', port=5000, debug=False)
@@ -0,0 +1,162 @@
+"""
+圧縮保存のベンチマーク - 圧縮方式ごとの文書データベースのサイズと読み込み時間を比較
+実行: python test/bench_compression.py [テキストファイル/ディレクトリ ...] [--dictionary 辞書名]
+                                       [--storage files|shards] [--runs N]
+
+テキスト（ディレクトリは中の .txt を1ファイル1文書として）を一度だけ解析し、
+圧縮方式（none / zlib / zstandard があれば zstd）ごとに一時ディレクトリへ保存して、
+書き込み時間、データベースの合計サイズと表ごとの内訳、読み込み時間を計測する。
+読み込みは get_document（全文書）、原文（Document.content）、ランダムな1段落の本文。
+テキストを指定しない時はサンプルテキストを使う。
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app import analyzer, compression, connections, document_manager, textfile
+from bench_ingest import SAMPLE_TEXT, use_data_dir
+
+# サイズの内訳に表示する表（索引を含む）
+SIZE_GROUPS = {
+    'text': ('content', 'passages'),
+    'features': ('lexemes', 'sqlite_autoindex_lexemes_1'),
+}
+PARAGRAPH_READS = 2000
+
+
+def load_texts(paths):
+    """(タイトル, 本文) のリスト"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(os.path.join(path, name) for name in os.listdir(path) if textfile.is_text_file(name))
+        else:
+            files.append(path)
+    texts = []
+    for path in files:
+        with open(path, 'rb') as f:
+            text = textfile.decode_text(f.read())
+        if text and text.strip():
+            texts.append((os.path.basename(path), text.strip()))
+    return texts
+
+
+def database_paths():
+    return [os.path.join(directory, name)
+            for directory in (document_manager.DOCUMENTS_DIR, document_manager.SHARDS_DIR)
+            if os.path.isdir(directory)
+            for name in os.listdir(directory) if name.endswith('.db')]
+
+
+def table_sizes(paths):
+    """表ごとのページ数から求めたバイト数（dbstat がない SQLite では空）"""
+    sizes = {}
+    for path in paths:
+        conn = sqlite3.connect(path)
+        try:
+            for name, size in conn.execute('SELECT name, SUM(pgsize) FROM dbstat GROUP BY name'):
+                sizes[name] = sizes.get(name, 0) + size
+        except sqlite3.OperationalError:
+            return {}
+        finally:
+            conn.close()
+    return sizes
+
+
+def timed(function, runs):
+    """runs 回実行した所要時間の中央値"""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def read_paragraphs(locations):
+    """指定した (db_filename, 文書キー, 段落序号) の段落本文を1段落ずつ読む"""
+    for db_filename, doc_key, para_idx in locations:
+        conn = document_manager.open_document_db(db_filename)
+        try:
+            row = conn.execute('''
+                SELECT ps.content FROM paragraphs p JOIN passages ps ON ps.id = p.passage_id
+                WHERE p.document_id = ? AND p.layer = 0 AND p.paragraph_index = ?
+            ''', (doc_key, para_idx)).fetchone()
+            document_manager._unpacker(conn)(row[0])
+        finally:
+            conn.close()
+
+
+def run(method, documents, dictionary, storage, runs):
+    with tempfile.TemporaryDirectory() as tmp:
+        use_data_dir(tmp)
+        document_manager.configure_storage(storage, compression_method=method)
+
+        start = time.perf_counter()
+        doc_ids = [document_manager.save_document(title, text, dictionary, paragraphs)
+                   for title, text, paragraphs in documents]
+        save = time.perf_counter() - start
+
+        paths = database_paths()
+        size = sum(os.path.getsize(path) for path in paths)
+        tables = table_sizes(paths)
+
+        opened = [document_manager.open_document(doc_id) for doc_id in doc_ids]
+        rng = random.Random(0)
+        locations = []
+        for _ in range(PARAGRAPH_READS):
+            doc = rng.choice(opened)
+            count = doc.info['paragraph_count']
+            if count:
+                locations.append((doc.info['db_filename'], doc.doc_key, rng.randrange(count)))
+
+        load = timed(lambda: [document_manager.get_document(doc_id) for doc_id in doc_ids], runs)
+        content = timed(lambda: [doc.content for doc in opened], runs)
+        paragraph = timed(lambda: read_paragraphs(locations), runs)
+        connections.configure()
+
+    result = {'method': method, 'save': save, 'size': size,
+              'load': load / len(doc_ids), 'content': content / len(doc_ids),
+              'paragraph': paragraph / max(1, len(locations))}
+    for group, names in SIZE_GROUPS.items():
+        result[group] = sum(tables.get(name, 0) for name in names) if tables else None
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='圧縮方式ごとのサイズと読み込み時間')
+    parser.add_argument('paths', nargs='*', help='テキストファイルまたはディレクトリ')
+    parser.add_argument('--dictionary', default='unidic-chuko')
+    parser.add_argument('--storage', choices=document_manager.STORAGE_BACKENDS, default='files')
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    texts = load_texts(args.paths) if args.paths else [
+        (f'sample{i}', '\n\n'.join(f'{SAMPLE_TEXT}（{i}-{j}）' for j in range(200))) for i in range(10)]
+    documents = [(title, text, analyzer.analyze_text(text, args.dictionary, use_cache=False))
+                 for title, text in texts]
+    token_count = sum(len(p['tokens']) for _, _, paragraphs in documents for p in paragraphs)
+    paragraph_count = sum(len(paragraphs) for _, _, paragraphs in documents)
+    methods = [m for m in compression.METHODS if m != 'zstd' or compression.zstandard is not None]
+
+    results = [run(method, documents, args.dictionary, args.storage, args.runs) for method in methods]
+
+    print(f"{len(documents)} 文書 / {paragraph_count} 段落 / {token_count} トークン"
+          f"  storage={args.storage}  (読み込みは中央値)")
+    print(f"  {'方式':<6}{'保存 秒':>8}{'サイズ MiB':>12}{'本文 MiB':>10}{'素性 MiB':>10}"
+          f"{'文書 ms':>10}{'原文 ms':>10}{'段落 µs':>10}")
+    mib = lambda n: '-' if n is None else f'{n / 1024 / 1024:.2f}'
+    for r in results:
+        print(f"  {r['method']:<6}{r['save']:>9.2f}{mib(r['size']):>13}{mib(r['text']):>11}{mib(r['features']):>11}"
+              f"{r['load'] * 1000:>11.2f}{r['content'] * 1000:>11.3f}{r['paragraph'] * 1e6:>11.1f}")
+
+
+if __name__ == '__main__':
+    main()
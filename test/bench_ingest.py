@@ -0,0 +1,113 @@
+"""
+保存処理のベンチマーク - 解析済みドキュメントの書き込み・読み込み時間とファイルサイズを計測
+実行: python test/bench_ingest.py [--tokens N] [--runs N] [--dictionary 辞書名] [--overlap 割合]
+
+サンプルテキストを一度だけ解析し、その段落を繰り返して約 N トークンの
+ドキュメントを作る（段落テキストは連番で区別し、全て別の段落として保存される）。
+一時ディレクトリ上で document_manager.save_document の書き込み時間（解析時間は含まない）、
+get_document での読み込み時間と文書データベースのサイズを計測する（文書ごとの独立ファイルに保存する）。
+
+--overlap を指定すると、各ドキュメントの段落のうちその割合を全ドキュメント共通にし、
+全ドキュメントを1つのデータベース（分片1つ）に保存したまま、1文書ごとの書き込み時間と
+データベースの増加量を計測する（共通の段落は最初の文書でのみ保存される）。
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app import analyzer, connections, document_manager
+
+SAMPLE_TEXT = ("行く川のながれは絶えずして、しかも本の水にあらず。"
+               "淀みに浮かぶうたかたは、かつ消えかつ結びて、久しくとどまりたるためしなし。"
+               "世の中にある人とすみかと、またかくのごとし。")
+
+
+def analyze_sample(dictionary):
+    """サンプルテキストを解析した段落"""
+    return analyzer.analyze_text(SAMPLE_TEXT, dictionary)[0]
+
+
+def build_paragraphs(sample, target_tokens, overlap, run):
+    """
+    サンプル段落を繰り返して約 target_tokens トークンの段落リストを作る
+    先頭の overlap の割合の段落は全ての run で同じテキスト、残りは run ごとに異なるテキストにする
+    """
+    repeat = max(1, target_tokens // len(sample['tokens']))
+    shared = int(repeat * overlap)
+    return [dict(sample, content=f"{sample['content']}#{i}" if i < shared
+                 else f"{sample['content']}#{run}-{i}")
+            for i in range(repeat)]
+
+
+def use_data_dir(path):
+    """保存先を一時ディレクトリに切り替える"""
+    document_manager.DATA_DIR = path
+    document_manager.DOCUMENTS_DIR = os.path.join(path, 'documents')
+    document_manager.SHARDS_DIR = os.path.join(path, 'shards')
+    document_manager.REGISTRY_PATH = os.path.join(path, 'registry.db')
+    document_manager._registry_initialized = False
+
+
+def db_size(db_path):
+    """データベースファイルのサイズ（書き込みはチェックポイント済みなので WAL は含めない）"""
+    return os.path.getsize(db_path) if os.path.exists(db_path) else 0
+
+
+def run_once(paragraphs, dictionary, run, keep):
+    content = f'bench_ingest {run} {time.time_ns()}'
+    shard_path = os.path.join(document_manager.SHARDS_DIR, document_manager.SHARD_FILENAME.format(0))
+    before = db_size(shard_path)
+    start = time.perf_counter()
+    doc_id = document_manager.save_document('bench_ingest', content, dictionary, paragraphs)
+    library = time.perf_counter() - start
+
+    start = time.perf_counter()
+    document_manager.get_document(doc_id)
+    load = time.perf_counter() - start
+    db_path = document_manager.open_document(doc_id).db_path
+    size = db_size(db_path) - (before if db_path == shard_path else 0)
+
+    if not keep:
+        document_manager.delete_document(doc_id)
+    return {'library': library, 'load': load, 'size': size}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Project Komachi 保存処理ベンチマーク')
+    parser.add_argument('--tokens', type=int, default=100000)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--dictionary', default='unidic-chuko')
+    parser.add_argument('--overlap', type=float, default=None,
+                        help='全ドキュメント共通の段落の割合（0〜1、指定時は1つのデータベースに保存し続ける）')
+    args = parser.parse_args()
+
+    sample = analyze_sample(args.dictionary)
+    overlap = args.overlap or 0.0
+    runs = [build_paragraphs(sample, args.tokens, overlap, run) for run in range(args.runs)]
+    token_count = sum(len(p['tokens']) for p in runs[0])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        use_data_dir(tmp)
+        keep = args.overlap is not None
+        document_manager.configure_storage('shards' if keep else 'files', 1)
+        results = [run_once(paragraphs, args.dictionary, run, keep) for run, paragraphs in enumerate(runs)]
+        connections.configure()
+
+    print(f"{len(runs[0])} 段落 / {token_count} トークン  runs={args.runs}"
+          f"{f'  overlap={overlap:.0%}' if keep else ''}  (中央値, 秒)")
+    for key in ('library', 'load'):
+        values = [r[key] for r in results]
+        median = statistics.median(values)
+        print(f"  {key:<8} {median:.3f}  ({token_count / median:,.0f} トークン/秒, "
+              f"min {min(values):.3f}, max {max(values):.3f})")
+    size = statistics.median(r['size'] for r in results)
+    print(f"  db size  {size / 1024 / 1024:.1f} MiB  ({size / token_count:.0f} バイト/トークン)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+起動時間のベンチマーク - サーバープロセスの起動から最初の応答・最初の解析までを計測
+実行: python test/bench_startup.py [--runs N] [--warmup 辞書名,...] [--dictionary 辞書名]
+
+計測項目:
+  first_response : プロセス起動から /api/dictionaries が応答するまで
+  first_page     : 続けて / （ホーム、DB初期化を含む）が応答するまで
+  first_analysis : 続けて /api/analyze が応答するまで（辞書の読み込みを含む）
+  analysis_call  : 最初の /api/analyze リクエスト自体の所要時間
+解析で作成したドキュメントは計測後に削除する。
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+PROJECT_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def request(url, data=None, method=None):
+    body = json.dumps(data).encode('utf-8') if data is not None else None
+    req = urllib.request.Request(url, data=body, method=method,
+                                 headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(req, timeout=120) as resp:
+        return json.loads(resp.read().decode('utf-8'))
+
+
+def run_once(warmup, dictionary):
+    port = free_port()
+    base = f'http://127.0.0.1:{port}'
+    env = dict(os.environ, KOMACHI_WARMUP=warmup)
+    code = ('from app.app import app, start_warm_up; '
+            f'start_warm_up("127.0.0.1", {port}); '
+            f'app.run(host="127.0.0.1", port={port})')
+
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, '-c', code], cwd=PROJECT_ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            try:
+                request(f'{base}/api/dictionaries')
+                break
+            except (urllib.error.URLError, ConnectionError):
+                if proc.poll() is not None:
+                    raise RuntimeError('サーバーの起動に失敗しました')
+                time.sleep(0.01)
+        first_response = time.perf_counter() - start
+
+        urllib.request.urlopen(f'{base}/', timeout=120).read()
+        first_page = time.perf_counter() - start
+
+        # 段落キャッシュや既存の解析結果に当たらないよう毎回異なるテキストを使う
+        text = f'行く川のながれは絶えずして、しかも本の水にあらず。{time.time_ns()}'
+        call_start = time.perf_counter()
+        result = request(f'{base}/api/analyze',
+                         {'text': text, 'title': 'bench_startup', 'dictionary': dictionary})
+        analysis_call = time.perf_counter() - call_start
+        first_analysis = time.perf_counter() - start
+
+        if result.get('document'):
+            request(f"{base}/api/documents/{result['document']['id']}", method='DELETE')
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    return {
+        'first_response': first_response,
+        'first_page': first_page,
+        'first_analysis': first_analysis,
+        'analysis_call': analysis_call,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Project Komachi 起動時間ベンチマーク')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--warmup', default='', help='KOMACHI_WARMUP に渡す辞書（カンマ区切り）')
+    parser.add_argument('--dictionary', default='unidic-chuko')
+    args = parser.parse_args()
+
+    results = [run_once(args.warmup, args.dictionary) for _ in range(args.runs)]
+
+    print(f"warmup={args.warmup or '(なし)'}  runs={args.runs}  (中央値, 秒)")
+    for key in ('first_response', 'first_page', 'first_analysis', 'analysis_call'):
+        values = [r[key] for r in results]
+        print(f"  {key:<15} {statistics.median(values):.3f}  (min {min(values):.3f}, max {max(values):.3f})")
+
+
+if __name__ == '__main__':
+    main()
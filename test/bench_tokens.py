@@ -0,0 +1,81 @@
+"""
+トークン表現のベンチマーク - 旧来の辞書形式と Token の比較
+実行: python test/bench_tokens.py [テキストファイル] [辞書名]
+
+テキストを一度だけMeCabで解析し、その特徴リストから両方の形式の
+トークンを構築して、構築時間とメモリ使用量（tracemalloc）を比較する。
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app import analyzer
+from app.tokens import Token, POS_COLORS
+
+SAMPLE_TEXT = "行く川のながれは絶えずして、しかも本の水にあらず。淀みに浮かぶうたかたは、かつ消えかつ結びて、久しくとどまりたるためしなし。"
+
+
+def legacy_token(surface, features):
+    """旧来の analyze_text が作っていた辞書形式のトークン"""
+    return {
+        "surface": surface,
+        "features": list(features),
+        "pos": features[0],
+        "pos_detail": features[1],
+        "conjugation_type": features[4],
+        "conjugation_form": features[5],
+        "reading": features[8],
+        "base_form": features[9],
+        "kana": features[11],
+        "origin": features[12],
+        "taigen_yougen": features[19],
+        "color": POS_COLORS.get(features[0], "#333333")
+    }
+
+
+def measure(build, raw_tokens):
+    """構築時間とメモリ使用量を計測（時間は tracemalloc の影響を避けて別に測る）"""
+    start = time.perf_counter()
+    tokens = [build(surface, features) for surface, features in raw_tokens]
+    elapsed = time.perf_counter() - start
+    del tokens
+
+    tracemalloc.start()
+    tokens = [build(surface, features) for surface, features in raw_tokens]
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return tokens, elapsed, memory
+
+
+def main():
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], encoding='utf-8') as f:
+            text = f.read()
+    else:
+        text = "\n\n".join([SAMPLE_TEXT] * 20000)
+    dictionary = sys.argv[2] if len(sys.argv) > 2 else "unidic-chuko"
+
+    # MeCabの出力は文字列を毎回新しく作るため、特徴リストもトークンごとに別オブジェクトにする
+    tagger = analyzer.get_tagger(dictionary)
+    raw_tokens = [(word.surface, analyzer._extract_features(word))
+                  for para in analyzer.split_paragraphs(text)
+                  for word in tagger(para)]
+    print(f"トークン数: {len(raw_tokens):,}")
+
+    results = {}
+    for name, build in [("dict", legacy_token), ("Token", Token.from_features)]:
+        tokens, elapsed, memory = measure(build, raw_tokens)
+        results[name] = (elapsed, memory)
+        print(f"{name:>6}: {elapsed:.3f} 秒, {memory / 1024 / 1024:.1f} MiB")
+        del tokens
+
+    dict_time, dict_memory = results["dict"]
+    token_time, token_memory = results["Token"]
+    print(f"メモリ: {dict_memory / token_memory:.1f} 倍削減, 時間: {dict_time / token_time:.2f} 倍")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,301 @@
+"""
+パターン検索の検証 - ランダムなパターンをパーサ・NFA・候補位置の絞り込みと総当たりで照合する
+実行: python test/check_patterns.py [--patterns N] [--seed N] [--dictionary 辞書名]
+
+サンプルテキストを解析して一時ディレクトリのライブラリに保存し、その語彙からランダムな構文木を
+作ってパターン文字列に書き出す。各パターンについて次を確かめる（不一致があれば終了コード 1）。
+  - パーサ: パターン文字列を解析した構文木が元の構文木と一致する
+  - NFA: Pattern.finditer の一致が、構文木を直接たどる総当たりの最短一致と一致する
+  - 絞り込み: iter_pattern_matches（必須トークンと _anchors の距離で開始位置を絞る）の一致が
+    全段落・全位置の総当たりと一致する（範囲は段落と文の両方）
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app import analyzer, connections, corpus, document_manager
+from app.tokens import sentence_spans
+
+# 文書ごとのサンプル（段落は空行区切り）
+SAMPLE_TEXTS = [
+    "今は昔、竹取の翁といふ者ありけり。野山にまじりて竹を取りつつ、よろづのことに使ひけり。"
+    "名をば、さぬきの造となむいひける。\n\n"
+    "その竹の中に、もと光る竹なむ一筋ありける。あやしがりて寄りて見るに、筒の中光りたり。"
+    "それを見れば、三寸ばかりなる人、いとうつくしうてゐたり。",
+    "昔、男ありけり。その男、身をえうなきものに思ひなして、京にはあらじ、あづまの方に住むべき国求めにとて行きけり。\n\n"
+    "春はあけぼの。やうやう白くなりゆく山ぎは、すこしあかりて、紫だちたる雲の細くたなびきたる。\n\n"
+    "行く川のながれは絶えずして、しかも本の水にあらず。淀みに浮かぶうたかたは、かつ消えかつ結びて、"
+    "久しくとどまりたるためしなし。",
+]
+
+FIELDS = ('surface',) + tuple(document_manager.INDEX_FIELDS)
+MISSING = '存在しない値'
+
+
+def use_data_dir(path):
+    """保存先を一時ディレクトリに切り替える"""
+    document_manager.DATA_DIR = path
+    document_manager.DOCUMENTS_DIR = os.path.join(path, 'documents')
+    document_manager.SHARDS_DIR = os.path.join(path, 'shards')
+    document_manager.REGISTRY_PATH = os.path.join(path, 'registry.db')
+    document_manager._registry_initialized = False
+
+
+def build_library(dictionary):
+    """サンプルを保存し、文書ID -> 段落のトークン列のリストを返す"""
+    documents = {}
+    for i, text in enumerate(SAMPLE_TEXTS):
+        paragraphs = analyzer.analyze_text(text, dictionary)
+        doc_id = document_manager.save_document(f'sample{i}', text, dictionary, paragraphs)
+        documents[doc_id] = [para['tokens'] for para in paragraphs]
+    return documents
+
+
+def collect_vocabulary(documents):
+    """キー名 -> サンプルに現れる値のリスト（パターンの値に使う）"""
+    values = {field: set() for field in FIELDS}
+    for paragraphs in documents.values():
+        for tokens in paragraphs:
+            for token in tokens:
+                values['surface'].add(token.surface)
+                for field, value in document_manager.lexeme_keys(token.features):
+                    values[field].add(value)
+    return {field: sorted(values[field]) for field in FIELDS if values[field]}
+
+
+# ===== ランダムな構文木と書き出し =====
+
+def random_condition(rng, vocabulary, depth=0):
+    """ランダムなトークン条件（構文木は corpus._PatternParser と同じ形）"""
+    roll = rng.random()
+    if depth >= 2 or roll < 0.65:
+        field = rng.choice(list(vocabulary))
+        value = MISSING if rng.random() < 0.03 else rng.choice(vocabulary[field])
+        return ('ne' if rng.random() < 0.15 else 'eq', field, value)
+    if roll < 0.75:
+        return ('not', random_condition(rng, vocabulary, depth + 1))
+    return (rng.choice(('and', 'or')), [random_condition(rng, vocabulary, depth + 1)
+                                        for _ in range(rng.randint(2, 3))])
+
+
+def random_node(rng, vocabulary, depth=0):
+    """ランダムな構文木（繰り返しの上限は小さく抑える）"""
+    roll = rng.random()
+    if depth >= 3 or roll < 0.45:
+        if rng.random() < 0.15:
+            return ('token', None)
+        return ('token', random_condition(rng, vocabulary))
+    if roll < 0.7:
+        return ('seq', [random_node(rng, vocabulary, depth + 1) for _ in range(rng.randint(2, 3))])
+    if roll < 0.85:
+        return ('alt', [random_node(rng, vocabulary, depth + 1) for _ in range(2)])
+    minimum = rng.randint(0, 2)
+    maximum = rng.choice((minimum, minimum + 1, minimum + 2, None))
+    return ('repeat', random_node(rng, vocabulary, depth + 1), minimum, maximum)
+
+
+def quote(value):
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def render_condition(condition):
+    kind = condition[0]
+    if kind in ('eq', 'ne'):
+        _, field, value = condition
+        return f"{field}{'=' if kind == 'eq' else '!='}{quote(value)}"
+    if kind == 'not':
+        return '!' + render_term(condition[1])
+    separator = ' & ' if kind == 'and' else ' | '
+    return separator.join(render_term(part) for part in condition[1])
+
+
+def render_term(condition):
+    """& や | の項として書き出す（複合条件は括弧で囲む）"""
+    text = render_condition(condition)
+    return f'({text})' if condition[0] in ('and', 'or') else text
+
+
+def render_item(node, rng):
+    """繰り返しの対象や列の要素として書き出す（トークン以外は括弧で囲む）"""
+    text = render(node, rng)
+    return text if node[0] == 'token' else f'({text})'
+
+
+def render(node, rng):
+    kind = node[0]
+    if kind == 'token':
+        condition = node[1]
+        if condition is None:
+            return '[]'
+        if condition[:2] == ('eq', 'surface') and rng.random() < 0.5:
+            return quote(condition[2])
+        return f'[{render_condition(condition)}]'
+    if kind == 'seq':
+        return ' '.join(render_item(child, rng) for child in node[1])
+    if kind == 'alt':
+        return ' | '.join(render_item(child, rng) if child[0] == 'alt' else render(child, rng)
+                          for child in node[1])
+    _, child, minimum, maximum = node
+    if (minimum, maximum) == (0, 1):
+        suffix = '?'
+    elif (minimum, maximum) == (0, None):
+        suffix = '*'
+    elif (minimum, maximum) == (1, None):
+        suffix = '+'
+    elif maximum is None:
+        suffix = f'{{{minimum},}}'
+    elif maximum == minimum:
+        suffix = f'{{{minimum}}}'
+    else:
+        suffix = f'{{{minimum},{maximum}}}'
+    return render_item(child, rng) + suffix
+
+
+# ===== 総当たり =====
+
+def test_condition(condition, token):
+    """トークン条件を直接評価する"""
+    if condition is None:
+        return True
+    kind = condition[0]
+    if kind in ('eq', 'ne'):
+        _, field, value = condition
+        if field == 'surface':
+            result = token.surface == value
+        else:
+            result = (field, value) in set(document_manager.lexeme_keys(token.features))
+        return result if kind == 'eq' else not result
+    if kind == 'not':
+        return not test_condition(condition[1], token)
+    results = [test_condition(part, token) for part in condition[1]]
+    return all(results) if kind == 'and' else any(results)
+
+
+def ends(node, tokens, position):
+    """tokens[position:] で node が一致しうる終了位置の集合"""
+    kind = node[0]
+    if kind == 'token':
+        if position < len(tokens) and test_condition(node[1], tokens[position]):
+            return {position + 1}
+        return set()
+    if kind == 'seq':
+        current = {position}
+        for child in node[1]:
+            current = {end for start in current for end in ends(child, tokens, start)}
+        return current
+    if kind == 'alt':
+        return {end for child in node[1] for end in ends(child, tokens, position)}
+    _, child, minimum, maximum = node
+    result = {position} if minimum == 0 else set()
+    current = {position}
+    count = 0
+    while current and (maximum is None or count < maximum):
+        current = {end for start in current for end in ends(child, tokens, start)}
+        count += 1
+        if count >= minimum:
+            if maximum is None:
+                # 上限なし: 新しく届いた位置からだけ続ければよい
+                current -= result
+            result |= current
+    return result
+
+
+def brute_force(tree, tokens):
+    """各開始位置からの最短一致（1トークン以上）"""
+    matches = []
+    for start in range(len(tokens)):
+        found = [end for end in ends(tree, tokens, start) if end > start]
+        if found:
+            matches.append((start, min(found)))
+    return matches
+
+
+def expected_matches(tree, documents, within):
+    """全文書・全段落の総当たりの一致 (文書ID, 段落番号, 開始, 終了)"""
+    matches = []
+    for doc_id in sorted(documents):
+        for para_idx, tokens in enumerate(documents[doc_id]):
+            spans = sentence_spans(tokens) if within == 'sentence' else [(0, len(tokens))]
+            for span_start, span_end in spans:
+                for start, end in brute_force(tree, tokens[span_start:span_end]):
+                    matches.append((doc_id, para_idx, start + span_start, end + span_start))
+    return matches
+
+
+def check(text, tree, documents):
+    """1つのパターンを照合し、不一致の説明のリストを返す"""
+    problems = []
+    parsed = corpus._PatternParser(text).parse()
+    if parsed != tree:
+        return [f'構文木が異なる: {parsed!r} != {tree!r}']
+    pattern = corpus.compile_pattern(text)
+    for doc_id in sorted(documents):
+        for para_idx, tokens in enumerate(documents[doc_id]):
+            found = list(pattern.finditer(tokens))
+            expected = brute_force(tree, tokens)
+            if found != expected:
+                problems.append(f'NFA: 文書 {doc_id} 段落 {para_idx}: {found} != {expected}')
+    for within in corpus.PATTERN_SCOPES:
+        found = [(match['document_id'], match['paragraph_index'], match['start'], match['end'])
+                 for match in corpus.iter_pattern_matches(pattern, within=within)]
+        expected = expected_matches(tree, documents, within)
+        if found != expected:
+            missing = sorted(set(expected) - set(found))[:5]
+            extra = sorted(set(found) - set(expected))[:5]
+            problems.append(f'絞り込み（{within}）: 不足 {missing} 余分 {extra}')
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description='パターン検索の検証')
+    parser.add_argument('--patterns', type=int, default=500, help='ランダムなパターンの数')
+    parser.add_argument('--seed', type=int, default=0, help='乱数の種')
+    parser.add_argument('--dictionary', default='unidic-chuko', help='解析に使う辞書')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        use_data_dir(tmp)
+        documents = build_library(args.dictionary)
+        vocabulary = collect_vocabulary(documents)
+        rng = random.Random(args.seed)
+        failures = 0
+        anchored = 0
+        matched = 0
+        start = time.perf_counter()
+        for _ in range(args.patterns):
+            tree = random_node(rng, vocabulary)
+            text = render(tree, rng)
+            try:
+                problems = check(text, tree, documents)
+            except corpus.PatternSyntaxError as e:
+                problems = [f'構文エラー: {e}']
+            if problems:
+                failures += 1
+                print(f"✗ {text}")
+                for problem in problems:
+                    print(f"    {problem}")
+                continue
+            anchored += bool(corpus.compile_pattern(text).anchors)
+            matched += bool(expected_matches(tree, documents, 'paragraph'))
+        seconds = time.perf_counter() - start
+        connections.configure()
+
+    # 表層形だけのパターン（省略形を含む）にも必須トークンがある
+    for text in ('"けり"', '[surface="竹"] []{0,3} "けり"', '("なむ" | "ぞ") []* "ける"'):
+        if not corpus.compile_pattern(text).anchors:
+            failures += 1
+            print(f"✗ {text}: 必須トークンがない")
+
+    print("=" * 50)
+    print(f"パターン {args.patterns} 個（必須トークンあり {anchored}、一致あり {matched}）"
+          f" 不一致 {failures} 個, {seconds:.1f}秒")
+    print("=" * 50)
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -11,6 +11,7 @@ import sqlite3
 import json
 import os
 import sys
+import textwrap
 from pathlib import Path
 
 # 路径配置
@@ -20,64 +21,61 @@ MAIN_DATA_DIR = os.path.join(PROJECT_ROOT, "data")
 OUTPUT_DIR = os.path.join(SCRIPT_DIR, "data")
 OUTPUT_DOC_DIR = os.path.join(OUTPUT_DIR, "documents")
 
+sys.path.insert(0, PROJECT_ROOT)
+from app.document_manager import open_document
+
 
 def get_registry_path():
     """获取主应用注册表路径"""
     return os.path.join(MAIN_DATA_DIR, "registry.db")
 
 
-def get_document_db_path(db_filename):
-    """获取文档数据库路径"""
-    return os.path.join(MAIN_DATA_DIR, "documents", db_filename)
-
-
 def export_document(doc_info):
-    """导出单个文档的完整数据"""
-    db_path = get_document_db_path(doc_info['db_filename'])
+    """打开单个文档（惰性加载，段落在写出时逐段读取）"""
+    document = open_document(doc_info['id'])
     
-    if not os.path.exists(db_path):
-        print(f"  ⚠ 警告: 数据库文件不存在: {db_path}")
+    if not document or not document.exists():
+        print(f"  ⚠ 警告: 数据库文件不存在: {doc_info['db_filename']}")
         return None
     
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    # 获取原文
-    cursor.execute('SELECT original_text FROM content WHERE id = 1')
-    content_row = cursor.fetchone()
-    content = content_row['original_text'] if content_row else ''
-    
-    # 获取段落和词元
-    paragraphs = []
-    cursor.execute('SELECT * FROM paragraphs ORDER BY paragraph_index')
-    
-    for para_row in cursor.fetchall():
-        paragraph = {
-            'index': para_row['paragraph_index'],
-            'content': para_row['content'],
-            'tokens': []
+    # 旧结构的数据库在首次打开时会先升级（补全文境界索引）
+    return document
+
+
+def iter_paragraph_data(document):
+    """逐段转换为导出格式（主辞书层）"""
+    for para in document.iter_paragraphs():
+        yield {
+            'index': para['paragraph_index'],
+            'content': para['content'],
+            'tokens': [token.to_dict() for token in para['tokens']],
+            'sentences': para['sentences'],
+            'clauses': para['clauses']
         }
-        
-        cursor.execute(
-            'SELECT * FROM tokens WHERE paragraph_id = ? ORDER BY token_index',
-            (para_row['id'],)
-        )
-        for token_row in cursor.fetchall():
-            token = {
-                'surface': token_row['surface'],
-                'features': json.loads(token_row['features'])
-            }
-            paragraph['tokens'].append(token)
-        
-        paragraphs.append(paragraph)
-    
-    conn.close()
-    
-    return {
-        'content': content,
-        'paragraphs': paragraphs
-    }
+
+
+def _indented_json(value, level):
+    """json.dump(indent=2) 中第 level 层的值的写法（首行不缩进）"""
+    text = json.dumps(value, ensure_ascii=False, indent=2)
+    return textwrap.indent(text, '  ' * level)[2 * level:]
+
+
+def dump_json_stream(f, head, key, items):
+    """
+    写出 head 加上列表 key 的JSON对象，输出与 json.dump(..., indent=2) 相同，
+    但列表逐项写入，无需整个列表驻留内存
+    """
+    f.write('{\n')
+    for name, value in head.items():
+        f.write(f'  {json.dumps(name, ensure_ascii=False)}: {_indented_json(value, 1)},\n')
+    f.write(f'  {json.dumps(key, ensure_ascii=False)}: [')
+    first = True
+    for item in items:
+        f.write('\n    ' if first else ',\n    ')
+        f.write(_indented_json(item, 2))
+        first = False
+    f.write(']' if first else '\n  ]')
+    f.write('\n}')
 
 
 def export_all():
@@ -125,10 +123,10 @@ def export_all():
         metadata = {r['key']: r['value'] for r in cursor.fetchall()}
         
         # 导出文档详细数据
-        doc_data = export_document(doc_info)
-        if doc_data:
-            # 合并所有信息
-            full_doc = {
+        document = export_document(doc_info)
+        if document:
+            # 合并所有信息（段落逐段写出）
+            head = {
                 'id': doc_id,
                 'title': row['title'],
                 'dictionary': row['dictionary'],
@@ -136,14 +134,13 @@ def export_all():
                 'token_count': row['token_count'],
                 'tags': tags,
                 'metadata': metadata,
-                'content': doc_data['content'],
-                'paragraphs': doc_data['paragraphs']
+                'content': document.content
             }
             
             # 保存单个文档 JSON
             doc_path = os.path.join(OUTPUT_DOC_DIR, f"{doc_id}.json")
             with open(doc_path, 'w', encoding='utf-8') as f:
-                json.dump(full_doc, f, ensure_ascii=False, indent=2)
+                dump_json_stream(f, head, 'paragraphs', iter_paragraph_data(document))
             
             # 添加到索引（不包含 content 和 paragraphs）
             documents.append({
@@ -6,6 +6,9 @@
     let currentDoc = null;
     let currentToken = null;
     let colorsEnabled = false;
+    // 各段落的词元元素与句索引（词元序号 → 句序号）
+    let paragraphViews = [];
+    let highlightedTokens = [];
     
     // DOM 元素
     const elements = {
@@ -108,6 +111,13 @@
                 <div class="paragraph-content">${renderTokens(para.tokens, paraIdx)}</div>
             </div>
         `).join('');
+        
+        const contents = elements.resultContainer.querySelectorAll('.paragraph-content');
+        paragraphViews = paragraphs.map((para, paraIdx) => {
+            const tokens = Array.from(contents[paraIdx].querySelectorAll('.token'));
+            const sentences = para.sentences || [];
+            return { tokens, sentences, sentenceOf: buildSpanIndex(sentences, tokens.length) };
+        });
     }
     
     /**
@@ -152,43 +162,32 @@
     }
     
     /**
-     * 高亮句子
+     * 由范围列表 [[开始, 结束), ...] 生成 词元序号 → 句序号 的索引
+     */
+    function buildSpanIndex(spans, tokenCount) {
+        const index = new Int32Array(tokenCount).fill(-1);
+        spans.forEach(([start, end], spanIdx) => index.fill(spanIdx, start, end));
+        return index;
+    }
+    
+    /**
+     * 高亮句子（使用导出数据中预先计算的句边界）
      */
     function highlightSentence(token) {
         // 清除之前的高亮
-        document.querySelectorAll('.token.sentence-highlight').forEach(t => {
-            t.classList.remove('sentence-highlight');
-        });
+        highlightedTokens.forEach(t => t.classList.remove('sentence-highlight'));
+        highlightedTokens = [];
         
-        const paraContent = token.closest('.paragraph-content');
-        if (!paraContent) return;
+        const view = paragraphViews[parseInt(token.dataset.para)];
+        if (!view) return;
         
-        const tokens = Array.from(paraContent.querySelectorAll('.token'));
-        const tokenIndex = tokens.indexOf(token);
-        
-        // 句子结束符
-        const sentenceEnders = ['。', '？', '！', '?', '!'];
-        let start = tokenIndex;
-        let end = tokenIndex;
-        
-        // 找开始
-        for (let i = tokenIndex - 1; i >= 0; i--) {
-            const surface = tokens[i].dataset.surface || tokens[i].textContent;
-            if (sentenceEnders.includes(surface)) break;
-            start = i;
-        }
-        
-        // 找结束
-        for (let i = tokenIndex; i < tokens.length; i++) {
-            end = i;
-            const surface = tokens[i].dataset.surface || tokens[i].textContent;
-            if (sentenceEnders.includes(surface)) break;
-        }
+        const spanIdx = view.sentenceOf[parseInt(token.dataset.token)];
+        if (spanIdx < 0) return;
+        const [start, end] = view.sentences[spanIdx];
         
         // 高亮
-        for (let i = start; i <= end; i++) {
-            tokens[i].classList.add('sentence-highlight');
-        }
+        highlightedTokens = view.tokens.slice(start, end);
+        highlightedTokens.forEach(t => t.classList.add('sentence-highlight'));
     }
     
     /**